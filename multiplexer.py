@@ -15,7 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
-from sitescripts.web import multiplex
+import argparse
+
+from sitescripts.metrics.middleware import instrument
+from sitescripts.prefork import PreforkServer, parse_address
+from sitescripts.web import load_lazy_handler_modules, multiplex
 
 try:
     from werkzeug.serving import run_simple
@@ -27,5 +31,30 @@ except ImportError:
         print ' * Running on http://%s:%i/' % server.server_address
         server.serve_forever()
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve the URL handlers')
+    parser.add_argument('-b', '--bind', default='localhost:5000',
+                        help='Address to listen on, as host:port')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='Number of preforked worker processes, if not '
+                             'given the development server is used')
+    parser.add_argument('--max-requests', type=int, default=1000,
+                        help='Requests after which a worker is replaced')
+    parser.add_argument('--no-preload', action='store_true',
+                        help="Don't import all handler modules before "
+                             'forking the workers')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    run_simple('localhost', 5000, multiplex, use_reloader=True, use_debugger=True)
+    args = parse_args()
+    host, port = parse_address(args.bind)
+    if args.workers > 0:
+        if not args.no_preload:
+            load_lazy_handler_modules()
+        server = PreforkServer(instrument(multiplex), (host, port),
+                               args.workers, args.max_requests)
+        server.serve_forever()
+    else:
+        run_simple(host, port, instrument(multiplex), use_reloader=True, use_debugger=True)
@@ -15,9 +15,11 @@
 
 import re
 import os
+import shutil
 import sys
 from urlparse import parse_qs
 from tempfile import mkstemp
+from sitescripts.requestbody import BodyReader, RequestBodyError, CHUNK_SIZE
 from sitescripts.utils import get_config, setupStderr
 from sitescripts.web import url_handler
 
@@ -39,9 +41,9 @@ def handleRequest(environ, start_response):
         return showError('Unsupported request version', start_response)
 
     try:
-        request_body_size = int(environ.get('CONTENT_LENGTH', 0))
-    except ValueError:
-        return showError('No content', start_response)
+        reader = BodyReader(environ)
+    except RequestBodyError as e:
+        return showError(str(e), start_response)
 
     dir = get_config().get('crashes', 'dataPath')
     if not os.path.exists(dir):
@@ -50,9 +52,8 @@ def handleRequest(environ, start_response):
     filename = None
     try:
         fd, filename = mkstemp('.xml.tmp', 'crash_', dir)
-        file = os.fdopen(fd, 'wb')
-        file.write(environ['wsgi.input'].read(request_body_size))
-        file.close()
+        with os.fdopen(fd, 'wb') as file:
+            shutil.copyfileobj(reader, file, CHUNK_SIZE)
         os.rename(filename, os.path.splitext(filename)[0])
     except Exception as e:
         if filename != None and os.path.isfile(filename):
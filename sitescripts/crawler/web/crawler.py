@@ -1,10 +1,11 @@
 import MySQLdb
 import os
-import re
 import json
 import sys
+from sitescripts.requestbody import iter_multipart
 from sitescripts.utils import cached, get_config
-from sitescripts.web import url_handler, basic_auth
+from sitescripts.web import (url_handler, basic_auth, compress_response,
+                             conditional_get)
 
 
 @cached(600)
@@ -32,10 +33,17 @@ def _fetch_crawlable_sites():
     return sites
 
 
+@cached(60)
+def _get_crawlable_sites():
+    return tuple(_fetch_crawlable_sites())
+
+
 @url_handler('/crawlableSites')
 @basic_auth('crawler')
+@compress_response()
+@conditional_get(lambda environ: _get_crawlable_sites(), 'private, no-cache')
 def crawlable_sites(environ, start_response):
-    urls = _fetch_crawlable_sites()
+    urls = _get_crawlable_sites()
     start_response('200 OK', [('Content-Type', 'text/plain')])
     return '\n'.join(urls)
 
@@ -48,37 +56,11 @@ def _find_site_id(site_url):
 
 
 def _read_multipart_lines(environ, line_callback):
-    data_file = environ['wsgi.input']
-    content_type = environ.get('CONTENT_TYPE')
-    if not content_type:
-        raise ValueError('Content-Type missing from header')
-
-    match = re.search(r'boundary=(.*)', content_type)
-    if not match:
-        raise ValueError('Multipart form data or boundary declaration missing')
-
-    boundary = match.group(1)
-    boundary_passed = False
-    header_passed = False
-
-    for line in data_file:
-        line = line.strip()
-
-        if not boundary_passed:
-            if line == '--' + boundary:
-                boundary_passed = True
-            continue
-
-        if not header_passed:
-            if not line:
-                header_passed = True
-            continue
-
-        if line == '--' + boundary + '--':
-            break
-
-        if line:
-            line_callback(line)
+    for part in iter_multipart(environ):
+        for line in part.iter_lines():
+            line = line.strip()
+            if line:
+                line_callback(line)
 
 
 def _create_run():
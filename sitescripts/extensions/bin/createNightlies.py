@@ -50,6 +50,7 @@ from sitescripts.extensions.utils import (
     compareVersions, Configuration,
     writeAndroidUpdateManifest,
 )
+from sitescripts import hgclient
 from sitescripts.utils import get_config, get_template
 
 MAX_BUILDS = 50
@@ -94,17 +95,16 @@ class NightlyBuild(object):
             retrieves the current revision ID from the repository
         """
         command = [
-            'hg', 'id', '-i', '-r', self.config.revision, '--config',
-            'defaults.id=', self.config.repository,
+            'id', '-i', '-r', self.config.revision, '--config', 'defaults.id=',
         ]
-        return subprocess.check_output(command).strip()
+        return hgclient.check_output(self.config.repository, command).strip()
 
     def getCurrentBuild(self):
         """
             calculates the (typically numerical) build ID for the current build
         """
-        command = ['hg', 'id', '-n', '--config', 'defaults.id=', self.tempdir]
-        build = subprocess.check_output(command).strip()
+        command = ['id', '-n', '--config', 'defaults.id=']
+        build = hgclient.check_output(self.tempdir, command).strip()
         if self.config.type in {'gecko', 'gecko-webext'}:
             build += 'beta'
         return build
@@ -114,13 +114,13 @@ class NightlyBuild(object):
           retrieve changes between the current and previous ("first") revision
         """
         command = [
-            'hg', 'log', '-R', self.tempdir, '-r',
+            'log', '-r',
             'reverse(ancestors({}))'.format(self.config.revision), '-l', '50',
             '--encoding', 'utf-8', '--template',
             '{date|isodate}\\0{author|person}\\0{rev}\\0{desc}\\0\\0',
             '--config', 'defaults.log=',
         ]
-        result = subprocess.check_output(command).decode('utf-8')
+        result = hgclient.check_output(self.tempdir, command).decode('utf-8')
 
         for change in result.split('\x00\x00'):
             if change:
@@ -693,6 +693,7 @@ class NightlyBuild(object):
         finally:
             # clean up
             if self.tempdir:
+                hgclient.close(self.tempdir)
                 shutil.rmtree(self.tempdir, ignore_errors=True)
 
 
@@ -721,6 +722,8 @@ def main():
     file = open(nightlyConfigFile, 'wb')
     nightlyConfig.write(file)
 
+    hgclient.log_stats()
+
 
 if __name__ == '__main__':
     main()
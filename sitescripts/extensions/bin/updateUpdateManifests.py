@@ -23,13 +23,13 @@ Generate update manifests
 import os
 import re
 import sys
-import subprocess
 import xml.dom.minidom as dom
 from ConfigParser import SafeConfigParser
 
 from buildtools.packagerSafari import get_developer_identifier
 from buildtools.xarfile import read_certificates_and_key
 
+from sitescripts import hgclient
 from sitescripts.utils import get_config, get_template
 from sitescripts.extensions.utils import (
     Configuration, getDownloadLinks,
@@ -37,8 +37,8 @@ from sitescripts.extensions.utils import (
 
 
 def get_min_sdk_version(repo, version):
-    command = ['hg', 'cat', '-r', version, 'AndroidManifest.xml']
-    result = subprocess.check_output(command, cwd=repo.repository)
+    command = ['cat', '-r', version, 'AndroidManifest.xml']
+    result = hgclient.check_output(repo.repository, command)
     uses_sdk = dom.parseString(result).getElementsByTagName('uses-sdk')[0]
     return uses_sdk.attributes['android:minSdkVersion'].value
 
@@ -49,8 +49,8 @@ def readMetadata(repo, version):
     extension's repository
     """
     if repo.type == 'android':
-        command = ['hg', '-R', repo.repository, 'id', '-r', version, '-n']
-        result = subprocess.check_output(command)
+        command = ['id', '-r', version, '-n']
+        result = hgclient.check_output(repo.repository, command)
         revision = re.sub(r'\D', '', result)
 
         return {
@@ -122,6 +122,7 @@ def updateUpdateManifests():
     parser = SafeConfigParser()
     getDownloadLinks(parser)
     writeUpdateManifest(parser)
+    hgclient.log_stats()
 
 
 if __name__ == '__main__':
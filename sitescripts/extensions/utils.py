@@ -18,7 +18,6 @@ import contextlib
 import os
 import json
 import re
-import subprocess
 import traceback
 import time
 import urlparse
@@ -26,6 +25,7 @@ import urllib
 import xml.dom.minidom as dom
 from ConfigParser import SafeConfigParser, NoOptionError
 from StringIO import StringIO
+from sitescripts import hgclient
 from sitescripts.utils import get_config
 from xml.parsers.expat import ExpatError
 
@@ -191,8 +191,8 @@ class Configuration(object):
     def readMetadata(self, version):
         genericFilename = 'metadata'
         filename = '%s.%s' % (genericFilename, self.type)
-        files = subprocess.check_output(['hg', '-R', self.repository,
-                                         'locate', '-r', version]).splitlines()
+        files = hgclient.check_output(self.repository,
+                                      ['locate', '-r', version]).splitlines()
 
         if filename not in files:
             # some repositories like those for Android and
@@ -203,8 +203,8 @@ class Configuration(object):
             # Fall back to platform-independent metadata file
             filename = genericFilename
 
-        command = ['hg', '-R', self.repository, 'cat', '-r', version, os.path.join(self.repository, filename)]
-        result = subprocess.check_output(command)
+        result = hgclient.check_output(self.repository,
+                                       ['cat', '-r', version, filename])
 
         parser = SafeConfigParser()
         parser.readfp(StringIO(result))
@@ -219,8 +219,9 @@ class Configuration(object):
             prefix = os.path.basename(os.path.normpath(self.repository))
         prefix += '-'
 
-        command = ['hg', 'locate', '-R', self.downloadsRepo, '-r', 'default']
-        for filename in subprocess.check_output(command).splitlines():
+        files = hgclient.check_output(self.downloadsRepo,
+                                      ['locate', '-r', 'default'])
+        for filename in files.splitlines():
             if filename.startswith(prefix) and filename.endswith(self.packageSuffix):
                 yield (filename, filename[len(prefix):len(filename) - len(self.packageSuffix)])
 
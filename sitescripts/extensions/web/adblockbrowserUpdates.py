@@ -23,7 +23,7 @@ from urlparse import parse_qs
 from jinja2 import Template
 
 from sitescripts.utils import get_config
-from sitescripts.web import url_handler
+from sitescripts.web import conditional_get, url_handler
 
 _MANIFEST_TEMPLATE = Template('''<?xml version="1.0"?>
 <updates>
@@ -97,22 +97,42 @@ def _handle_request(environ, start_response, builds_dir, builds_url):
     return [response]
 
 
+def _get_builds_version(builds_dir):
+    # Adding or replacing builds changes the modification time
+    try:
+        return os.stat(builds_dir).st_mtime
+    except OSError:
+        return 0
+
+
+def _get_release_builds_dir():
+    return get_config().get('extensions', 'downloadsDirectory')
+
+
+def _get_devbuilds_dir():
+    nightlies_dir = get_config().get('extensions', 'nightliesDirectory')
+    return os.path.join(nightlies_dir, 'adblockbrowser')
+
+
 @url_handler('/adblockbrowser/updates.xml')
+@conditional_get(lambda environ: _get_builds_version(_get_release_builds_dir()),
+                 'max-age=300')
 def adblockbrowser_updates(environ, start_response):
     config = get_config()
 
-    builds_dir = config.get('extensions', 'downloadsDirectory')
+    builds_dir = _get_release_builds_dir()
     builds_url = config.get('extensions', 'downloadsURL').rstrip('/')
 
     return _handle_request(environ, start_response, builds_dir, builds_url)
 
 
 @url_handler('/devbuilds/adblockbrowser/updates.xml')
+@conditional_get(lambda environ: _get_builds_version(_get_devbuilds_dir()),
+                 'max-age=300')
 def adblockbrowser_devbuild_updates(environ, start_response):
     config = get_config()
 
-    nightlies_dir = config.get('extensions', 'nightliesDirectory')
-    builds_dir = os.path.join(nightlies_dir, 'adblockbrowser')
+    builds_dir = _get_devbuilds_dir()
 
     nightlies_url = config.get('extensions', 'nightliesURL').rstrip('/')
     builds_url = '%s/adblockbrowser' % nightlies_url
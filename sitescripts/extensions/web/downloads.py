@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
 import re
 import time
 import posixpath
@@ -20,15 +22,26 @@ import urlparse
 import threading
 import traceback
 from ConfigParser import SafeConfigParser
-from sitescripts.web import url_handler
+from sitescripts.web import conditional_get, url_handler
 from sitescripts.extensions.utils import getDownloadLinks
 
 links = {}
+links_version = None
 UPDATE_INTERVAL = 10 * 60   # 10 minutes
 
+_update_thread = None
+_update_lock = threading.Lock()
+
+
+def _get_version(environ):
+    _start_updates()
+    return links_version
+
 
 @url_handler('/latest/')
+@conditional_get(_get_version, 'max-age=600')
 def handle_request(environ, start_response):
+    _start_updates()
     request = urlparse.urlparse(environ.get('REQUEST_URI', ''))
     basename = posixpath.splitext(posixpath.basename(request.path))[0]
     if basename in links:
@@ -47,17 +60,41 @@ def _get_links():
     return result
 
 
-def _update_links():
-    global links
+def _set_links(new_links):
+    global links, links_version
 
+    links = new_links
+    links_version = hashlib.sha1(json.dumps(new_links,
+                                            sort_keys=True)).hexdigest()
+
+
+def _update_links():
     while True:
+        time.sleep(UPDATE_INTERVAL)
         try:
-            links = _get_links()
+            _set_links(_get_links())
         except:
             traceback.print_exc()
-        time.sleep(UPDATE_INTERVAL)
 
 
-t = threading.Thread(target=_update_links)
-t.daemon = True
-t.start()
+def _start_updates():
+    """Get the links and start updating them, unless done already.
+
+    This is done on the first request rather than on import, so that
+    nothing is downloaded by processes that don't serve these requests.
+    """
+    global _update_thread
+
+    if _update_thread is not None:
+        return
+    with _update_lock:
+        if _update_thread is not None:
+            return
+        try:
+            _set_links(_get_links())
+        except:
+            traceback.print_exc()
+        thread = threading.Thread(target=_update_links)
+        thread.daemon = True
+        thread.start()
+        _update_thread = thread
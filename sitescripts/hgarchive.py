@@ -0,0 +1,237 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cached access to the files of a Mercurial revision.
+
+The files of a revision are extracted once into a cache directory that is
+keyed by the node ID, and are then shared by all processes reading that
+revision. Revision names (like `default`) are resolved to node IDs via
+`hg log` only if the changelog or bookmarks of a local repository have
+changed since the last resolution, which is remembered both in memory and
+in the cache directory. Otherwise reading a revision costs a `stat` call.
+
+The cache directory is configured as `hg_archive_cache` in the `DEFAULT`
+section of the sitescripts configuration. If it isn't configured, a private
+directory of the current user in the temporary directory is used.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from sitescripts.utils import get_config
+
+# Number of extracted revisions to keep for each repository
+KEEP_REVISIONS = 5
+
+# Files that change whenever what a revision name refers to can change
+_SIGNATURE_FILES = [os.path.join('store', '00changelog.i'), 'bookmarks']
+
+_resolved = {}
+_lock = threading.Lock()
+
+
+class CacheDirectoryError(Exception):
+    """The default cache directory can't be used safely."""
+
+
+class Archive(object):
+    """The files of a revision, extracted into a directory."""
+
+    def __init__(self, path, node):
+        self.path = path
+        self.node = node
+
+    def _get_path(self, filename):
+        return os.path.join(self.path, *filename.split('/'))
+
+    def exists(self, filename):
+        return os.path.isfile(self._get_path(filename))
+
+    def open(self, filename):
+        return open(self._get_path(filename), 'rb')
+
+    def read(self, filename):
+        with self.open(filename) as file:
+            return file.read()
+
+    def list_files(self):
+        """Return the sorted paths of all files, using / as separator."""
+        result = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            relpath = os.path.relpath(dirpath, self.path)
+            for filename in filenames:
+                if relpath != os.curdir:
+                    filename = os.path.join(relpath, filename)
+                result.append(filename.replace(os.sep, '/'))
+        result.sort()
+        return result
+
+    def get_cache_file(self, name):
+        """Return the path of a file to cache data derived from the files.
+
+        The path is the same for all revisions of the repository, so the
+        cached data has to be checked against `node` when it's read.
+        """
+        return os.path.join(os.path.dirname(self.path), name)
+
+
+def _get_private_dir(path):
+    try:
+        os.mkdir(path, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    # Anyone can create the directory first in the temporary directory, so
+    # only use it if it's ours and nobody else can write to it
+    stat = os.lstat(path)
+    if not os.path.isdir(path) or os.path.islink(path) or \
+            stat.st_uid != os.getuid() or stat.st_mode & 0077:
+        raise CacheDirectoryError(
+            '{} is not a private directory of the current user, configure '
+            'hg_archive_cache instead'.format(path),
+        )
+    return path
+
+
+def get_cache_dir():
+    config = get_config()
+    if config.has_option('DEFAULT', 'hg_archive_cache'):
+        return config.get('DEFAULT', 'hg_archive_cache')
+    return _get_private_dir(os.path.join(
+        tempfile.gettempdir(), 'sitescripts-hg-archive-{}'.format(os.getuid()),
+    ))
+
+
+def _get_repo_cache_dir(repo):
+    key = hashlib.sha1(os.path.abspath(repo)).hexdigest()
+    return os.path.join(get_cache_dir(), key)
+
+
+def _get_signature(repo):
+    hg_dir = os.path.join(repo, '.hg')
+    signature = []
+    for filename in _SIGNATURE_FILES:
+        try:
+            stat = os.stat(os.path.join(hg_dir, filename))
+            signature.append([stat.st_size, stat.st_mtime])
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            signature.append(None)
+    return signature
+
+
+def _write_json(path, data):
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'wb') as file:
+        json.dump(data, file)
+    os.rename(temp_path, path)
+
+
+def _read_resolved(repo_cache_dir):
+    try:
+        with open(os.path.join(repo_cache_dir, 'revisions.json'), 'rb') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def resolve(repo, revision='default'):
+    """Return the node ID of a revision."""
+    if re.search(r'^[0-9a-f]{40}$', revision):
+        return revision
+
+    repo = os.path.abspath(repo)
+    local = os.path.isdir(os.path.join(repo, '.hg'))
+    if local:
+        signature = _get_signature(repo)
+        key = (repo, revision)
+        if key in _resolved and _resolved[key][0] == signature:
+            return _resolved[key][1]
+
+        repo_cache_dir = _get_repo_cache_dir(repo)
+        stored = _read_resolved(repo_cache_dir).get(revision)
+        if stored is not None and stored[0] == signature:
+            _resolved[key] = stored
+            return stored[1]
+
+    node = subprocess.check_output([
+        'hg', '-R', repo, 'log', '-r', revision, '--template', '{node}',
+    ]).strip()
+
+    if local:
+        _resolved[key] = [signature, node]
+        with _lock:
+            if not os.path.isdir(repo_cache_dir):
+                os.makedirs(repo_cache_dir)
+            resolved = _read_resolved(repo_cache_dir)
+            resolved[revision] = [signature, node]
+            _write_json(os.path.join(repo_cache_dir, 'revisions.json'),
+                        resolved)
+    return node
+
+
+def _prune(repo_cache_dir, keep):
+    trees = []
+    for name in os.listdir(repo_cache_dir):
+        path = os.path.join(repo_cache_dir, name)
+        if re.search(r'^[0-9a-f]{40}$', name) and os.path.isdir(path):
+            trees.append((os.path.getmtime(path), path))
+    trees.sort(reverse=True)
+    for mtime, path in trees[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _extract(repo, node, path):
+    repo_cache_dir = os.path.dirname(path)
+    if not os.path.isdir(repo_cache_dir):
+        os.makedirs(repo_cache_dir)
+
+    # hg archive refuses to write into an existing directory, so it creates
+    # the tree in a new directory that only we can write to
+    temp_dir = tempfile.mkdtemp(prefix=node + '.', dir=repo_cache_dir)
+    temp_path = os.path.join(temp_dir, 'files')
+    try:
+        subprocess.check_call([
+            'hg', '-R', repo, '--config', 'ui.archivemeta=false',
+            'archive', '-r', node, '-t', 'files', temp_path,
+        ])
+        try:
+            os.rename(temp_path, path)
+        except OSError as e:
+            # Another process extracted the same revision in the meantime
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    _prune(repo_cache_dir, KEEP_REVISIONS)
+
+
+def get_archive(repo, revision='default'):
+    """Return an Archive with the files of a revision in a repository."""
+    node = resolve(repo, revision)
+    path = os.path.join(_get_repo_cache_dir(repo), node)
+    # Checked each time, as old trees are pruned by other processes too
+    if not os.path.isdir(path):
+        _extract(os.path.abspath(repo), node, path)
+    return Archive(path, node)
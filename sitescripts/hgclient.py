@@ -0,0 +1,179 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run hg commands through pooled Mercurial command servers.
+
+Starting hg takes about 100 ms, most of it Python startup. Instead of
+forking hg for every command, a command server (`hg serve --cmdserver pipe`)
+is started for each repository the first time it is used and kept around
+for subsequent commands in the same process. The time spent in each hg
+command is recorded, see get_stats() and log_stats().
+"""
+
+import atexit
+import logging
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+_servers = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+class CommandServer(object):
+    """A command server running in a repository."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        env = dict(os.environ, HGPLAIN='1', HGENCODING='UTF-8')
+        self._process = subprocess.Popen(
+            ['hg', 'serve', '--cmdserver', 'pipe',
+             '--config', 'ui.interactive=False'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=repo, env=env,
+            close_fds=True,
+        )
+
+        channel, hello = self._read_channel()
+        if channel != 'o' or 'runcommand' not in hello:
+            self.close()
+            raise Exception('Unexpected hello from hg command server in '
+                            '{}: {!r}'.format(repo, hello))
+
+    def _read_channel(self):
+        header = self._process.stdout.read(5)
+        if len(header) < 5:
+            raise IOError('hg command server in {} terminated '
+                          'unexpectedly'.format(self.repo))
+        channel, length = struct.unpack('>cI', header)
+        if channel in 'IL':
+            # Input requests send the maximal size of the input expected
+            return channel, length
+        return channel, self._process.stdout.read(length)
+
+    def run_command(self, args):
+        """Run an hg command, return its exit code, output and error output.
+
+        Commands run with the repository root as working directory.
+        """
+        data = '\0'.join(args)
+        self._process.stdin.write('runcommand\n' +
+                                  struct.pack('>I', len(data)) + data)
+        self._process.stdin.flush()
+
+        output = []
+        error = []
+        while True:
+            channel, data = self._read_channel()
+            if channel == 'o':
+                output.append(data)
+            elif channel == 'e':
+                error.append(data)
+            elif channel == 'r':
+                code = struct.unpack('>i', data)[0]
+                return code, ''.join(output), ''.join(error)
+            elif channel in 'IL':
+                # Commands aren't supposed to be interactive, signal EOF
+                self._process.stdin.write(struct.pack('>I', 0))
+                self._process.stdin.flush()
+            elif channel.isupper():
+                raise IOError('Unsupported hg command server channel: '
+                              '{}'.format(channel))
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+def _acquire(repo):
+    with _lock:
+        idle = _servers.get(repo)
+        if idle:
+            return idle.pop()
+    return CommandServer(repo)
+
+
+def _release(server):
+    with _lock:
+        _servers.setdefault(server.repo, []).append(server)
+
+
+def _record(command, duration):
+    with _lock:
+        stats = _stats.setdefault(command, {'count': 0, 'time': 0.0})
+        stats['count'] += 1
+        stats['time'] += duration
+
+
+def check_output(repo, args):
+    """Run an hg command in a repository and return its output.
+
+    Like subprocess.check_output(['hg', '-R', repo] + args), this raises
+    CalledProcessError if the command fails. Relative file names in `args`
+    refer to the root of the repository.
+    """
+    repo = os.path.abspath(repo)
+    start = time.time()
+    server = _acquire(repo)
+    try:
+        code, output, error = server.run_command(args)
+    except BaseException:
+        server.close()
+        raise
+    _release(server)
+    _record(args[0], time.time() - start)
+
+    sys.stderr.write(error)
+    if code != 0:
+        raise subprocess.CalledProcessError(code, ['hg', '-R', repo] + args,
+                                            output)
+    return output
+
+
+def close(repo):
+    """Shut down the command servers for a repository.
+
+    This needs to be called before a repository is removed.
+    """
+    with _lock:
+        servers = _servers.pop(os.path.abspath(repo), [])
+    for server in servers:
+        server.close()
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        servers = [server for idle in _servers.itervalues()
+                   for server in idle]
+        _servers.clear()
+    for server in servers:
+        server.close()
+
+
+def get_stats():
+    """Return a dict mapping hg commands to their call count and time."""
+    with _lock:
+        return {command: dict(stats) for command, stats in _stats.items()}
+
+
+def log_stats():
+    for command, stats in sorted(get_stats().items(),
+                                 key=lambda item: -item[1]['time']):
+        logging.info('hg %s: %d calls, %.3f s', command, stats['count'],
+                     stats['time'])
@@ -0,0 +1,45 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Deliver the mails queued in the configured spool directory.
+
+Runs once (e.g. from cron), or keeps checking the queue every few seconds
+if an interval is given.
+"""
+
+import argparse
+import time
+
+from sitescripts.mail.spool import BATCH_SIZE, deliver_queue
+from sitescripts.utils import get_config
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-i', '--interval', type=float,
+                        help='Seconds to wait between checking the queue')
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE,
+                        help='Number of messages to send over a connection')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    while True:
+        directory = get_config().get('mail', 'spool_directory')
+        deliver_queue(directory, batch_size=args.batch_size)
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,304 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Spool mails to a queue directory and deliver them in batches.
+
+If the `mail` section of the configuration has a `spool_directory`,
+`send()` only writes the message to that directory, and
+`sitescripts.mail.bin.deliver_mail` delivers the queued messages later. If
+it doesn't, messages are delivered right away, as before.
+
+Messages are delivered through the configured backend: an SMTP server that
+all messages of a batch are sent over one connection to, if `smtp_host` is
+configured in the `mail` section, otherwise the `mailer` binary (i.e.
+sendmail). If `mailerDebug` is enabled, messages are written to files
+instead.
+"""
+
+import email
+import fcntl
+import os
+import smtplib
+import socket
+import subprocess
+import sys
+import time
+import traceback
+import uuid
+from email.utils import getaddresses, parseaddr
+from tempfile import mkstemp
+
+from sitescripts.utils import get_config
+
+# Seconds to wait before retrying the delivery of a message, doubled after
+# each failed attempt, and the maximal number of attempts
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 60 * 60
+MAX_ATTEMPTS = 10
+
+BATCH_SIZE = 100
+
+
+class DeliveryError(Exception):
+    """Delivering a message failed, it should be tried again later."""
+
+
+class ConnectionFailed(Exception):
+    """The backend isn't available, no message could be delivered."""
+
+
+class SendmailBackend(object):
+    """Pass each message to a new process of the `mailer` binary."""
+
+    def __init__(self, mailer):
+        self.mailer = mailer
+
+    def send_batch(self, messages):
+        for message in messages:
+            process = subprocess.Popen([self.mailer, '-t'],
+                                       stdin=subprocess.PIPE)
+            process.communicate(message)
+            if process.returncode != 0:
+                raise DeliveryError('{} exited with code {}'.format(
+                    self.mailer, process.returncode,
+                ))
+            yield message
+
+
+class FileBackend(object):
+    """Write each message to a file in a directory, for debugging."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send_batch(self, messages):
+        for message in messages:
+            handle, path = mkstemp(prefix='mail_', suffix='.eml',
+                                   dir=self.directory)
+            with os.fdopen(handle, 'wb') as file:
+                file.write(message)
+            yield message
+
+
+class SMTPBackend(object):
+    """Send all messages of a batch over one connection to an SMTP server.
+
+    The envelope sender and recipients are taken from the From, To, Cc and
+    Bcc headers, like `sendmail -t` does.
+    """
+
+    def __init__(self, host, port=25, username=None, password=None,
+                 starttls=False, timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def send_batch(self, messages):
+        try:
+            connection = self._connect()
+        except (smtplib.SMTPException, socket.error) as e:
+            raise ConnectionFailed('Connecting to {}:{} failed: {}'.format(
+                self.host, self.port, e,
+            ))
+        try:
+            for message in messages:
+                parsed = email.message_from_string(message)
+                sender = parseaddr(parsed.get('From', ''))[1]
+                recipients = [
+                    address for name, address in getaddresses(
+                        parsed.get_all('To', []) + parsed.get_all('Cc', []) +
+                        parsed.get_all('Bcc', []),
+                    ) if address
+                ]
+                if not recipients:
+                    raise DeliveryError('Message without recipients')
+                if 'Bcc' in parsed:
+                    del parsed['Bcc']
+                    message = parsed.as_string()
+                try:
+                    connection.sendmail(sender, recipients, message)
+                except (smtplib.SMTPException, socket.error) as e:
+                    raise DeliveryError('Sending mail failed: {}'.format(e))
+                yield message
+        finally:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, socket.error):
+                connection.close()
+
+
+def get_backend():
+    config = get_config()
+    if config.has_option('DEFAULT', 'mailerDebug') and \
+            config.get('DEFAULT', 'mailerDebug') == 'yes':
+        return FileBackend(config.get('mail', 'debug_directory')
+                           if config.has_option('mail', 'debug_directory')
+                           else '.')
+    if config.has_option('mail', 'smtp_host'):
+        return SMTPBackend(
+            config.get('mail', 'smtp_host'),
+            config.getint('mail', 'smtp_port', 25),
+            config.get('mail', 'smtp_username')
+            if config.has_option('mail', 'smtp_username') else None,
+            config.get('mail', 'smtp_password')
+            if config.has_option('mail', 'smtp_password') else None,
+            config.getboolean('mail', 'smtp_starttls', False),
+        )
+    return SendmailBackend(config.get('DEFAULT', 'mailer'))
+
+
+def _get_spool_directory():
+    config = get_config()
+    if config.has_option('mail', 'spool_directory'):
+        return config.get('mail', 'spool_directory')
+    return None
+
+
+def _parse_name(name):
+    # The names of queued messages are "<not before>-<attempts>-<id>.eml"
+    try:
+        not_before, attempts, message_id = name[:-len('.eml')].split('-', 2)
+        return int(not_before), int(attempts), message_id
+    except ValueError:
+        return None
+
+
+def spool(message, directory):
+    """Add a message to the queue in the directory."""
+    temp_directory = os.path.join(directory, 'tmp')
+    if not os.path.isdir(temp_directory):
+        os.makedirs(temp_directory)
+    name = '0-0-{}.eml'.format(uuid.uuid4().hex)
+    handle, path = mkstemp(dir=temp_directory)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(message)
+        os.rename(path, os.path.join(directory, name))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def send(message):
+    """Queue a message, or deliver it right away if there is no queue.
+
+    Like the mailer output before there was a queue, failures to deliver
+    a message right away are only logged, so that the request sending it
+    doesn't fail.
+    """
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    directory = _get_spool_directory()
+    if directory:
+        spool(message, directory)
+        return
+    try:
+        for sent in get_backend().send_batch([message]):
+            pass
+    except (DeliveryError, ConnectionFailed):
+        print >>sys.stderr, 'Sending mail failed:'
+        traceback.print_exc()
+
+
+def _get_queued(directory, now):
+    queued = []
+    for name in os.listdir(directory):
+        parsed = _parse_name(name) if name.endswith('.eml') else None
+        if parsed and parsed[0] <= now:
+            queued.append((parsed, name))
+    return [name for state, name in sorted(queued)]
+
+
+def _retry_later(directory, name, now):
+    not_before, attempts, message_id = _parse_name(name)
+    attempts += 1
+    if attempts >= MAX_ATTEMPTS:
+        failed_directory = os.path.join(directory, 'failed')
+        if not os.path.isdir(failed_directory):
+            os.makedirs(failed_directory)
+        os.rename(os.path.join(directory, name),
+                  os.path.join(failed_directory, name))
+        return
+    delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    os.rename(os.path.join(directory, name), os.path.join(
+        directory,
+        '{}-{}-{}.eml'.format(int(now + delay), attempts, message_id),
+    ))
+
+
+def deliver_queue(directory, backend=None, batch_size=BATCH_SIZE):
+    """Deliver the queued messages that are due, return how many were sent.
+
+    Messages are sent in batches of `batch_size`. If a message fails, it's
+    tried again later, with increasing delays, and moved to the `failed`
+    subdirectory after MAX_ATTEMPTS attempts. The rest of the batch is tried
+    again right away, with a new connection. If the backend isn't available
+    at all, the messages stay in the queue for the next run.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # Only one process delivers the messages of a queue at a time
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return 0
+        return _deliver_queue(directory, backend or get_backend(),
+                              batch_size)
+
+
+def _deliver_queue(directory, backend, batch_size):
+    now = time.time()
+    names = _get_queued(directory, now)
+    sent_count = 0
+    while names:
+        batch, names = names[:batch_size], names[batch_size:]
+        while batch:
+            messages = []
+            for name in batch:
+                with open(os.path.join(directory, name), 'rb') as file:
+                    messages.append(file.read())
+
+            sent = 0
+            try:
+                for message in backend.send_batch(messages):
+                    os.remove(os.path.join(directory, batch[sent]))
+                    sent += 1
+                break
+            except ConnectionFailed:
+                traceback.print_exc()
+                return sent_count + sent
+            except DeliveryError:
+                print >>sys.stderr, 'Delivering {} failed:'.format(
+                    batch[sent],
+                )
+                traceback.print_exc()
+                _retry_later(directory, batch[sent], now)
+                batch = batch[sent + 1:]
+            finally:
+                sent_count += sent
+    return sent_count
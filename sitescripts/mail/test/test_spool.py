@@ -0,0 +1,160 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncore
+import os
+import smtpd
+import threading
+import uuid
+from ConfigParser import SafeConfigParser
+
+import pytest
+
+from sitescripts.mail import spool
+from sitescripts.utils import ConfigSnapshot
+
+MESSAGE = u'''From: sender@example.com
+To: Recipient <to@example.com>
+Cc: cc@example.com
+Bcc: bcc@example.com
+Subject: {}
+
+Hello
+'''
+
+
+class SMTPServer(smtpd.SMTPServer):
+    def __init__(self, rejected=()):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.rejected = rejected
+        self.messages = []
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, sender, recipients, data):
+        if any(subject in data for subject in self.rejected):
+            return '554 Rejected'
+        self.messages.append((sender, recipients, data))
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer(rejected=['Subject: rejected'])
+    thread = threading.Thread(target=asyncore.loop,
+                              kwargs={'timeout': 0.05})
+    thread.start()
+    yield server
+    server.close()
+    thread.join()
+
+
+@pytest.fixture
+def directory(tmpdir):
+    return tmpdir.join('spool').strpath
+
+
+@pytest.fixture
+def config(mocker, directory):
+    parser = SafeConfigParser()
+    parser.optionxform = str
+    parser.set('DEFAULT', 'mailer', 'sendmail')
+    parser.set('DEFAULT', 'mailerDebug', 'no')
+    parser.add_section('mail')
+    parser.set('mail', 'spool_directory', directory)
+    mocker.patch.object(spool, 'get_config',
+                        lambda: ConfigSnapshot(parser))
+    return parser
+
+
+def _queued(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith('.eml'))
+
+
+def test_spool_and_deliver(config, directory, smtp_server, mocker):
+    # Queued messages are sent in the order of their IDs
+    mocker.patch.object(spool.uuid, 'uuid4',
+                        side_effect=[uuid.UUID(int=i) for i in range(3)])
+    for subject in ['first', 'rejected', u'third \xe4']:
+        spool.send(MESSAGE.format(subject))
+    assert len(_queued(directory)) == 3
+
+    backend = spool.SMTPBackend('127.0.0.1', smtp_server.port)
+    assert spool.deliver_queue(directory, backend, batch_size=2) == 2
+
+    # All messages were sent over one connection, except after the failure
+    assert smtp_server.connections == 2
+    subjects = [data.splitlines()[3] for sender, recipients, data
+                in smtp_server.messages]
+    assert subjects == ['Subject: first', 'Subject: third \xc3\xa4']
+    sender, recipients, data = smtp_server.messages[0]
+    assert sender == 'sender@example.com'
+    assert recipients == ['to@example.com', 'cc@example.com',
+                          'bcc@example.com']
+    assert 'Bcc' not in data
+
+    # The rejected message is retried later
+    [name] = _queued(directory)
+    assert name.split('-')[1] == '1'
+    assert spool.deliver_queue(directory, backend) == 0
+    assert _queued(directory) == [name]
+
+
+def test_retries(config, directory, mocker):
+    backend = mocker.Mock()
+    backend.send_batch.side_effect = spool.DeliveryError()
+    spool.spool(MESSAGE.format('failing'), directory)
+    mocker.patch.object(spool, 'MAX_ATTEMPTS', 2)
+
+    spool.deliver_queue(directory, backend)
+    [name] = _queued(directory)
+    mocker.patch('time.time', return_value=int(name.split('-')[0]))
+    spool.deliver_queue(directory, backend)
+    assert _queued(directory) == []
+    assert len(os.listdir(os.path.join(directory, 'failed'))) == 1
+
+
+def test_connection_failure(config, directory):
+    spool.spool(MESSAGE.format('first'), directory)
+    spool.spool(MESSAGE.format('second'), directory)
+    queued = _queued(directory)
+    backend = spool.SMTPBackend('127.0.0.1', 1)
+    assert spool.deliver_queue(directory, backend) == 0
+    assert _queued(directory) == queued
+
+
+def test_file_backend(config, tmpdir):
+    config.set('DEFAULT', 'mailerDebug', 'yes')
+    config.remove_option('mail', 'spool_directory')
+    config.set('mail', 'debug_directory', tmpdir.strpath)
+    spool.send(MESSAGE.format('debug'))
+    [path] = tmpdir.listdir('mail_*.eml')
+    assert path.read() == MESSAGE.format('debug')
+
+
+def test_immediate_failure(config, capsys):
+    config.remove_option('mail', 'spool_directory')
+    config.set('DEFAULT', 'mailer', 'false')
+    spool.send(MESSAGE.format('failing'))
+    assert 'false exited with code 1' in capsys.readouterr()[1]
+
+    config.set('mail', 'smtp_host', '127.0.0.1')
+    config.set('mail', 'smtp_port', '1')
+    spool.send(MESSAGE.format('failing'))
+    assert 'Connecting to 127.0.0.1:1 failed' in capsys.readouterr()[1]
@@ -0,0 +1,107 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the throughput and latency of a server running the handlers.
+
+Requests the given URLs from a number of concurrent connections for a
+while, in order to compare server setups, e.g. multiplexer.fcgi behind a
+web server with `multiplexer.py --workers`, using the same URLs.
+"""
+
+import argparse
+import httplib
+import itertools
+import threading
+import time
+import urlparse
+
+
+def _run_client(urls, end_time, latencies, errors):
+    connections = {}
+    for url in itertools.cycle(urls):
+        start_time = time.time()
+        if start_time >= end_time:
+            break
+
+        parsed = urlparse.urlsplit(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        try:
+            connection = connections.get(parsed.netloc)
+            if connection is None:
+                connection = httplib.HTTPConnection(parsed.netloc,
+                                                    timeout=30)
+                connections[parsed.netloc] = connection
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.getheader('connection', '').lower() == 'close' or \
+                    response.version == 10:
+                connection.close()
+                del connections[parsed.netloc]
+            if response.status >= 500:
+                errors.append(response.status)
+        except (httplib.HTTPException, IOError) as e:
+            errors.append(e)
+            connections.pop(parsed.netloc, None)
+        latencies.append(time.time() - start_time)
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def run_benchmark(urls, concurrency, duration):
+    """Return the requests per second, latencies in seconds and errors."""
+    latencies = []
+    errors = []
+    start_time = time.time()
+    threads = [
+        threading.Thread(target=_run_client,
+                         args=(urls, start_time + duration, latencies, errors))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.time() - start_time), latencies, errors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='+', metavar='url',
+                        help='URLs to request, one after another')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='Number of concurrent connections')
+    parser.add_argument('-t', '--time', type=float, default=10,
+                        help='Seconds to send requests for')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    throughput, latencies, errors = run_benchmark(args.urls, args.concurrency,
+                                                  args.time)
+    latencies.sort()
+    print 'Requests:        %d' % len(latencies)
+    print 'Errors:          %d' % len(errors)
+    print 'Requests/s:      %.1f' % throughput
+    if latencies:
+        for percent in [50, 90, 99]:
+            print 'Latency p%d:     %.1f ms' % (
+                percent, _percentile(latencies, percent) * 1000,
+            )
@@ -16,66 +16,59 @@
 import os
 import re
 import sys
-import subprocess
-import tarfile
-from StringIO import StringIO
+from sitescripts.hgarchive import get_archive
 from sitescripts.utils import get_config, setupStderr
 
 
 def generate_data(repo):
-    command = ['hg', '-R', repo, 'archive', '-r', 'default', '-t', 'tar', '-p', '.', '-']
-    data = subprocess.check_output(command)
+    archive = get_archive(repo)
 
     users = {}
     repos = []
-    with tarfile.open(mode='r:', fileobj=StringIO(data)) as archive:
-        for fileinfo in archive:
-            name = fileinfo.name
-            if name.startswith('./'):
-                name = name[2:]
+    for name in archive.list_files():
+        if name.startswith('users/'):
+            filename = name
+            name = os.path.basename(name)
+            options = []
+            match = re.search(r'^(.*)\[(.*)\]$', name)
+            if match:
+                name = match.group(1)
+                options = match.group(2).split(',')
 
-            if fileinfo.type == tarfile.REGTYPE and name.startswith('users/'):
-                name = os.path.basename(name)
-                options = []
-                match = re.search(r'^(.*)\[(.*)\]$', name)
-                if match:
-                    name = match.group(1)
-                    options = match.group(2).split(',')
-
-                user = {
-                    'name': name,
-                    'keytype': 'rsa',
-                    'disabled': False,
-                    'trusted': False,
-                    'repos': [],
-                }
-                for option in options:
-                    if option == 'dsa':
-                        user['keytype'] = 'dsa'
-                    elif option == 'disabled':
-                        user['disabled'] = True
-                    elif option == 'trusted':
-                        user['trusted'] = True
-                    else:
-                        print >>sys.stderr, 'Unknown user option: %s' % option
-                user['key'] = re.sub(r'\s', '', archive.extractfile(fileinfo).read())
-                users[name] = user
-            elif fileinfo.type == tarfile.REGTYPE and name.startswith('repos/'):
-                repos.append(fileinfo)
-            elif fileinfo.type == tarfile.REGTYPE and not name.startswith('.'):
-                print >>sys.stderr, 'Unrecognized file in the repository: %s' % name
-
-        for fileinfo in repos:
-            name = os.path.basename(fileinfo.name).lower()
-            repousers = archive.extractfile(fileinfo).readlines()
-            for user in repousers:
-                user = user.strip()
-                if user == '' or user.startswith('#'):
-                    continue
-                if user in users:
-                    users[user]['repos'].append(name)
+            user = {
+                'name': name,
+                'keytype': 'rsa',
+                'disabled': False,
+                'trusted': False,
+                'repos': [],
+            }
+            for option in options:
+                if option == 'dsa':
+                    user['keytype'] = 'dsa'
+                elif option == 'disabled':
+                    user['disabled'] = True
+                elif option == 'trusted':
+                    user['trusted'] = True
                 else:
-                    print >>sys.stderr, 'Unknown user listed for repository %s: %s' % (name, user)
+                    print >>sys.stderr, 'Unknown user option: %s' % option
+            user['key'] = re.sub(r'\s', '', archive.read(filename))
+            users[name] = user
+        elif name.startswith('repos/'):
+            repos.append(name)
+        elif not name.startswith('.'):
+            print >>sys.stderr, 'Unrecognized file in the repository: %s' % name
+
+    for filename in repos:
+        name = os.path.basename(filename).lower()
+        repousers = archive.read(filename).splitlines()
+        for user in repousers:
+            user = user.strip()
+            if user == '' or user.startswith('#'):
+                continue
+            if user in users:
+                users[user]['repos'].append(name)
+            else:
+                print >>sys.stderr, 'Unknown user listed for repository %s: %s' % (name, user)
 
     for user in users.itervalues():
         if user['disabled']:
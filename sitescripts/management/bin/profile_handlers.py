@@ -0,0 +1,125 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Report what importing each URL handler module costs.
+
+Each module listed in the `multiplexer` section of the configuration is
+imported in a new Python process, like when a FastCGI worker is spawned.
+The time it takes, the number of modules it pulls in and the number of
+threads it starts are reported, minus what importing `sitescripts.web`
+without any handler modules costs.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from ConfigParser import RawConfigParser
+
+from sitescripts.utils import get_config
+
+_MEASURE_SCRIPT = '''
+import json, sys, threading, time
+start_time = time.time()
+import sitescripts.web
+print json.dumps({
+    'time': time.time() - start_time,
+    'modules': len(sys.modules),
+    'threads': threading.active_count(),
+})
+'''
+
+
+def _write_config(path, modules):
+    source = get_config()
+    config = RawConfigParser()
+    config.optionxform = lambda x: x
+    for key, value in source.defaults().iteritems():
+        config.set('DEFAULT', key, value)
+    for section in source.sections():
+        if section == 'multiplexer_urls':
+            continue
+        config.add_section(section)
+        if section == 'multiplexer':
+            for module in modules:
+                config.set(section, module,
+                           source.get(section, module, raw=True))
+        else:
+            for key, value in source.items(section, raw=True):
+                config.set(section, key, value)
+
+    with open(path, 'wb') as file:
+        config.write(file)
+
+
+def _measure(config_path, runs):
+    env = dict(os.environ, SITESCRIPTS_CONFIG=config_path)
+    results = []
+    for i in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _MEASURE_SCRIPT], env=env,
+        )
+        results.append(json.loads(output.splitlines()[-1]))
+    return min(results, key=lambda result: result['time'])
+
+
+def profile_handlers(runs):
+    """Return the import costs of the handler modules, most expensive first.
+
+    Each result is a dict with the keys `module`, `time`, `modules` and
+    `threads`.
+    """
+    config = get_config()
+    modules = set(config.options('multiplexer')) - set(config.defaults())
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(tempdir, 'sitescripts.ini')
+        _write_config(config_path, [])
+        baseline = _measure(config_path, runs)
+
+        results = []
+        for module in modules:
+            _write_config(config_path, [module])
+            result = _measure(config_path, runs)
+            result = {key: value - baseline[key]
+                      for key, value in result.iteritems()}
+            result['module'] = module
+            results.append(result)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    results.sort(key=lambda result: result['time'], reverse=True)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--runs', type=int, default=3,
+                        help='Imports per module, the fastest one counts')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print '%-60s %10s %8s %8s' % ('module', 'time (ms)', 'modules',
+                                  'threads')
+    for result in profile_handlers(args.runs):
+        print '%-60s %10.1f %8d %8d' % (result['module'],
+                                        result['time'] * 1000,
+                                        result['modules'], result['threads'])
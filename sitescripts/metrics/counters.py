@@ -0,0 +1,207 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Counters shared between the processes serving web requests.
+
+Each process writes its counters to its own memory-mapped file, so that
+no locking between processes is required when counting. The values of all
+files in the directory are summed up when reading them. The files of
+processes that have exited since are added to an aggregate file and
+removed then, so that the counters never go down, without the number of
+files growing as processes are replaced. Gauges, i.e. counters that only
+make sense while the process is running, are dropped instead.
+
+A counters file starts with the number of bytes used, followed by the
+counters, each consisting of the length of its key, the key and the value
+as a double, aligned to 8 bytes.
+"""
+
+import errno
+import fcntl
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+INITIAL_SIZE = 64 * 1024
+
+_USED = struct.Struct('=Q')
+_KEY_LENGTH = struct.Struct('=I')
+_VALUE = struct.Struct('=d')
+
+
+def _value_offset(offset, key_length):
+    return offset + (_KEY_LENGTH.size + key_length + 7) // 8 * 8
+
+
+def _read_entries(data, used):
+    offset = _USED.size
+    while offset < used:
+        length = _KEY_LENGTH.unpack_from(data, offset)[0]
+        key_offset = offset + _KEY_LENGTH.size
+        offset = _value_offset(offset, length)
+        if offset + _VALUE.size > used:
+            break
+        yield data[key_offset:key_offset + length], offset
+        offset += _VALUE.size
+
+
+def get_path(directory, pid):
+    return os.path.join(directory, 'counters.{}.db'.format(pid))
+
+
+def _get_aggregate_path(directory):
+    return os.path.join(directory, 'counters.aggregate.json')
+
+
+@contextmanager
+def _locked(directory):
+    # Held while files of exited processes are folded into the aggregate,
+    # so that a new process with the same ID doesn't open them meanwhile
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class CountersFile(object):
+    """The counters of the current process, see module docstring."""
+
+    def __init__(self, directory):
+        self.pid = os.getpid()
+        self.path = get_path(directory, self.pid)
+        self._lock = threading.Lock()
+
+        with _locked(directory):
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if os.fstat(fd).st_size < INITIAL_SIZE:
+                os.ftruncate(fd, INITIAL_SIZE)
+            self._map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        # A process with the same ID might have written to this file before
+        self._used = max(_USED.unpack_from(self._map, 0)[0], _USED.size)
+        self._offsets = {key: offset for key, offset
+                         in _read_entries(self._map, self._used)}
+
+    def _add_key(self, key):
+        offset = _value_offset(self._used, len(key))
+        end = offset + _VALUE.size
+        size = len(self._map)
+        if end > size:
+            while end > size:
+                size *= 2
+            self._map.resize(size)
+
+        key_offset = self._used + _KEY_LENGTH.size
+        _KEY_LENGTH.pack_into(self._map, self._used, len(key))
+        self._map[key_offset:key_offset + len(key)] = key
+        _VALUE.pack_into(self._map, offset, 0)
+
+        # Readers only look at the entries up to the number of bytes used,
+        # so the new entry is complete once they see it.
+        self._used = end
+        _USED.pack_into(self._map, 0, self._used)
+        self._offsets[key] = offset
+        return offset
+
+    def add(self, amounts):
+        """Add to the counters, given as (key, amount) pairs."""
+        with self._lock:
+            for key, amount in amounts:
+                offset = self._offsets.get(key)
+                if offset is None:
+                    offset = self._add_key(key)
+                value = _VALUE.unpack_from(self._map, offset)[0]
+                _VALUE.pack_into(self._map, offset, value + amount)
+
+    def close(self):
+        self._map.close()
+
+
+def _read_file(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < _USED.size:
+        return
+    used = min(_USED.unpack_from(data, 0)[0], len(data))
+    for key, offset in _read_entries(data, used):
+        yield key, _VALUE.unpack_from(data, offset)[0]
+
+
+def _read_aggregate(directory):
+    try:
+        with open(_get_aggregate_path(directory), 'rb') as file:
+            return {key.encode('utf-8'): value
+                    for key, value in json.load(file).iteritems()}
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return {}
+
+
+def _write_aggregate(directory, aggregate):
+    handle = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+    with handle:
+        json.dump(aggregate, handle)
+    os.chmod(handle.name, 0644)
+    os.rename(handle.name, _get_aggregate_path(directory))
+
+
+def read_counters(directory, is_gauge=lambda key: False):
+    """Return the sum of the counters in the directory, by key.
+
+    The files of processes that exited are folded into the aggregate file,
+    leaving out the keys that `is_gauge` returns true for.
+    """
+    if not os.path.isdir(directory):
+        return defaultdict(float)
+
+    with _locked(directory):
+        aggregate = _read_aggregate(directory)
+        totals = defaultdict(float, aggregate)
+        exited = []
+        for path in glob.glob(get_path(directory, '*')):
+            match = re.search(r'\.(\d+)\.db$', path)
+            running = match is None or _is_running(int(match.group(1)))
+            if not running:
+                exited.append(path)
+            for key, value in _read_file(path):
+                if running:
+                    totals[key] += value
+                elif not is_gauge(key):
+                    totals[key] += value
+                    aggregate[key] = aggregate.get(key, 0) + value
+
+        if exited:
+            _write_aggregate(directory, aggregate)
+            for path in exited:
+                os.remove(path)
+    return totals
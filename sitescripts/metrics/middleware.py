@@ -0,0 +1,252 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import json
+import os
+import threading
+import time
+import traceback
+
+from sitescripts.metrics.counters import CountersFile, read_counters
+from sitescripts.utils import get_config
+
+# Upper bounds of the request duration histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PREFIX = 'sitescripts_http_'
+
+
+def _key(*parts):
+    return json.dumps(parts)
+
+
+class _Response(object):
+    def __init__(self, start_response):
+        self._start_response = start_response
+        self.status = '500'
+        self.size = 0
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status.split(None, 1)[0]
+        write = self._start_response(status, headers, exc_info)
+
+        def counting_write(data):
+            self.size += len(data)
+            write(data)
+        return counting_write
+
+
+class _ResponseIterable(object):
+    def __init__(self, result, response, on_close):
+        self._result = result
+        self._response = response
+        self._on_close = on_close
+
+    def __iter__(self):
+        for data in self._result:
+            self._response.size += len(data)
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self._result, 'close'):
+                self._result.close()
+        finally:
+            self._on_close()
+
+
+class MetricsMiddleware(object):
+    """Record the requests, by the URL their handler is registered for.
+
+    The number of requests by status code, the bytes sent and a histogram
+    of the time it took until the response was sent are recorded. Requests
+    without a handler are recorded with an empty URL. For handlers with a
+    concurrency limit, the number of queued requests and a histogram of the
+    time requests waited are recorded as well.
+    """
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = directory
+        self._counters = None
+        self._lock = threading.Lock()
+
+    def _get_counters(self):
+        # Forked processes must not write to the file of their parent
+        pid = os.getpid()
+        with self._lock:
+            if self._counters is None or self._counters.pid != pid:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                self._counters = CountersFile(self.directory)
+            return self._counters
+
+    def record(self, url, status, size, duration, queue_wait=None):
+        bucket = bisect.bisect_left(BUCKETS, duration)
+        values = [
+            (_key('requests', url, status), 1),
+            (_key('bytes', url), size),
+            (_key('duration', url, bucket), 1),
+            (_key('duration_sum', url), duration),
+        ]
+        if queue_wait is not None:
+            bucket = bisect.bisect_left(BUCKETS, queue_wait)
+            values += [
+                (_key('queue_wait', url, bucket), 1),
+                (_key('queue_wait_sum', url), queue_wait),
+            ]
+        self._get_counters().add(values)
+
+    def record_queue_change(self, url, delta):
+        # The sum of the changes of all processes is the current queue size
+        try:
+            self._get_counters().add([(_key('queued', url), delta)])
+        except Exception:
+            traceback.print_exc()
+
+    def __call__(self, environ, start_response):
+        start_time = time.time()
+        response = _Response(start_response)
+        environ['sitescripts.metrics'] = self
+
+        def on_close():
+            # Failing to record metrics mustn't fail the request
+            try:
+                self.record(environ.get('sitescripts.handler_url') or '',
+                            response.status, response.size,
+                            time.time() - start_time,
+                            environ.get('sitescripts.queue_wait'))
+            except Exception:
+                traceback.print_exc()
+
+        try:
+            result = self.app(environ, response.start_response)
+        except Exception:
+            on_close()
+            raise
+        return _ResponseIterable(result, response, on_close)
+
+
+def instrument(app):
+    """Wrap the WSGI app to record metrics, if configured."""
+    config = get_config()
+    if not config.has_option('metrics', 'directory'):
+        return app
+    return MetricsMiddleware(app, config.get('metrics', 'directory'))
+
+
+def _escape(value):
+    return (value.encode('utf-8').replace('\\', r'\\')
+            .replace('\n', r'\n').replace('"', r'\"'))
+
+
+def _format_sample(name, labels, value):
+    labels = ','.join('{}="{}"'.format(label, _escape(label_value))
+                      for label, label_value in labels)
+    if value == int(value):
+        value = int(value)
+    return '{}{}{{{}}} {!r}\n'.format(PREFIX, name, labels, value)
+
+
+def _format_histogram(name, description, buckets_by_url, sums):
+    lines = [
+        '# HELP {}{} {}\n'.format(PREFIX, name, description),
+        '# TYPE {}{} histogram\n'.format(PREFIX, name),
+    ]
+    for url, buckets in sorted(buckets_by_url.iteritems()):
+        count = 0
+        for bound, value in zip(BUCKETS + ('+Inf',), buckets):
+            count += value
+            lines.append(_format_sample(
+                name + '_bucket', [('url', url), ('le', unicode(bound))],
+                count,
+            ))
+        lines.append(_format_sample(name + '_sum', [('url', url)],
+                                    sums.get(url, 0)))
+        lines.append(_format_sample(name + '_count', [('url', url)], count))
+    return lines
+
+
+def format_metrics(counters):
+    """Return the counters in the Prometheus text exposition format."""
+    requests = []
+    sizes = []
+    queued = []
+    histograms = {'duration': {}, 'queue_wait': {}}
+    sums = {'duration': {}, 'queue_wait': {}}
+    for key, value in counters.iteritems():
+        parts = json.loads(key)
+        kind, url = parts[:2]
+        if kind == 'requests':
+            requests.append((url, parts[2], value))
+        elif kind == 'bytes':
+            sizes.append((url, value))
+        elif kind == 'queued':
+            queued.append((url, value))
+        elif kind in histograms:
+            buckets = histograms[kind].setdefault(
+                url, [0] * (len(BUCKETS) + 1),
+            )
+            buckets[parts[2]] += value
+        elif kind.endswith('_sum'):
+            sums[kind[:-4]][url] = value
+
+    lines = [
+        '# HELP {}requests_total Requests by handler URL and status.\n'
+        .format(PREFIX),
+        '# TYPE {}requests_total counter\n'.format(PREFIX),
+    ]
+    for url, status, value in sorted(requests):
+        lines.append(_format_sample('requests_total',
+                                    [('url', url), ('status', status)],
+                                    value))
+
+    lines += [
+        '# HELP {}response_bytes_total Bytes sent by handler URL.\n'
+        .format(PREFIX),
+        '# TYPE {}response_bytes_total counter\n'.format(PREFIX),
+    ]
+    for url, value in sorted(sizes):
+        lines.append(_format_sample('response_bytes_total', [('url', url)],
+                                    value))
+
+    lines += _format_histogram('request_duration_seconds',
+                               'Request duration by handler URL.',
+                               histograms['duration'], sums['duration'])
+
+    lines += [
+        '# HELP {}queued_requests Requests waiting for a concurrency limit '
+        'by handler URL.\n'.format(PREFIX),
+        '# TYPE {}queued_requests gauge\n'.format(PREFIX),
+    ]
+    for url, value in sorted(queued):
+        lines.append(_format_sample('queued_requests', [('url', url)], value))
+
+    lines += _format_histogram('queue_wait_seconds',
+                               'Time requests waited for a concurrency '
+                               'limit by handler URL.',
+                               histograms['queue_wait'], sums['queue_wait'])
+
+    return ''.join(lines)
+
+
+def _is_gauge(key):
+    # The queue size changes of a process that exited don't count anymore
+    return json.loads(key)[0] == 'queued'
+
+
+def read_metrics(directory):
+    return format_metrics(read_counters(directory, _is_gauge))
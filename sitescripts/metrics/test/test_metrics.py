@@ -0,0 +1,167 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import os
+from ConfigParser import SafeConfigParser
+
+import pytest
+
+from sitescripts import web
+from sitescripts.metrics import counters
+from sitescripts.metrics.middleware import MetricsMiddleware, read_metrics
+from sitescripts.metrics.web import metrics
+
+
+@pytest.fixture
+def directory(tmpdir):
+    return tmpdir.mkdir('metrics').strpath
+
+
+def test_counters_of_all_processes(directory, mocker):
+    first = counters.CountersFile(directory)
+    first.add([('a', 1), ('b', 0.5)])
+    first.add([('a', 2)])
+
+    mocker.patch('os.getpid', return_value=first.pid + 1)
+    second = counters.CountersFile(directory)
+    second.add([('b', 1)])
+    # More keys than fit into the initial size of the file
+    second.add(('key %d' % i, i) for i in range(10000))
+
+    totals = counters.read_counters(directory)
+    assert totals['a'] == 3
+    assert totals['b'] == 1.5
+    assert totals['key 9999'] == 9999
+    assert len(totals) == 10002
+
+    # A new process with the same ID continues with the existing counters
+    second.close()
+    third = counters.CountersFile(directory)
+    third.add([('b', 1), ('key 1', 1)])
+    totals = counters.read_counters(directory)
+    assert totals['b'] == 2.5
+    assert totals['key 1'] == 2
+
+
+def test_counters_of_exited_processes(directory, mocker):
+    running = {}
+    mocker.patch.object(counters, '_is_running',
+                        lambda pid: running.get(pid, True))
+    first = counters.CountersFile(directory)
+    first.add([('a', 1), ('gauge', 1)])
+    mocker.patch('os.getpid', return_value=first.pid + 1)
+    second = counters.CountersFile(directory)
+    second.add([('a', 2), ('gauge', 1)])
+
+    def is_gauge(key):
+        return key == 'gauge'
+
+    running[second.pid] = False
+    totals = counters.read_counters(directory, is_gauge)
+    assert totals == {'a': 3, 'gauge': 1}
+    # The file of the exited process was folded into the aggregate
+    assert not os.path.exists(second.path)
+    assert counters.read_counters(directory, is_gauge) == totals
+
+    third = counters.CountersFile(directory)
+    third.add([('a', 1)])
+    assert counters.read_counters(directory, is_gauge)['a'] == 4
+
+
+def app(environ, start_response):
+    path = environ['PATH_INFO']
+    if path == '/error':
+        raise ValueError()
+    environ['sitescripts.handler_url'] = path
+    write = start_response('200 OK', [])
+    write('abc')
+    return ['defg']
+
+
+def request(middleware, path):
+    environ = {'PATH_INFO': path}
+    result = middleware(environ, lambda status, headers, exc_info: len)
+    body = ''.join(result)
+    result.close()
+    return body
+
+
+def test_middleware(directory):
+    middleware = MetricsMiddleware(app, directory)
+    assert request(middleware, '/foo') == 'defg'
+    request(middleware, '/foo')
+    request(middleware, '/bar')
+    with pytest.raises(ValueError):
+        request(middleware, '/error')
+
+    lines = read_metrics(directory).splitlines()
+    assert ('sitescripts_http_requests_total'
+            '{url="/foo",status="200"} 2') in lines
+    assert 'sitescripts_http_requests_total{url="",status="500"} 1' in lines
+    assert 'sitescripts_http_response_bytes_total{url="/foo"} 14' in lines
+    assert ('sitescripts_http_request_duration_seconds_bucket'
+            '{url="/bar",le="10"} 1') in lines
+    assert ('sitescripts_http_request_duration_seconds_bucket'
+            '{url="/bar",le="+Inf"} 1') in lines
+    assert ('sitescripts_http_request_duration_seconds_count'
+            '{url="/foo"} 2') in lines
+    assert ('# TYPE sitescripts_http_request_duration_seconds '
+            'histogram') in lines
+
+
+def test_queue_metrics(directory):
+    middleware = MetricsMiddleware(app, directory)
+    middleware.record('/foo', '200', 0, 0.5, queue_wait=0.2)
+    middleware.record('/foo', '503', 0, 1, queue_wait=1)
+    middleware.record_queue_change('/foo', 1)
+    middleware.record_queue_change('/foo', 1)
+    middleware.record_queue_change('/foo', -1)
+
+    lines = read_metrics(directory).splitlines()
+    assert 'sitescripts_http_queued_requests{url="/foo"} 1' in lines
+    assert ('sitescripts_http_queue_wait_seconds_bucket'
+            '{url="/foo",le="0.25"} 1') in lines
+    assert ('sitescripts_http_queue_wait_seconds_bucket'
+            '{url="/foo",le="1"} 2') in lines
+    assert ('sitescripts_http_queue_wait_seconds_sum'
+            '{url="/foo"} 1.2') in lines
+    assert ('sitescripts_http_request_duration_seconds_sum'
+            '{url="/foo"} 1.5') in lines
+
+
+def test_metrics_authentication(directory, mocker):
+    config = SafeConfigParser({'basic_auth_realm': 'test'})
+    config.add_section('metrics')
+    config.set('metrics', 'directory', directory)
+    config.set('metrics', 'basic_auth_username', 'user')
+    config.set('metrics', 'basic_auth_password', 'secret')
+    mocker.patch.object(web, 'get_config', lambda: config)
+    mocker.patch.object(metrics, 'get_config', lambda: config)
+    request(MetricsMiddleware(app, directory), '/foo')
+
+    statuses = []
+
+    def start_response(status, headers):
+        statuses.append(status)
+
+    environ = {'PATH_INFO': '/metrics'}
+    metrics.metrics(environ, start_response)
+    environ['HTTP_AUTHORIZATION'] = 'Basic ' + base64.b64encode(
+        'user:secret',
+    )
+    body = ''.join(metrics.metrics(environ, start_response))
+    assert statuses == ['401 UNAUTHORIZED', '200 OK']
+    assert 'sitescripts_http_requests_total{url="/foo",status="200"} 1' in body
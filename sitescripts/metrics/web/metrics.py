@@ -0,0 +1,30 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+from sitescripts.metrics.middleware import read_metrics
+from sitescripts.utils import get_config
+from sitescripts.web import basic_auth, compress_response, url_handler
+
+
+@url_handler('/metrics')
+@basic_auth('metrics')
+@compress_response()
+def metrics(environ, start_response):
+    directory = get_config().get('metrics', 'directory')
+    start_response('200 OK', [
+        ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ('Cache-Control', 'no-cache'),
+    ])
+    return [read_metrics(directory)]
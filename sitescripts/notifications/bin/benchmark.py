@@ -0,0 +1,137 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the /notification.json response generation.
+
+Compares the requests per second of the handler, which assembles the
+response from serialized fragments, with serializing the whole response on
+each request as it used to be done.
+"""
+
+import argparse
+import copy
+import json
+import time
+import urlparse
+
+from sitescripts.notifications.response import (assign_groups,
+                                                determine_groups)
+from sitescripts.notifications.store import Snapshot
+import sitescripts.notifications.web.notification as handler
+
+LOCALES = ['en-US', 'de', 'fr', 'es', 'ru', 'zh-CN', 'ja', 'pt-BR']
+
+
+class _StaticStore(object):
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get_snapshot(self):
+        return self.snapshot
+
+
+def _create_notifications(count):
+    notifications = []
+    for i in range(count):
+        notifications.append({
+            'id': 'notification-%d' % i,
+            'severity': 'normal',
+            'title': {locale: u'Title %d (%s)' % (i, locale)
+                      for locale in LOCALES},
+            'message': {locale: u'Message %d (%s) <a>link</a>' % (i, locale)
+                        for locale in LOCALES},
+            'links': ['https://adblockplus.org/'],
+            'targets': [{'extension': 'adblockplus',
+                         'extensionMinVersion': '3.0'}],
+        })
+    return notifications
+
+
+def _legacy_notification(notifications, environ):
+    # The response generation as done before serialized fragments were
+    # introduced: copying and serializing everything on each request.
+    params = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+    version = params.get('lastVersion', [''])[0]
+    groups = determine_groups(version, notifications)
+    notifications = [x for x in notifications if not x.get('inactive', False)]
+    assign_groups(groups, notifications)
+
+    notifications_to_send = []
+    for notification in notifications:
+        if not (notification.get('title') and notification.get('message')):
+            continue
+        if 'variants' in notification:
+            notification = copy.deepcopy(notification)
+            del notification['variants']
+        notifications_to_send.append(notification)
+    version = time.strftime('%Y%m%d%H%M', time.gmtime())
+    for group in groups:
+        version += '-%s/%s' % (group['id'], group['variant'])
+    response = {
+        'version': version,
+        'notifications': notifications_to_send,
+    }
+    return json.dumps(response, ensure_ascii=False, indent=2,
+                      separators=(',', ': '), sort_keys=True).encode('utf-8')
+
+
+def _measure(func, duration):
+    count = 0
+    start_time = time.time()
+    end_time = start_time + duration
+    while True:
+        for i in xrange(100):
+            func()
+        count += 100
+        current_time = time.time()
+        if current_time >= end_time:
+            return count / (current_time - start_time)
+
+
+def run_benchmark(counts, duration):
+    environ = {'QUERY_STRING': 'lastVersion=197001010000'}
+
+    def start_response(status, headers):
+        pass
+
+    print '%14s %16s %16s %8s' % (
+        'notifications', 'legacy (req/s)', 'current (req/s)', 'speedup',
+    )
+    for count in counts:
+        notifications = _create_notifications(count)
+        handler._store = _StaticStore(Snapshot('0' * 40, tuple(notifications),
+                                               None))
+        legacy = _measure(lambda: _legacy_notification(notifications, environ),
+                          duration)
+        current = _measure(lambda: handler.notification(environ,
+                                                        start_response),
+                           duration)
+        print '%14d %16.0f %16.0f %7.1fx' % (count, legacy, current,
+                                             current / legacy)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--notifications', type=int, nargs='+',
+                        default=[1, 10, 100],
+                        help='Numbers of active notifications to test with')
+    parser.add_argument('-t', '--time', type=float, default=3,
+                        help='Seconds to measure each variant for')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.notifications, args.time)
@@ -0,0 +1,211 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pre-render /notification.json responses into static files.
+
+The response to a request only depends on the groups in its `lastVersion`
+parameter and on the variant the client is randomly assigned to. For each
+set of groups and each variant that can be sampled, a complete response is
+rendered into the output directory. `index.json` maps the groups part of
+`lastVersion` (i.e. without the timestamp) to the files along with the upper
+bound of the random selection for each file, `nginx.conf` contains the same
+mapping as nginx configuration, so that these requests can be served
+without the URL handler. Requests with groups for notifications that
+aren't active or don't have variants aren't covered and have to be passed
+on to the URL handler.
+
+This needs to run whenever the notifications change and whenever the start
+or end time of a notification passes. The `version` of the pre-rendered
+responses is the minute it ran, where the URL handler uses the minute of
+the request, so it also needs to run (e.g. from cron) at least as often as
+clients are supposed to get a new version. The files of the previous run
+are kept, so that they can still be served until nginx is reloaded.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import urllib
+
+from sitescripts.notifications.parser import get_revision, load_notifications
+from sitescripts.notifications.response import (Fragments, assign_groups,
+                                                create_response)
+from sitescripts.notifications.store import Snapshot
+from sitescripts.utils import get_config
+
+# Limit for the number of group sets, the number of files is a multiple
+MAX_GROUP_SETS = 1000
+
+
+def _get_group_sets(fragments):
+    grouped = [notification for notification in fragments.notifications
+               if 'variants' in notification]
+    choices = [[None] + range(len(notification['variants']) + 1)
+               for notification in grouped]
+    count = reduce(lambda result, x: result * len(x), choices, 1)
+    if count > MAX_GROUP_SETS:
+        raise Exception('Notifications result in {} group sets, more than '
+                        'the limit of {}'.format(count, MAX_GROUP_SETS))
+
+    for variants in itertools.product(*choices):
+        yield [{'id': notification['id'], 'variant': variant}
+               for notification, variant in zip(grouped, variants)
+               if variant is not None]
+
+
+def _get_selections(fragments, groups):
+    """Yield a selection and its upper bound for each possible assignment."""
+    assigned = {group['id'] for group in groups}
+    start = 0
+    for notification in fragments.notifications:
+        if 'variants' in notification and notification['id'] not in assigned:
+            for variant in notification['variants']:
+                end = min(start + variant['sample'], 1)
+                if end > start:
+                    yield (start + end) / 2.0, end
+                start = end
+    if start < 1:
+        yield (start + 1) / 2.0, 1
+
+
+def _get_suffix(groups):
+    return ''.join('-%s/%s' % (group['id'], group['variant'])
+                   for group in groups)
+
+
+def render_responses(notifications, revision):
+    """Render the responses for all group sets and variants.
+
+    Returns the index (as described above) and a dict mapping file names to
+    the rendered responses.
+    """
+    fragments = Fragments(Snapshot(revision, tuple(notifications), None))
+    positions = {notification['id']: i
+                 for i, notification in enumerate(fragments.notifications)}
+    index = {'revision': revision, 'groups': {}, 'versions': {}}
+    files = {}
+    aliases = {}
+    for groups in _get_group_sets(fragments):
+        entries = []
+        for selection, bound in _get_selections(fragments, groups):
+            assigned_groups = [dict(group) for group in groups]
+            assign_groups(assigned_groups, fragments.notifications, selection)
+            version, body = create_response(fragments, assigned_groups)
+            name = hashlib.sha1(body).hexdigest() + '.json'
+            files[name] = body
+            index['versions'][name] = version
+            entries.append([bound, name])
+
+            # Clients send the groups back in the order of the version they
+            # got, which lists newly assigned groups last.
+            canonical = sorted(assigned_groups,
+                               key=lambda group: positions[group['id']])
+            aliases[_get_suffix(assigned_groups)] = _get_suffix(canonical)
+        index['groups'][_get_suffix(groups)] = entries
+
+    for alias, suffix in aliases.iteritems():
+        index['groups'].setdefault(alias, index['groups'][suffix])
+    return index, files
+
+
+def get_response_file(index, last_version, selection):
+    """Look up the file to send for a request, or None if there is none.
+
+    `selection` is a number in [0, 1) used to pick one of the files for the
+    groups of the request, just like the URL handler assigns groups.
+    """
+    suffix = last_version.lstrip('0123456789')
+    for bound, name in index['groups'].get(suffix, []):
+        if selection <= bound:
+            return name
+    return None
+
+
+def _write_nginx_config(path, index):
+    lines = [
+        '# Generated by sitescripts.notifications.bin.generate_static',
+        'map $arg_lastVersion $abp_notification_groups {',
+        '  "~^[0-9]*(?<groups>.*)$" $groups;',
+        '}',
+        '',
+        'map $abp_notification_groups $abp_notification_file {',
+        '  default "";',
+    ]
+    split_clients = []
+    for i, (suffix, entries) in enumerate(sorted(index['groups'].items())):
+        variable = '$abp_notification_%d' % i
+        for key in {suffix, urllib.quote(suffix, safe='-')}:
+            lines.append('  "%s" %s;' % (key, variable))
+        split_clients += [
+            '',
+            'split_clients "${remote_addr}${arg_lastVersion}" %s {' % variable,
+        ]
+        start = 0
+        for bound, name in entries[:-1]:
+            end = round(bound * 100, 2)
+            if end > start:
+                split_clients.append('  %.2f%% %s;' % (end - start, name))
+            start = end
+        split_clients += ['  * %s;' % entries[-1][1], '}']
+    lines.append('}')
+    lines += split_clients
+    lines += ['', 'map $abp_notification_file $abp_notification_version {',
+              '  default "";']
+    for name, version in sorted(index['versions'].items()):
+        lines.append('  %s "%s";' % (name, version))
+    lines.append('}')
+
+    with open(path, 'wb') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def _write_file(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.rename(temp_path, path)
+
+
+def _read_previous_files(output_dir):
+    try:
+        with open(os.path.join(output_dir, 'index.json'), 'rb') as file:
+            return set(json.load(file)['versions'])
+    except (IOError, ValueError, KeyError):
+        return set()
+
+
+def generate_static(output_dir):
+    revision = get_revision()
+    index, files = render_responses(load_notifications(revision), revision)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    # The nginx configuration that is loaded still refers to these
+    previous_files = _read_previous_files(output_dir)
+    for name, body in files.iteritems():
+        _write_file(os.path.join(output_dir, name), body)
+    _write_file(os.path.join(output_dir, 'index.json'),
+                json.dumps(index, indent=2, sort_keys=True))
+    _write_nginx_config(os.path.join(output_dir, 'nginx.conf'), index)
+
+    for name in os.listdir(output_dir):
+        if name.endswith('.json') and name != 'index.json' and \
+                name not in files and name not in previous_files:
+            os.remove(os.path.join(output_dir, name))
+
+
+if __name__ == '__main__':
+    generate_static(get_config().get('notifications', 'static_output'))
@@ -15,13 +15,10 @@
 
 import codecs
 import datetime
-import os
 import re
-import subprocess
-import tarfile
 import traceback
-from StringIO import StringIO
 
+from sitescripts.hgarchive import get_archive, resolve
 from sitescripts.utils import get_config
 
 
@@ -128,30 +125,48 @@ def _parse_notification(data, name):
     return notification
 
 
-def load_notifications():
+def get_revision():
+    """Return the node id of the default branch head of the repository."""
+    return resolve(get_config().get('notifications', 'repository'))
+
+
+def read_notifications(revision='default'):
+    """Parse all notification files in the given revision of the repository.
+
+    Unlike load_notifications() this keeps the `start` and `end` keys, so
+    that the active state can be determined later on via
+    set_active_state().
+    """
     repo = get_config().get('notifications', 'repository')
-    command = ['hg', '-R', repo, 'archive', '-r', 'default', '-t', 'tar',
-               '-p', '.', '-X', os.path.join(repo, '.hg_archival.txt'), '-']
-    data = subprocess.check_output(command)
+    archive = get_archive(repo, revision)
 
     notifications = []
-    with tarfile.open(mode='r:', fileobj=StringIO(data)) as archive:
-        for fileinfo in archive:
-            name = fileinfo.name
-            if name.startswith('./'):
-                name = name[2:]
-
-            if fileinfo.type == tarfile.REGTYPE:
-                data = codecs.getreader('utf8')(archive.extractfile(fileinfo))
-                try:
-                    notification = _parse_notification(data, name)
-                    if not 'inactive' in notification:
-                        current_time = datetime.datetime.now()
-                        start = notification.pop('start', current_time)
-                        end = notification.pop('end', current_time)
-                        if not start <= current_time <= end:
-                            notification['inactive'] = True
-                    notifications.append(notification)
-                except:
-                    traceback.print_exc()
+    for name in archive.list_files():
+        with archive.open(name) as file:
+            data = codecs.getreader('utf8')(file)
+            try:
+                notifications.append(_parse_notification(data, name))
+            except:
+                traceback.print_exc()
+    return notifications
+
+
+def set_active_state(notification, current_time):
+    """Mark the notification inactive if current_time is outside its range.
+
+    The `start` and `end` keys are removed from notifications that haven't
+    been explicitly set inactive.
+    """
+    if not 'inactive' in notification:
+        start = notification.pop('start', current_time)
+        end = notification.pop('end', current_time)
+        if not start <= current_time <= end:
+            notification['inactive'] = True
+
+
+def load_notifications(revision='default'):
+    notifications = read_notifications(revision)
+    current_time = datetime.datetime.now()
+    for notification in notifications:
+        set_active_state(notification, current_time)
     return notifications
@@ -0,0 +1,168 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generation of /notification.json responses.
+
+This is shared by the URL handler and the generator of static responses.
+"""
+
+import copy
+import json
+import random
+import time
+
+from sitescripts.notifications.targets import TargetIndex, targets_match
+
+# Query parameters describing the client, used to filter by target if the
+# client passes filterTargets=1
+CLIENT_PARAMS = {
+    'addonName': 'extension',
+    'addonVersion': 'extensionVersion',
+    'application': 'application',
+    'applicationVersion': 'applicationVersion',
+    'platform': 'platform',
+    'platformVersion': 'platformVersion',
+}
+
+
+def determine_groups(version, notifications):
+    version_groups = dict(x.split('/') for x in version.split('-')[1:]
+                          if x.count('/') == 1)
+    groups = []
+    for notification in notifications:
+        group_id = notification['id']
+        if group_id in version_groups:
+            groups.append({'id': group_id,
+                           'variant': int(version_groups[group_id])})
+    return groups
+
+
+def assign_groups(groups, notifications, selection=None):
+    if selection is None:
+        selection = random.random()
+    start = 0
+    for notification in notifications:
+        if 'variants' not in notification:
+            continue
+        if notification['id'] in [g['id'] for g in groups]:
+            continue
+        group = {'id': notification['id'], 'variant': 0}
+        groups.append(group)
+        for i, variant in enumerate(notification['variants']):
+            sample_size = variant['sample']
+            end = start + sample_size
+            selected = sample_size > 0 and start <= selection <= end
+            start = end
+            if selected:
+                group['variant'] = i + 1
+                break
+
+
+def _merge_variant(notification, variant):
+    notification = copy.deepcopy(notification)
+    notification.update(variant)
+    for key_to_remove in ('sample', 'variants'):
+        notification.pop(key_to_remove, None)
+    return notification
+
+
+def _can_be_shown(notification):
+    return (notification.get('title', None) and
+            notification.get('message', None))
+
+
+def _generate_version(groups):
+    version = time.strftime('%Y%m%d%H%M', time.gmtime())
+    for group in groups:
+        version += '-%s/%s' % (group['id'], group['variant'])
+    return version
+
+
+def _serialize(notification):
+    """Serialize a notification the way it's indented in the response."""
+    data = json.dumps(notification, ensure_ascii=False, indent=2,
+                      separators=(',', ': '), sort_keys=True)
+    return data.replace('\n', '\n    ').encode('utf-8')
+
+
+class Fragments(object):
+    """Serialized notifications of a snapshot, ready to be sent.
+
+    `default` contains the serialized active notifications that can be shown
+    outside of any group, `variants` maps the ID of each notification with
+    variants to a list containing the serialized merged variants and their
+    targets (or None if the merged variant can't be shown).
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.notifications = [x for x in snapshot.notifications
+                              if not x.get('inactive', False)]
+        self.default = []
+        self.variants = {}
+        default_targets = []
+        for notification in self.notifications:
+            if _can_be_shown(notification):
+                default = dict(notification)
+                default.pop('variants', None)
+                self.default.append(_serialize(default))
+                default_targets.append(notification.get('targets'))
+            if 'variants' in notification:
+                self.variants[notification['id']] = [
+                    (_serialize(variant), variant.get('targets'))
+                    if _can_be_shown(variant) else None
+                    for variant in (_merge_variant(notification, x)
+                                    for x in notification['variants'])
+                ]
+        self.default_index = TargetIndex(default_targets)
+
+
+def _get_notifications_to_send(fragments, groups, client=None):
+    for group in groups:
+        variant = group['variant']
+        if variant == 0 or group['id'] not in fragments.variants:
+            continue
+        entry = fragments.variants[group['id']][variant - 1]
+        if entry is None:
+            return []
+        serialized, targets = entry
+        if client is not None and not targets_match(targets, client):
+            return []
+        return [serialized]
+
+    if client is not None:
+        return [fragments.default[i]
+                for i in fragments.default_index.match(client)]
+    return fragments.default
+
+
+def get_client(params):
+    if params.get('filterTargets', [''])[0] not in ('1', 'true'):
+        return None
+    return {key: params[param][0] for param, key in CLIENT_PARAMS.iteritems()
+            if param in params}
+
+
+def create_response(fragments, groups, client=None):
+    version = _generate_version(groups)
+    notifications = _get_notifications_to_send(fragments, groups, client)
+    if notifications:
+        notifications = '\n    ' + ',\n    '.join(notifications) + '\n  '
+    else:
+        notifications = ''
+    return version, ''.join([
+        '{\n  "notifications": [', notifications, '],\n  "version": ',
+        json.dumps(version), '\n}',
+    ])
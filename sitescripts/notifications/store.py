@@ -0,0 +1,157 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-memory store of the parsed notifications, keyed on the revision.
+
+Each worker process keeps the notifications of the current head of the
+notifications repository in memory. Requests are served from an immutable
+snapshot, while changes to the repository are picked up in a background
+thread, so no request has to wait for `hg` unless there is no snapshot yet.
+"""
+
+import datetime
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from sitescripts.notifications.parser import (get_revision,
+                                              read_notifications,
+                                              set_active_state)
+from sitescripts.utils import get_config
+
+# Default number of seconds between two checks for a new revision
+CHECK_INTERVAL = 10
+
+# `notifications` is a tuple of the notifications that are active or
+# inactive at the time the snapshot is created. It's shared between all
+# requests, so neither the tuple nor the notifications must be modified.
+# `expires` is the next start or end time of a notification, after which the
+# active state of the notifications has to be determined again (or None).
+Snapshot = namedtuple('Snapshot', ['revision', 'notifications', 'expires'])
+
+
+def _create_snapshot(revision, notifications, current_time):
+    result = []
+    expires = None
+    for notification in notifications:
+        for key in ('start', 'end'):
+            if key in notification and notification[key] > current_time:
+                expires = min(expires or notification[key], notification[key])
+        notification = dict(notification)
+        set_active_state(notification, current_time)
+        result.append(notification)
+    return Snapshot(revision, tuple(result), expires)
+
+
+class NotificationStore(object):
+    def __init__(self, check_interval=None):
+        if check_interval is None:
+            config = get_config()
+            if config.has_option('notifications', 'check_interval'):
+                check_interval = config.getfloat('notifications',
+                                                 'check_interval')
+            else:
+                check_interval = CHECK_INTERVAL
+        self.check_interval = check_interval
+
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._notifications = None
+        self._last_check = 0
+        self._thread = None
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'last_refresh_duration': None,
+        }
+
+    def get_snapshot(self):
+        """Return the snapshot of the current notifications.
+
+        Only the very first call loads the notifications synchronously. If
+        the revision check is due, it's started in a background thread and
+        the current snapshot is returned in the meantime.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._last_check = time.time()
+                    self._refresh()
+                    self._count('misses')
+                    return self._snapshot
+                snapshot = self._snapshot
+
+        current_time = datetime.datetime.now()
+        if snapshot.expires is not None and current_time >= snapshot.expires:
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = _create_snapshot(snapshot.revision,
+                                                      self._notifications,
+                                                      current_time)
+                snapshot = self._snapshot
+
+        if time.time() - self._last_check >= self.check_interval:
+            self._start_refresh()
+
+        self._count('hits')
+        return snapshot
+
+    def get_stats(self):
+        """Return the hit counters and refresh latency of this store."""
+        with self._lock:
+            stats = dict(self._stats)
+            if self._snapshot is not None:
+                stats['revision'] = self._snapshot.revision
+            return stats
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._last_check = time.time()
+            self._thread = threading.Thread(target=self._refresh_in_background)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception:
+            traceback.print_exc()
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+
+    def _refresh(self):
+        revision = get_revision()
+        if self._snapshot is not None and self._snapshot.revision == revision:
+            return
+
+        start_time = time.time()
+        notifications = read_notifications(revision)
+        snapshot = _create_snapshot(revision, notifications,
+                                    datetime.datetime.now())
+        with self._lock:
+            self._notifications = notifications
+            self._snapshot = snapshot
+            self._stats['refreshes'] += 1
+            self._stats['last_refresh_duration'] = time.time() - start_time
@@ -0,0 +1,136 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Server-side matching of notification targets against a client.
+
+Clients are described by a dict that can contain the keys `extension`,
+`application` and `platform` as well as the corresponding `...Version` keys.
+Any key that is missing is unknown, so targets are only ruled out by what
+the client told us. Targets for `blockedTotal` and `locales` are always
+considered matching, it's up to the client to evaluate those.
+"""
+
+import bisect
+import functools
+
+from sitescripts.extensions.utils import compareVersions
+
+TARGET_TYPES = ('extension', 'application', 'platform')
+
+_version_key = functools.cmp_to_key(compareVersions)
+
+
+def target_matches(target, client):
+    """Check whether a single target can match the client."""
+    for target_type in TARGET_TYPES:
+        value = client.get(target_type)
+        if value is not None and target.get(target_type, value) != value:
+            return False
+
+        version = client.get(target_type + 'Version')
+        if version is None:
+            continue
+        min_version = target.get(target_type + 'MinVersion')
+        if min_version and compareVersions(version, min_version) < 0:
+            return False
+        max_version = target.get(target_type + 'MaxVersion')
+        if max_version and compareVersions(version, max_version) > 0:
+            return False
+    return True
+
+
+def targets_match(targets, client):
+    """Check whether any of the targets (if any) can match the client."""
+    if not targets:
+        return True
+    return any(target_matches(target, client) for target in targets)
+
+
+def _key_matches(value, key_value):
+    return value is None or key_value is None or value == key_value
+
+
+class _Bucket(object):
+    """Targets for one extension and application, sorted by min version."""
+
+    def __init__(self):
+        self.unbounded = []
+        self.bounded = []
+
+    def add(self, index, target):
+        min_version = target.get('extensionMinVersion')
+        if min_version is None:
+            self.unbounded.append((index, target))
+        else:
+            self.bounded.append((_version_key(min_version), index, target))
+
+    def finish(self):
+        self.bounded.sort(key=lambda entry: entry[0])
+        self.keys = [key for key, index, target in self.bounded]
+
+    def get_candidates(self, version):
+        if version is None:
+            end = len(self.bounded)
+        else:
+            end = bisect.bisect_right(self.keys, _version_key(version))
+        for candidate in self.unbounded:
+            yield candidate
+        for key, index, target in self.bounded[:end]:
+            yield index, target
+
+
+class TargetIndex(object):
+    """Index over the targets of a list of entries (e.g. notifications).
+
+    `entries` is a list with the list of targets of each entry, match()
+    returns the indexes of the entries that can match a client. Targets are
+    grouped by extension and application and sorted by the minimal extension
+    version, so only the targets that could apply are checked in full.
+    """
+
+    def __init__(self, entries):
+        self._untargeted = []
+        self._buckets = {}
+        for index, targets in enumerate(entries):
+            if not targets:
+                self._untargeted.append(index)
+                continue
+            for target in targets:
+                key = (target.get('extension'), target.get('application'))
+                self._buckets.setdefault(key, _Bucket()).add(index, target)
+        for bucket in self._buckets.itervalues():
+            bucket.finish()
+
+    def _get_buckets(self, client):
+        extension = client.get('extension')
+        application = client.get('application')
+        if extension is not None and application is not None:
+            keys = [(extension, application), (extension, None),
+                    (None, application), (None, None)]
+            return [self._buckets[key] for key in keys
+                    if key in self._buckets]
+        return [bucket for key, bucket in self._buckets.iteritems()
+                if _key_matches(extension, key[0]) and
+                _key_matches(application, key[1])]
+
+    def match(self, client):
+        """Return the sorted indexes of the entries matching the client."""
+        result = set(self._untargeted)
+        version = client.get('extensionVersion')
+        for bucket in self._get_buckets(client):
+            for index, target in bucket.get_candidates(version):
+                if index not in result and target_matches(target, client):
+                    result.add(index)
+        return sorted(result)
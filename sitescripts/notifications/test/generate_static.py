@@ -0,0 +1,131 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import re
+
+import mock
+import pytest
+
+from sitescripts.notifications.bin import generate_static
+from sitescripts.notifications.response import (Fragments, assign_groups,
+                                                create_response,
+                                                determine_groups)
+from sitescripts.notifications.store import Snapshot
+
+NOTIFICATIONS = [
+    {'id': '1', 'title': {'en-US': '1'}, 'message': {'en-US': '1'}},
+    {
+        'id': 'a',
+        'title': {'en-US': 'a'},
+        'message': {'en-US': 'a'},
+        'variants': [
+            {'sample': 0.25, 'title': {'en-US': 'a1'}},
+            {'sample': 0.25, 'title': {'en-US': 'a2'}},
+        ],
+    },
+    {
+        'id': 'b',
+        'variants': [
+            {'sample': 0.1, 'title': {'en-US': 'b1'},
+             'message': {'en-US': 'b1'}},
+        ],
+    },
+    {'id': 'c', 'inactive': True, 'title': {'en-US': 'c'},
+     'message': {'en-US': 'c'}},
+]
+
+LAST_VERSIONS = [
+    '', '201801010000', '201801010000-a/0', '201801010000-a/2',
+    '201801010000-b/1', '201801010000-a/0-b/0', '201801010000-b/0-a/1',
+    '201801010000-a/1-b/1',
+]
+
+# The URL handler can assign a client to two groups if the selection is
+# exactly on the border between them, these values are not.
+SELECTIONS = [0.05, 0.2, 0.3, 0.45, 0.55, 0.65, 0.9, 0.999]
+
+
+def _strip_version(body):
+    return re.sub(r'"version": "\d+', '"version": "', body)
+
+
+@pytest.fixture
+def rendered():
+    return generate_static.render_responses(NOTIFICATIONS, 'a' * 40)
+
+
+@pytest.mark.parametrize('last_version', LAST_VERSIONS)
+@pytest.mark.parametrize('selection', SELECTIONS)
+def test_same_as_handler(rendered, last_version, selection):
+    index, files = rendered
+    name = generate_static.get_response_file(index, last_version, selection)
+
+    fragments = Fragments(Snapshot('a' * 40, tuple(NOTIFICATIONS), None))
+    groups = determine_groups(last_version, NOTIFICATIONS)
+    assign_groups(groups, fragments.notifications, selection)
+    version, body = create_response(fragments, groups)
+
+    assert _strip_version(files[name]) == _strip_version(body)
+    assert index['versions'][name][12:] == version[12:]
+
+
+@pytest.mark.parametrize('last_version', [
+    '201801010000-c/0', '201801010000-a/3', '201801010000-1/0',
+])
+def test_not_covered(rendered, last_version):
+    index, files = rendered
+    assert generate_static.get_response_file(index, last_version, 0) is None
+
+
+def test_too_many_group_sets():
+    notifications = [{'id': str(i), 'variants': [{'sample': 0}]}
+                     for i in range(10)]
+    with pytest.raises(Exception):
+        generate_static.render_responses(notifications, 'a' * 40)
+
+
+def _generate_static(output_dir, notifications):
+    with mock.patch.object(generate_static, 'get_revision',
+                           return_value='a' * 40), \
+            mock.patch.object(generate_static, 'load_notifications',
+                              return_value=notifications):
+        generate_static.generate_static(output_dir.strpath)
+    return json.loads(output_dir.join('index.json').read())
+
+
+def test_generate_static(tmpdir):
+    tmpdir.join('outdated.json').write('{}')
+    index = _generate_static(tmpdir, NOTIFICATIONS)
+    assert index['revision'] == 'a' * 40
+    assert not tmpdir.join('outdated.json').exists()
+    for name in index['versions']:
+        assert tmpdir.join(name).exists()
+
+    nginx_config = tmpdir.join('nginx.conf').read()
+    assert '"-a%2F0-b%2F0" $abp_notification_' in nginx_config
+    assert '  25.00% ' in nginx_config
+
+
+def test_previous_files_kept(tmpdir):
+    first = set(_generate_static(tmpdir, NOTIFICATIONS)['versions'])
+    second = set(_generate_static(tmpdir, NOTIFICATIONS[:1])['versions'])
+    # nginx might still serve the files of the previous run until reloaded
+    assert {path.basename for path in tmpdir.listdir('*.json')} == \
+        first | second | {'index.json'}
+
+    third = set(_generate_static(tmpdir, NOTIFICATIONS[:2])['versions'])
+    assert {path.basename for path in tmpdir.listdir('*.json')} == \
+        second | third | {'index.json'}
@@ -18,33 +18,42 @@ import mock
 import unittest
 
 import sitescripts.notifications.web.notification as notification
+from sitescripts.notifications.store import Snapshot
+
+
+def _get_response(environ, start_response):
+    return ''.join(notification.notification(environ, start_response))
 
 
 class TestNotification(unittest.TestCase):
     def setUp(self):
-        self.load_notifications_patcher = mock.patch('sitescripts.notifications.web.notification.load_notifications')
-        self.load_notifications_mock = self.load_notifications_patcher.start()
+        self.get_snapshot_patcher = mock.patch.object(notification._store,
+                                                      'get_snapshot')
+        get_snapshot_mock = self.get_snapshot_patcher.start()
+        get_snapshot_mock.side_effect = lambda: Snapshot(
+            'default', tuple(self.notifications), None,
+        )
 
     def tearDown(self):
-        self.load_notifications_patcher.stop()
+        self.get_snapshot_patcher.stop()
 
     def test_no_group(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
         ]
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], '1')
         self.assertFalse('-' in result['version'])
 
     def test_not_in_group(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': 'a', 'variants': [
                 {'title': {'en-US': ''}, 'message': {'en-US': ''}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -52,13 +61,13 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/0')
 
     def test_in_group(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': 'a', 'variants': [
                 {'title': {'en-US': ''}, 'message': {'en-US': ''}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/1',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -66,7 +75,7 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/1')
 
     def test_not_in_one_of_many_groups(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': 'a', 'variants': [
                 {'title': {'en-US': ''}, 'message': {'en-US': ''}},
@@ -78,7 +87,7 @@ class TestNotification(unittest.TestCase):
                 {'title': {'en-US': ''}, 'message': {'en-US': ''}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0-b/0-c/0',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -86,7 +95,7 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/0-b/0-c/0')
 
     def test_in_one_of_many_groups(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': 'a', 'variants': [
                 {'title': {'en-US': ''}, 'message': {'en-US': ''}},
@@ -98,7 +107,7 @@ class TestNotification(unittest.TestCase):
                 {'title': {'en-US': ''}, 'message': {'en-US': ''}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0-b/1-c/0',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -106,13 +115,13 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/0-b/1-c/0')
 
     def test_not_put_in_group(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': 'a', 'variants': [
                 {'sample': 0, 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -120,13 +129,13 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/0')
 
     def test_put_in_group(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': 'a', 'variants': [
                 {'sample': 1, 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -134,7 +143,7 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/1')
 
     def test_notification_variant_merged(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {
                 'id': 'a',
                 'title': {'en-US': 'default'},
@@ -144,7 +153,7 @@ class TestNotification(unittest.TestCase):
                 ],
             },
         ]
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], 'a')
         self.assertEqual(result['notifications'][0]['title']['en-US'], 'default')
@@ -153,15 +162,15 @@ class TestNotification(unittest.TestCase):
         self.assertFalse('sample' in result['notifications'][0])
 
     def test_no_variant_no_notifications(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': 'a', 'variants': [{'sample': 0}]},
         ]
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 0)
 
     @mock.patch('random.random')
     def test_probability_distribution_single_group(self, random_call):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {
                 'id': 'a',
                 'variants': [
@@ -172,39 +181,39 @@ class TestNotification(unittest.TestCase):
             },
         ]
         random_call.return_value = 0
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['title']['en-US'], '1')
         self.assertRegexpMatches(result['version'], r'-a/1')
         random_call.return_value = 0.5
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['title']['en-US'], '1')
         self.assertRegexpMatches(result['version'], r'-a/1')
         random_call.return_value = 0.51
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['title']['en-US'], '2')
         self.assertRegexpMatches(result['version'], r'-a/2')
         random_call.return_value = 0.75
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['title']['en-US'], '2')
         self.assertRegexpMatches(result['version'], r'-a/2')
         random_call.return_value = 0.751
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['title']['en-US'], '3')
         self.assertRegexpMatches(result['version'], r'-a/3')
         random_call.return_value = 1
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['title']['en-US'], '3')
         self.assertRegexpMatches(result['version'], r'-a/3')
 
     @mock.patch('random.random')
     def test_probability_distribution_multiple_groups(self, random_call):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {
                 'id': 'a',
                 'variants': [
@@ -221,32 +230,32 @@ class TestNotification(unittest.TestCase):
             },
         ]
         random_call.return_value = 0
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], 'a')
         self.assertEqual(result['notifications'][0]['title']['en-US'], '1')
         self.assertRegexpMatches(result['version'], r'-a/1-b/0')
         random_call.return_value = 0.251
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], 'a')
         self.assertEqual(result['notifications'][0]['title']['en-US'], '2')
         self.assertRegexpMatches(result['version'], r'-a/2-b/0')
         random_call.return_value = 0.51
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], 'b')
         self.assertEqual(result['notifications'][0]['title']['en-US'], '1')
         self.assertRegexpMatches(result['version'], r'-a/0-b/1')
         random_call.return_value = 0.751
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], 'b')
         self.assertEqual(result['notifications'][0]['title']['en-US'], '2')
         self.assertRegexpMatches(result['version'], r'-a/0-b/2')
 
     def test_invalid_last_version(self):
-        self.load_notifications_mock.return_value = []
+        self.notifications = []
         notification.notification({'QUERY_STRING': 'lastVersion='},
                                   lambda *args: None)
         notification.notification({'QUERY_STRING': 'lastVersion=-'},
@@ -257,7 +266,7 @@ class TestNotification(unittest.TestCase):
                                   lambda *args: None)
 
     def test_version_header_present(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
         ]
         response_header_map = {}
@@ -265,12 +274,12 @@ class TestNotification(unittest.TestCase):
         def start_response(status, response_headers):
             for name, value in response_headers:
                 response_header_map[name] = value
-        result = json.loads(notification.notification({}, start_response))
+        result = json.loads(_get_response({}, start_response))
         self.assertEqual(result['version'],
                          response_header_map['ABP-Notification-Version'])
 
     def test_default_group_notification_returned_if_valid(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {
                 'id': 'a',
@@ -281,7 +290,7 @@ class TestNotification(unittest.TestCase):
                 ],
             },
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 2)
@@ -292,7 +301,7 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/0')
 
     def test_default_group_notification_not_returned_if_invalid(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {
                 'id': 'a',
@@ -302,7 +311,7 @@ class TestNotification(unittest.TestCase):
                 ],
             },
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
@@ -310,7 +319,7 @@ class TestNotification(unittest.TestCase):
         self.assertRegexpMatches(result['version'], r'-a/0')
 
     def test_invalid_notification_not_returned(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
             {'id': '2', 'title': {'en-US': ''}, 'message': {}},
             {'id': '3', 'title': {}, 'message': {'en-US': ''}},
@@ -318,33 +327,33 @@ class TestNotification(unittest.TestCase):
             {'id': '5', 'message': {}},
             {'id': '6'},
         ]
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertEqual(result['notifications'][0]['id'], '1')
 
     def test_stays_in_group_when_notification_present(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': 'a'},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0-b/1',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 0)
         self.assertRegexpMatches(result['version'], r'-a/0')
 
     def test_leaves_group_when_notification_absent(self):
-        self.load_notifications_mock.return_value = []
-        result = json.loads(notification.notification({
+        self.notifications = []
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0-b/1',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 0)
         self.assertRegexpMatches(result['version'], r'[^-]*')
 
     def test_stays_in_group_when_notification_inactive(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': 'a', 'inactive': True},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/0-b/1',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 0)
@@ -352,38 +361,132 @@ class TestNotification(unittest.TestCase):
 
     def test_stays_in_group_when_notification_inactive_assign_new_group(self):
         # See: https://issues.adblockplus.org/ticket/5827
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': '1', 'inactive': True},
             {'id': '2', 'variants': [
                 {'sample': 1, 'title': {'en-US': '2.1'}, 'message': {'en-US': '2.1'}},
             ]},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-1/0',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 1)
         self.assertRegexpMatches(result['version'], r'-1/0-2/1')
 
     def test_inactive_notifications_not_returned(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': 'a', 'title': {'en-US': ''}, 'message': {'en-US': ''}, 'inactive': True},
             {'id': 'b', 'title': {'en-US': ''}, 'message': {'en-US': ''}, 'inactive': False},
             {'id': 'c', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
         ]
-        result = json.loads(notification.notification({}, lambda *args: None))
+        result = json.loads(_get_response({}, lambda *args: None))
         self.assertEqual(len(result['notifications']), 2)
         self.assertEqual(result['notifications'][0]['id'], 'b')
         self.assertEqual(result['notifications'][1]['id'], 'c')
 
     def test_inactive_notification_variant_not_returned(self):
-        self.load_notifications_mock.return_value = [
+        self.notifications = [
             {'id': 'a', 'inactive': True},
         ]
-        result = json.loads(notification.notification({
+        result = json.loads(_get_response({
             'QUERY_STRING': 'lastVersion=197001010000-a/1',
         }, lambda *args: None))
         self.assertEqual(len(result['notifications']), 0)
 
+    def _assert_formatted(self, body):
+        expected = json.dumps(json.loads(body), ensure_ascii=False, indent=2,
+                              separators=(',', ': '), sort_keys=True)
+        self.assertEqual(body, expected.encode('utf-8'))
+
+    def test_response_formatting(self):
+        self.notifications = [
+            {
+                'id': '1',
+                'title': {'en-US': u'\u00dcberschrift'},
+                'message': {'en-US': 'Line\nbreak', 'de': u'Nachricht'},
+                'links': ['a', 'b'],
+                'targets': [{'extension': 'adblockplus'}, {'locales': []}],
+            },
+            {
+                'id': 'a',
+                'title': {'en-US': '0'},
+                'message': {'en-US': '0'},
+                'variants': [
+                    {'sample': 0, 'title': {'en-US': '1'}},
+                ],
+            },
+        ]
+        self._assert_formatted(_get_response({}, lambda *args: None))
+        self._assert_formatted(_get_response({
+            'QUERY_STRING': 'lastVersion=197001010000-a/1',
+        }, lambda *args: None))
+        self.notifications = []
+        self._assert_formatted(_get_response({}, lambda *args: None))
+
+    def test_target_filtering(self):
+        self.notifications = [
+            {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''},
+             'targets': [{'extension': 'adblockplus'}]},
+            {'id': '2', 'title': {'en-US': ''}, 'message': {'en-US': ''},
+             'targets': [{'extension': 'adblockpluschrome',
+                          'extensionMinVersion': '3.0'}]},
+            {'id': '3', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
+        ]
+        query = 'addonName=adblockpluschrome&addonVersion=3.1'
+        result = json.loads(_get_response({
+            'QUERY_STRING': query,
+        }, lambda *args: None))
+        self.assertEqual([x['id'] for x in result['notifications']],
+                         ['1', '2', '3'])
+        result = json.loads(_get_response({
+            'QUERY_STRING': query + '&filterTargets=1',
+        }, lambda *args: None))
+        self.assertEqual([x['id'] for x in result['notifications']],
+                         ['2', '3'])
+
+    def test_target_filtering_variant(self):
+        self.notifications = [
+            {'id': 'a', 'targets': [{'application': 'firefox'}], 'variants': [
+                {'title': {'en-US': '1'}, 'message': {'en-US': '1'}},
+                {'title': {'en-US': '2'}, 'message': {'en-US': '2'},
+                 'targets': [{'application': 'chrome'}]},
+            ]},
+        ]
+        for variant, expected in [(1, 0), (2, 1)]:
+            result = json.loads(_get_response({
+                'QUERY_STRING': 'lastVersion=197001010000-a/%d&'
+                                'application=chrome&filterTargets=1' % variant,
+            }, lambda *args: None))
+            self.assertEqual(len(result['notifications']), expected)
+
+    def test_conditional_get(self):
+        self.notifications = [
+            {'id': '1', 'title': {'en-US': ''}, 'message': {'en-US': ''}},
+            {'id': 'a', 'variants': [
+                {'sample': 0.5, 'title': {'en-US': ''},
+                 'message': {'en-US': ''}},
+            ]},
+        ]
+        responses = []
+
+        def start_response(status, headers):
+            responses.append((status, dict(headers)))
+
+        _get_response({'QUERY_STRING': 'lastVersion=197001010000-a/1'},
+                      start_response)
+        etag = responses[-1][1]['ETag']
+        body = _get_response({
+            'QUERY_STRING': 'lastVersion=197001010000-a/1',
+            'HTTP_IF_NONE_MATCH': etag,
+        }, start_response)
+        self.assertEqual(body, '')
+        self.assertEqual(responses[-1][0], '304 Not Modified')
+
+        # Clients that are assigned to a group get a response of their own
+        _get_response({}, start_response)
+        self.assertEqual(responses[-1][0], '200 OK')
+        self.assertNotIn('ETag', responses[-1][1])
+
 
 if __name__ == '__main__':
     unittest.main()
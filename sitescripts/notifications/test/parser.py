@@ -13,9 +13,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
-import StringIO
 import datetime
-import tarfile
+import io
 import unittest
 
 import mock
@@ -23,15 +22,15 @@ import mock
 import sitescripts.notifications.parser as parser
 
 
-def _create_notification_archive(files):
-    archive_stream = StringIO.StringIO()
-    with tarfile.open(mode='w', fileobj=archive_stream) as archive:
-        for name, text in files:
-            file_stream = StringIO.StringIO(text)
-            tar_info = tarfile.TarInfo(name)
-            tar_info.size = len(file_stream.buf)
-            archive.addfile(tar_info, file_stream)
-    return archive_stream.getvalue()
+class _NotificationArchive(object):
+    def __init__(self, files):
+        self.files = files
+
+    def list_files(self):
+        return [name for name, text in self.files]
+
+    def open(self, name):
+        return io.BytesIO(dict(self.files)[name])
 
 
 def _format_time(time):
@@ -40,19 +39,13 @@ def _format_time(time):
 
 class TestParser(unittest.TestCase):
     def setUp(self):
-        self.call_patcher = mock.patch('subprocess.call')
-        self.call_patcher.start()
-        self.check_output_patcher = mock.patch('subprocess.check_output')
-        check_output_mock = self.check_output_patcher.start()
-
-        def check_output_side_effect(command):
-            if 'hg' in command and 'archive' in command:
-                return _create_notification_archive(self.notification_to_load)
-        check_output_mock.side_effect = check_output_side_effect
+        self.get_archive_patcher = mock.patch.object(parser, 'get_archive')
+        get_archive_mock = self.get_archive_patcher.start()
+        get_archive_mock.side_effect = lambda repo, revision: \
+            _NotificationArchive(self.notification_to_load)
 
     def tearDown(self):
-        self.call_patcher.stop()
-        self.check_output_patcher.stop()
+        self.get_archive_patcher.stop()
 
     def test_typical(self):
         self.notification_to_load = [('1', '''
@@ -157,7 +150,7 @@ end = %s
     def test_urls(self):
         self.notification_to_load = [
             ('1', '\nurls = adblockplus.org\n'),
-            ('1', '\nurls = adblockplus.org eyeo.com\n'),
+            ('2', '\nurls = adblockplus.org eyeo.com\n'),
         ]
         notifications = parser.load_notifications()
 
@@ -0,0 +1,133 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import unittest
+
+import mock
+
+from sitescripts.notifications.store import NotificationStore
+
+
+class TestNotificationStore(unittest.TestCase):
+    def setUp(self):
+        self.revision = 'a' * 40
+        self.notifications = [{'id': '1'}]
+
+        self.get_revision_patcher = mock.patch(
+            'sitescripts.notifications.store.get_revision',
+            side_effect=lambda: self.revision,
+        )
+        self.get_revision_mock = self.get_revision_patcher.start()
+        self.read_notifications_patcher = mock.patch(
+            'sitescripts.notifications.store.read_notifications',
+            side_effect=lambda revision: [dict(x) for x in self.notifications],
+        )
+        self.read_notifications_mock = self.read_notifications_patcher.start()
+
+        self.store = NotificationStore(check_interval=0)
+
+    def tearDown(self):
+        self.get_revision_patcher.stop()
+        self.read_notifications_patcher.stop()
+
+    def _get_snapshot(self):
+        snapshot = self.store.get_snapshot()
+        if self.store._thread is not None:
+            self.store._thread.join()
+        return snapshot
+
+    def test_initial_load(self):
+        snapshot = self._get_snapshot()
+        self.assertEqual(snapshot.revision, self.revision)
+        self.assertEqual(snapshot.notifications, ({'id': '1'},))
+        self.read_notifications_mock.assert_called_once_with(self.revision)
+        stats = self.store.get_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['refreshes'], 1)
+        self.assertIsNotNone(stats['last_refresh_duration'])
+
+    def test_same_revision_not_reloaded(self):
+        self._get_snapshot()
+        self._get_snapshot()
+        self._get_snapshot()
+        self.assertEqual(self.read_notifications_mock.call_count, 1)
+        stats = self.store.get_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['refreshes'], 1)
+
+    def test_new_revision_loaded_in_background(self):
+        self._get_snapshot()
+        self.revision = 'b' * 40
+        self.notifications = [{'id': '2'}]
+
+        # The request triggering the check gets the previous snapshot
+        snapshot = self._get_snapshot()
+        self.assertEqual(snapshot.notifications, ({'id': '1'},))
+
+        snapshot = self._get_snapshot()
+        self.assertEqual(snapshot.revision, self.revision)
+        self.assertEqual(snapshot.notifications, ({'id': '2'},))
+        self.assertEqual(self.store.get_stats()['refreshes'], 2)
+
+    def test_check_interval(self):
+        self.store.check_interval = 3600
+        self._get_snapshot()
+        self._get_snapshot()
+        self.assertEqual(self.get_revision_mock.call_count, 1)
+
+    def test_failed_refresh_keeps_snapshot(self):
+        self._get_snapshot()
+        self.get_revision_mock.side_effect = Exception('hg failed')
+        with mock.patch('traceback.print_exc'):
+            snapshot = self._get_snapshot()
+        self.assertEqual(snapshot.revision, self.revision)
+        self.assertEqual(self.store.get_stats()['refresh_errors'], 1)
+
+    def test_active_state(self):
+        current_time = datetime.datetime.now()
+        hour_delta = datetime.timedelta(hours=1)
+        self.notifications = [
+            {'id': '1', 'start': current_time - hour_delta,
+             'end': current_time + hour_delta},
+            {'id': '2', 'start': current_time + hour_delta},
+            {'id': '3', 'inactive': True},
+        ]
+        snapshot = self._get_snapshot()
+        self.assertEqual(snapshot.notifications, (
+            {'id': '1'},
+            {'id': '2', 'inactive': True},
+            {'id': '3', 'inactive': True},
+        ))
+        self.assertEqual(snapshot.expires, current_time + hour_delta)
+
+    def test_active_state_updated_when_expired(self):
+        current_time = datetime.datetime.now()
+        self.notifications = [
+            {'id': '1', 'end': current_time + datetime.timedelta(hours=1)},
+        ]
+        self.assertNotIn('inactive', self._get_snapshot().notifications[0])
+
+        later = current_time + datetime.timedelta(hours=2)
+        with mock.patch('datetime.datetime') as datetime_mock:
+            datetime_mock.now.return_value = later
+            snapshot = self._get_snapshot()
+        self.assertTrue(snapshot.notifications[0]['inactive'])
+        self.assertIsNone(snapshot.expires)
+        self.assertEqual(self.read_notifications_mock.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+
+import pytest
+
+from sitescripts.notifications.targets import TargetIndex, targets_match
+
+CLIENT = {
+    'extension': 'adblockpluschrome',
+    'extensionVersion': '3.1.0.2000',
+    'application': 'chrome',
+    'applicationVersion': '64.0',
+    'platform': 'chromium',
+    'platformVersion': '64.0.3282.140',
+}
+
+ENTRIES = [
+    None,
+    [{'extension': 'adblockpluschrome'}],
+    [{'extension': 'adblockplus'}],
+    [{'extension': 'adblockplus'}, {'application': 'chrome'}],
+    [{'extensionMinVersion': '3.1'}],
+    [{'extensionMinVersion': '3.1.0.2001'}],
+    [{'extensionMaxVersion': '3.1a'}],
+    [{'extension': 'adblockpluschrome', 'extensionMinVersion': '3.0',
+      'extensionMaxVersion': '3.1.0.2000'}],
+    [{'application': 'firefox', 'applicationMinVersion': '50'}],
+    [{'applicationMinVersion': '64'}],
+    [{'platform': 'gecko'}],
+    [{'platformMaxVersion': '63'}],
+    [{'blockedTotalMin': 100, 'locales': ['de']}],
+]
+
+
+@pytest.mark.parametrize('targets,expected', [
+    (None, True),
+    ([], True),
+    ([{'extension': 'adblockpluschrome'}], True),
+    ([{'extension': 'adblockplus'}], False),
+    ([{'extensionMinVersion': '3.1'}], True),
+    ([{'extensionMinVersion': '3.1.1'}], False),
+    ([{'extensionMaxVersion': '3.1.0.2000'}], True),
+    ([{'extensionMaxVersion': '3.1b'}], False),
+    ([{'applicationMinVersion': '64'}], True),
+    ([{'platform': 'gecko'}, {'platform': 'chromium'}], True),
+    ([{'platformMinVersion': '65'}], False),
+    ([{'blockedTotalMin': 100}], True),
+])
+def test_targets_match(targets, expected):
+    assert targets_match(targets, CLIENT) == expected
+
+
+def test_unknown_client_properties_match():
+    assert targets_match([{'extension': 'adblockplus',
+                           'extensionMinVersion': '99'}], {})
+    assert not targets_match([{'extension': 'adblockplus',
+                               'extensionMinVersion': '99'}],
+                             {'extensionVersion': '1.0'})
+
+
+@pytest.mark.parametrize('keys', [
+    keys
+    for count in range(len(CLIENT) + 1)
+    for keys in itertools.combinations(sorted(CLIENT), count)
+])
+def test_index_consistent_with_targets_match(keys):
+    client = {key: CLIENT[key] for key in keys}
+    expected = [i for i, targets in enumerate(ENTRIES)
+                if targets_match(targets, client)]
+    assert TargetIndex(ENTRIES).match(client) == expected
+
+
+def test_index_match():
+    assert TargetIndex(ENTRIES).match(CLIENT) == [0, 1, 3, 4, 7, 9, 12]
@@ -13,110 +13,64 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
-import json
-import random
 import time
 import urlparse
 
-from sitescripts.notifications.parser import load_notifications
-from sitescripts.web import url_handler
+from sitescripts.notifications.response import (Fragments, assign_groups,
+                                                create_response,
+                                                determine_groups, get_client)
+from sitescripts.notifications.store import NotificationStore, Snapshot
+from sitescripts.web import compress_response, conditional_get, url_handler
 
+_store = NotificationStore()
 
-def _determine_groups(version, notifications):
-    version_groups = dict(x.split('/') for x in version.split('-')[1:]
-                          if x.count('/') == 1)
-    groups = []
-    for notification in notifications:
-        group_id = notification['id']
-        if group_id in version_groups:
-            groups.append({'id': group_id, 'variant': int(version_groups[group_id])})
-    return groups
+_fragments = Fragments(Snapshot(None, (), None))
 
 
-def _assign_groups(groups, notifications):
-    selection = random.random()
-    start = 0
-    for notification in notifications:
-        if 'variants' not in notification:
-            continue
-        if notification['id'] in [g['id'] for g in groups]:
-            continue
-        group = {'id': notification['id'], 'variant': 0}
-        groups.append(group)
-        for i, variant in enumerate(notification['variants']):
-            sample_size = variant['sample']
-            end = start + sample_size
-            selected = sample_size > 0 and start <= selection <= end
-            start = end
-            if selected:
-                group['variant'] = i + 1
-                break
+def _get_fragments(snapshot):
+    global _fragments
 
+    fragments = _fragments
+    if fragments.snapshot is not snapshot:
+        fragments = _fragments = Fragments(snapshot)
+    return fragments
 
-def _get_active_variant(notifications, groups):
-    for group in groups:
-        group_id = group['id']
-        variant = group['variant']
-        if variant == 0:
-            continue
-        notification = next((x for x in notifications if x['id'] == group_id), None)
-        if not notification:
-            continue
-        notification = copy.deepcopy(notification)
-        notification.update(notification['variants'][variant - 1])
-        for key_to_remove in ('sample', 'variants'):
-            notification.pop(key_to_remove, None)
-        return notification
 
+def _get_version(environ):
+    params = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+    snapshot = environ['sitescripts.notifications.snapshot'] = \
+        _store.get_snapshot()
+    groups = determine_groups(params.get('lastVersion', [''])[0],
+                              snapshot.notifications)
 
-def _can_be_shown(notification):
-    return notification.get('title', None) and notification.get('message', None)
-
-
-def _generate_version(groups):
-    version = time.strftime('%Y%m%d%H%M', time.gmtime())
-    for group in groups:
-        version += '-%s/%s' % (group['id'], group['variant'])
-    return version
-
-
-def _get_notifications_to_send(notifications, groups):
-    active_variant = _get_active_variant(notifications, groups)
-    if active_variant:
-        return [active_variant] if _can_be_shown(active_variant) else []
-
-    notifications_to_send = []
-    for notification in notifications:
-        if not _can_be_shown(notification):
-            continue
-        if 'variants' in notification:
-            notification = copy.deepcopy(notification)
-            del notification['variants']
-        notifications_to_send.append(notification)
-    return notifications_to_send
-
+    # Clients are assigned to the groups they aren't in yet at random
+    group_ids = {group['id'] for group in groups}
+    for notification in snapshot.notifications:
+        if ('variants' in notification and
+                not notification.get('inactive', False) and
+                notification['id'] not in group_ids):
+            return None
 
-def _create_response(notifications, groups):
-    return {
-        'version': _generate_version(groups),
-        'notifications': _get_notifications_to_send(notifications, groups),
-    }
+    # The version in the response contains the current minute
+    return (snapshot.revision, snapshot.expires,
+            time.strftime('%Y%m%d%H%M', time.gmtime()))
 
 
 @url_handler('/notification.json')
+@compress_response()
+@conditional_get(_get_version, 'max-age=60')
 def notification(environ, start_response):
     params = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
     version = params.get('lastVersion', [''])[0]
-    notifications = load_notifications()
-    groups = _determine_groups(version, notifications)
-    notifications = [x for x in notifications if not x.get('inactive', False)]
-    _assign_groups(groups, notifications)
-    response = _create_response(notifications, groups)
+    snapshot = environ.get('sitescripts.notifications.snapshot')
+    if snapshot is None:
+        snapshot = _store.get_snapshot()
+    fragments = _get_fragments(snapshot)
+    groups = determine_groups(version, snapshot.notifications)
+    assign_groups(groups, fragments.notifications)
+    version, response_body = create_response(fragments, groups,
+                                             get_client(params))
     response_headers = [('Content-Type', 'application/json; charset=utf-8'),
-                        ('ABP-Notification-Version', response['version'])]
-    response_body = json.dumps(response, ensure_ascii=False, indent=2,
-                               separators=(',', ': '),
-                               sort_keys=True).encode('utf-8')
+                        ('ABP-Notification-Version', version)]
     start_response('200 OK', response_headers)
-    return response_body
+    return [response_body]
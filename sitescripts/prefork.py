@@ -0,0 +1,235 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""HTTP server running a WSGI app in preforked worker processes.
+
+The master process opens the listening socket and forks the workers, which
+accept connections on the shared socket and handle one request at a time.
+Workers are replaced after a maximum number of requests, and the master is
+woken up by SIGCHLD to replace workers that exited right away. Modules
+imported by the master before forking are shared by the workers
+copy-on-write.
+
+On SIGHUP the master tells the workers to exit after their current request
+and executes itself again, passing on the listening socket, so that new
+code and configuration are loaded without refusing any connections. On
+SIGTERM or SIGINT the workers finish their current request and the server
+exits.
+"""
+
+import errno
+import fcntl
+import os
+import select
+import signal
+import socket
+import sys
+import traceback
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+# Environment variable with the file descriptor of the listening socket,
+# set when the master executes itself again on SIGHUP
+SOCKET_FD_VARIABLE = 'SITESCRIPTS_SERVER_FD'
+
+LISTEN_BACKLOG = 128
+
+
+class _RequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        # Requests are logged by the web server in front of us
+        pass
+
+
+def parse_address(address):
+    """Parse a host:port address, the host defaults to all interfaces."""
+    host, port = address.rsplit(':', 1) if ':' in address else ('', address)
+    return host, int(port)
+
+
+def _create_socket(address):
+    fd = os.environ.pop(SOCKET_FD_VARIABLE, None)
+    if fd is not None:
+        sock = socket.fromfd(int(fd), socket.AF_INET, socket.SOCK_STREAM)
+        os.close(int(fd))
+        return sock
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(LISTEN_BACKLOG)
+    return sock
+
+
+class PreforkServer(object):
+    def __init__(self, app, address, workers=4, max_requests=1000,
+                 argv=None):
+        self.app = app
+        self.address = address
+        self.workers = workers
+        self.max_requests = max_requests
+        # Command line to execute on SIGHUP
+        self.argv = argv or [sys.executable] + sys.argv
+
+        self._socket = None
+        # Pipe that signals are written to, to wake up the master
+        self._wakeup_fds = None
+        self._worker_pids = set()
+        self._stopping = False
+        self._reloading = False
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reloading = True
+
+    def _handle_child(self, signum, frame):
+        # Workers are reaped by the main loop, once it's woken up
+        pass
+
+    def serve_forever(self):
+        self._socket = _create_socket(self.address)
+        self._wakeup_fds = os.pipe()
+        for fd in self._wakeup_fds:
+            fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        signal.set_wakeup_fd(self._wakeup_fds[1])
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        signal.signal(signal.SIGCHLD, self._handle_child)
+
+        try:
+            while not self._stopping:
+                self._reap_workers()
+                if self._reloading:
+                    self._reload()
+                while len(self._worker_pids) < self.workers:
+                    self._spawn_worker()
+                self._wait_for_signal()
+        finally:
+            self._stop_workers()
+            for pid in list(self._worker_pids):
+                self._wait_for_worker(pid)
+            self._socket.close()
+
+    def _wait_for_signal(self):
+        # Signals that come in while the loop runs are written to the
+        # pipe as well, so that none of them is missed
+        try:
+            select.select([self._wakeup_fds[0]], [], [])
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+        try:
+            while os.read(self._wakeup_fds[0], 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            # Workers of the previous master after a reload aren't known
+            self._worker_pids.discard(pid)
+
+    def _wait_for_worker(self, pid):
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                return
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                if e.errno != errno.EINTR:
+                    raise
+
+    def _stop_workers(self):
+        for pid in self._worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _reload(self):
+        self._stop_workers()
+        os.environ[SOCKET_FD_VARIABLE] = str(self._socket.fileno())
+        os.execv(self.argv[0], self.argv)
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self._worker_pids.add(pid)
+            return
+
+        status = 0
+        try:
+            self._run_worker()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # Don't run the exit handlers of the master
+            os._exit(status)
+
+    def _run_worker(self):
+        self._stopping = False
+        signal.set_wakeup_fd(-1)
+        for fd in self._wakeup_fds:
+            os.close(fd)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        server = WSGIServer(self._socket.getsockname(), _RequestHandler,
+                            bind_and_activate=False)
+        server.socket.close()
+        server.socket = self._socket
+        server.server_name = socket.getfqdn(self.address[0])
+        server.server_port = self._socket.getsockname()[1]
+        server.setup_environ()
+        server.set_app(self.app)
+
+        handled = 0
+        while not self._stopping and handled < self.max_requests:
+            # SIGTERM interrupts waiting for a connection, but not the
+            # handling of a request. The timeout makes sure that the flag
+            # is checked even if the signal came just before waiting.
+            signal.siginterrupt(signal.SIGTERM, True)
+            try:
+                if not select.select([self._socket], [], [], 1)[0]:
+                    continue
+                request, client_address = self._socket.accept()
+            except (select.error, socket.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            signal.siginterrupt(signal.SIGTERM, False)
+
+            try:
+                server.process_request(request, client_address)
+            except Exception:
+                server.handle_error(request, client_address)
+                server.shutdown_request(request)
+            handled += 1
@@ -31,21 +31,17 @@ import sitescripts.subscriptions.subscriptionParser as subscriptionParser
 def loadSubscriptions():
     global interval, weekDay
 
-    subscriptions = subscriptionParser.readSubscriptions()
+    index = subscriptionParser.readSubscriptionIndex()
 
-    results = {}
-    resultList = []
-    for subscription in subscriptions.values():
-        if subscription.digest == 'daily' and interval == 'week':
-            continue
-        if subscription.digest == 'weekly' and interval == 'day':
-            continue
-        if interval == 'week' and subscription.digestDay != weekDay:
-            continue
+    selected = index.find()
+    if interval == 'week':
+        selected = index.find(digest_day=weekDay) - index.find(digest='daily')
+    elif interval == 'day':
+        selected -= index.find(digest='weekly')
 
-        for [title, url, complete] in subscription.variants:
-            results[url] = subscription
-        resultList.append(subscription)
+    results = {url: subscription for url, subscription in index.by_url.iteritems()
+               if subscription in selected}
+    resultList = sorted(selected, key=lambda subscription: subscription.name)
     return (results, resultList)
 
 
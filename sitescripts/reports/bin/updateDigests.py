@@ -20,7 +20,7 @@ import os
 import re
 from time import time
 from email.utils import parseaddr
-from sitescripts.utils import get_config, get_template, setupStderr
+from sitescripts.utils import get_config, get_template, setupStderr, write_compressed_copy
 from sitescripts.reports.utils import getReports, getReportSubscriptions, calculateReportSecret, getDigestPath, getUserUsefulnessScore
 import sitescripts.subscriptions.subscriptionParser as subscriptionParser
 
@@ -28,15 +28,15 @@ import sitescripts.subscriptions.subscriptionParser as subscriptionParser
 def updateDigests(dir):
     global currentTime
 
-    subs = subscriptionParser.readSubscriptions()
+    index = subscriptionParser.readSubscriptionIndex()
     defname, defemail = parseaddr(get_config().get('reports', 'defaultSubscriptionRecipient'))
 
-    subscriptions = {}
+    subscriptions = index.by_url
+    # The digests are named after the addresses as they are written, like
+    # the links mailed by mailDigests
     emails = {}
     emails[defemail] = []
-    for subscription in subs.values():
-        for title, url, complete in subscription.variants:
-            subscriptions[url] = subscription
+    for subscription in index.find():
         name, email = parseaddr(subscription.email)
         if email != '':
             emails[email] = []
@@ -87,6 +87,7 @@ def updateDigests(dir):
         file = getDigestPath(dir, email)
         template = get_template(get_config().get('reports', 'htmlDigestTemplate'))
         template.stream({'email': email, 'reports': reports}).dump(file, encoding='utf-8')
+        write_compressed_copy(file)
         digests.add(file)
 
     # Remove not updated digests which are more then 2 weeks old
@@ -94,6 +95,8 @@ def updateDigests(dir):
         file = os.path.join(dir, filename)
         if os.path.isfile(file) and file not in digests and re.match(r'^[\da-f]{32}\.html$', filename) and os.stat(file).st_mtime < currentTime - 14 * 24 * 60 * 60:
             os.remove(file)
+            if os.path.isfile(file + '.gz'):
+                os.remove(file + '.gz')
 
 
 def getSubscriptionInfo(subscription):
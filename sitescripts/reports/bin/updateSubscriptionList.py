@@ -26,16 +26,11 @@ def updateSubscriptionList():
     for dbsub in cursor:
         subids[dbsub['url']] = dbsub['id']
 
-    subscriptions = subscriptionParser.readSubscriptions()
-    for subscription in subscriptions.values():
-        for title, url, complete in subscription.variants:
-            id = subids.get(url)
-            if id == None:
-                executeQuery(cursor, 'INSERT INTO #PFX#subscriptions (url) VALUES (%s)', url)
-            else:
-                del subids[url]
+    urls = subscriptionParser.readSubscriptionIndex().get_urls()
+    for url in sorted(urls - set(subids)):
+        executeQuery(cursor, 'INSERT INTO #PFX#subscriptions (url) VALUES (%s)', url)
 
-    for url in subids:
+    for url in set(subids) - urls:
         executeQuery(cursor, 'DELETE FROM #PFX#subscriptions WHERE id = %s', subids[url])
     get_db().commit()
 
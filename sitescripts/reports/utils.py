@@ -21,7 +21,7 @@ import os
 import re
 import marshal
 import subprocess
-from sitescripts.utils import get_config, cached, get_template, anonymizeMail, sendMail
+from sitescripts.utils import get_config, cached, get_template, anonymizeMail, sendMail, write_compressed_copy
 
 
 def getReportSubscriptions(guid):
@@ -131,6 +131,7 @@ def saveReport(guid, reportData, isNew=False):
         os.makedirs(dir)
     template = get_template(get_config().get('reports', 'webTemplate'))
     template.stream(reportData).dump(file, encoding='utf-8')
+    write_compressed_copy(file)
 
     if contact:
         reportData['email'] = origEmail
@@ -141,8 +142,9 @@ def removeReport(guid):
     executeQuery(cursor, 'DELETE FROM #PFX#reports WHERE guid = %s', guid)
     get_db().commit()
     file = os.path.join(get_config().get('reports', 'dataPath'), guid[0], guid[1], guid[2], guid[3], guid + '.html')
-    if os.path.isfile(file):
-        os.remove(file)
+    for path in (file, file + '.gz'):
+        if os.path.isfile(path):
+            os.remove(path)
     file = os.path.join(get_config().get('reports', 'dataPath'), guid[0], guid[1], guid[2], guid[3], guid + '.png')
     if os.path.isfile(file):
         os.remove(file)
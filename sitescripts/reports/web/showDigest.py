@@ -22,7 +22,7 @@ from datetime import date, timedelta, datetime
 from urlparse import parse_qs
 from sitescripts.reports.utils import getDigestSecret, getDigestSecret_compat
 from sitescripts.utils import get_config, get_template, setupStderr
-from sitescripts.web import url_handler
+from sitescripts.web import send_file, url_handler
 
 
 @url_handler('/digest')
@@ -69,13 +69,7 @@ def handleRequest(environ, start_response):
         start_response('302 Found', [('Location', '/digest?id=' + id), ('Set-Cookie', cookies[id].OutputString())])
         return []
     else:
-        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8'), ('Set-Cookie', cookies[id].OutputString())])
-        blockSize = 4096
-        f = open(path)
-        if 'wsgi.file_wrapper' in environ:
-            return environ['wsgi.file_wrapper'](f, blockSize)
-        else:
-            return iter(lambda: f.read(blockSize), '')
+        return send_file(environ, start_response, path, [('Content-Type', 'text/html; charset=utf-8'), ('Set-Cookie', cookies[id].OutputString())])
 
 
 def showError(message, start_response):
@@ -13,10 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
+import httplib
 import re
 import os
+import shutil
 import sys
 from urlparse import parse_qs
+from sitescripts.requestbody import BodyReader, RequestBodyError, CHUNK_SIZE
 from sitescripts.utils import get_config, get_template
 from sitescripts.web import url_handler
 import sitescripts.subscriptions.knownIssuesParser as knownIssuesParser
@@ -45,21 +48,21 @@ def handleRequest(environ, start_response):
         return showError('Duplicate GUID', start_response)
 
     try:
-        request_size = int(environ['CONTENT_LENGTH'])
-    except (KeyError, ValueError):
-        return showError('Invalid or missing Content-Length header', start_response,
-                         '411 Length Required')
+        reader = BodyReader(environ)
+    except RequestBodyError as e:
+        return showError(str(e), start_response,
+                         '%d %s' % (e.status, httplib.responses[e.status]))
 
     dir = os.path.dirname(path)
     if not os.path.exists(dir):
         os.makedirs(dir)
     try:
-        file = open(path + '.tmp', 'wb')
-        data = environ['wsgi.input'].read(request_size)
-        file.write(data)
-        file.close()
+        with open(path + '.tmp', 'wb') as file:
+            shutil.copyfileobj(reader, file, CHUNK_SIZE)
 
-        knownIssues = knownIssuesParser.findMatches(data.splitlines(), params.get('lang', ['en-US'])[0])
+        with open(path + '.tmp', 'rb') as file:
+            lines = (line.rstrip('\r\n') for line in file)
+            knownIssues = knownIssuesParser.findMatches(lines, params.get('lang', ['en-US'])[0])
 
         os.rename(path + '.tmp', path)
     except Exception as e:
@@ -0,0 +1,302 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read the bodies of POST requests without keeping them in memory.
+
+The body is read from `wsgi.input` in chunks as it's parsed, and requests
+without a valid `Content-Length` header or with a body larger than the
+`max_request_body_size` option of the `DEFAULT` configuration section are
+rejected with a `RequestBodyError`.
+"""
+
+import cgi
+import re
+import shutil
+import urllib
+from tempfile import SpooledTemporaryFile
+
+from sitescripts.utils import get_config
+
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# Bytes read from the input at once, and the longest line (or part of one)
+# that the multipart parser handles at once
+CHUNK_SIZE = 64 * 1024
+
+# Bytes of a spooled body kept in memory, before it's written to disk
+SPOOL_SIZE = 1024 * 1024
+
+# Maximal number and size of the header lines of each part of a multipart body
+MAX_PART_HEADERS = 32
+MAX_PART_HEADER_SIZE = 8 * 1024
+
+
+class RequestBodyError(ValueError):
+    """The request body is missing, too large or malformed.
+
+    `status` is the HTTP status code to respond with.
+    """
+
+    def __init__(self, status, message):
+        super(RequestBodyError, self).__init__(message)
+        self.status = status
+
+
+def get_max_body_size():
+    config = get_config()
+    if config.has_option('DEFAULT', 'max_request_body_size'):
+        return config.getint('DEFAULT', 'max_request_body_size')
+    return MAX_BODY_SIZE
+
+
+class BodyReader(object):
+    """File-like object reading no more than the request body.
+
+    The `Content-Length` header is checked against `max_size` (or the
+    configured maximum) before anything is read.
+    """
+
+    def __init__(self, environ, max_size=None):
+        if max_size is None:
+            max_size = get_max_body_size()
+        try:
+            length = int(environ['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            length = -1
+        if length < 0:
+            raise RequestBodyError(411, 'Invalid or missing Content-Length '
+                                        'header')
+        if length > max_size:
+            raise RequestBodyError(413, 'Request body too large')
+
+        self._input = environ['wsgi.input']
+        self.remaining = length
+
+    def _check(self, data, size):
+        self.remaining -= len(data)
+        if size and not data:
+            raise RequestBodyError(400, 'Request body incomplete')
+        return data
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return ''
+        return self._check(self._input.read(size), size)
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return ''
+        return self._check(self._input.readline(size), size)
+
+    def iter_chunks(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def __iter__(self):
+        while True:
+            line = self.readline(CHUNK_SIZE)
+            if not line:
+                break
+            yield line
+
+
+def copy_body(environ, file, max_size=None):
+    """Write the request body to a file, return the number of bytes."""
+    reader = BodyReader(environ, max_size)
+    size = reader.remaining
+    shutil.copyfileobj(reader, file, CHUNK_SIZE)
+    return size
+
+
+def spool_body(environ, max_size=None):
+    """Return a temporary file with the request body, read from the start.
+
+    Bodies up to `SPOOL_SIZE` are kept in memory, larger ones are written to
+    disk. The caller should close the file.
+    """
+    file = SpooledTemporaryFile(SPOOL_SIZE)
+    try:
+        copy_body(environ, file, max_size)
+        file.seek(0)
+    except Exception:
+        file.close()
+        raise
+    return file
+
+
+_separator_regexp = re.compile(r'[&;]')
+
+
+def _parse_pair(pair, keep_blank_values):
+    if not pair:
+        return None
+    name, sep, value = pair.partition('=')
+    if not value and not keep_blank_values:
+        return None
+    return (urllib.unquote_plus(name), urllib.unquote_plus(value))
+
+
+def iter_urlencoded(environ, max_size=None, keep_blank_values=False):
+    """Yield the name and value of each field of a urlencoded form body.
+
+    Like `urlparse.parse_qsl`, fields are separated by `&` or `;`, empty
+    fields are ignored and fields with empty values are skipped unless
+    `keep_blank_values` is true.
+    """
+    reader = BodyReader(environ, max_size)
+    buffer = ''
+    for chunk in reader.iter_chunks():
+        pairs = _separator_regexp.split(buffer + chunk)
+        buffer = pairs.pop()
+        for pair in pairs:
+            field = _parse_pair(pair, keep_blank_values)
+            if field:
+                yield field
+    if buffer:
+        field = _parse_pair(buffer, keep_blank_values)
+        if field:
+            yield field
+
+
+class Part(object):
+    """A part of a multipart body.
+
+    `headers` maps the lowercase header names to their values, `name` and
+    `filename` are taken from the `Content-Disposition` header. The data has
+    to be read before the next part is requested from `iter_multipart`.
+    """
+
+    def __init__(self, headers, reader, delimiter, line_size):
+        self.headers = headers
+        disposition, params = cgi.parse_header(
+            headers.get('content-disposition', ''),
+        )
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        self.last = False
+        self._chunks = self._read_chunks(reader, delimiter, line_size)
+
+    def _read_chunks(self, reader, delimiter, line_size):
+        # The line break before a delimiter belongs to the delimiter, so it's
+        # only passed on once the next line turns out not to be one.
+        line_break = ''
+        at_line_start = True
+        while True:
+            line = reader.readline(line_size)
+            if not line:
+                raise RequestBodyError(400, 'Multipart body incomplete')
+            if at_line_start and line.startswith(delimiter):
+                rest = line[len(delimiter):].rstrip('\r\n')
+                if rest in ('', '--'):
+                    self.last = rest == '--'
+                    return
+
+            data = line_break + line
+            at_line_start = line.endswith('\n')
+            line_break = ''
+            if data.endswith('\r\n'):
+                data, line_break = data[:-2], '\r\n'
+            elif at_line_start:
+                data, line_break = data[:-1], '\n'
+            elif data.endswith('\r'):
+                data, line_break = data[:-1], '\r'
+            if data:
+                yield data
+
+    def iter_chunks(self):
+        return self._chunks
+
+    def iter_lines(self):
+        """Yield the lines of the data, including their line breaks."""
+        buffer = ''
+        for chunk in self._chunks:
+            lines = (buffer + chunk).split('\n')
+            buffer = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if buffer:
+            yield buffer
+
+    def read(self):
+        return ''.join(self._chunks)
+
+    def drain(self):
+        for chunk in self._chunks:
+            pass
+
+
+def _get_boundary(environ):
+    content_type, params = cgi.parse_header(environ.get('CONTENT_TYPE', ''))
+    if not content_type.startswith('multipart/'):
+        raise RequestBodyError(415, 'Multipart form data expected')
+    boundary = params.get('boundary')
+    if not boundary:
+        raise RequestBodyError(400, 'Boundary declaration missing')
+    return boundary
+
+
+def _read_part_headers(reader):
+    headers = {}
+    for i in range(MAX_PART_HEADERS + 1):
+        line = reader.readline(MAX_PART_HEADER_SIZE)
+        if not line.endswith('\n'):
+            raise RequestBodyError(400, 'Invalid multipart headers')
+        line = line.rstrip('\r\n')
+        if not line:
+            return headers
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise RequestBodyError(400, 'Invalid multipart headers')
+        headers[name.strip().lower()] = value.strip()
+    raise RequestBodyError(400, 'Too many multipart headers')
+
+
+def iter_multipart(environ, max_size=None):
+    """Yield a `Part` for each part of a multipart body, as it's read."""
+    delimiter = '--' + _get_boundary(environ)
+    reader = BodyReader(environ, max_size)
+
+    # Delimiter lines have to be read at once, including the line break and
+    # the "--" marking the end of the body
+    line_size = max(CHUNK_SIZE, len(delimiter) + 4)
+
+    # Skip the preamble
+    at_line_start = True
+    while True:
+        line = reader.readline(line_size)
+        if not line:
+            raise RequestBodyError(400, 'Multipart body incomplete')
+        if at_line_start and line.startswith(delimiter):
+            rest = line[len(delimiter):].rstrip('\r\n')
+            if rest == '--':
+                return
+            if rest == '':
+                break
+        at_line_start = line.endswith('\n')
+
+    while True:
+        part = Part(_read_part_headers(reader), reader, delimiter,
+                    line_size)
+        yield part
+        part.drain()
+        if part.last:
+            return
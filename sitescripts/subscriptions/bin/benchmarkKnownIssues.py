@@ -0,0 +1,224 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of matching issue reports against known issues.
+
+Compares the reports per second of findMatches(), which uses the compiled
+rules, with the line by line matching of all supported keys as it used to
+be done, as well as with findMatchesBatch(). The known issues and reports
+are generated, with sizes similar to the real ones.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from sitescripts.subscriptions import knownIssuesParser
+
+DOMAINS = ['example.com', 'example.net', 'ads.example.org', 'cdn.example.de',
+           'tracker.example.fr', 'static.example.co.uk']
+
+
+def _random_url(rng):
+    return 'https://%s/%s/%d.%s' % (
+        rng.choice(DOMAINS), rng.choice(['ads', 'img', 'js', 'banner']),
+        rng.randint(0, 100000), rng.choice(['js', 'png', 'gif', 'html']),
+    )
+
+
+def create_known_issues(count, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines += ['[Issue %d]' % i,
+                  'url = https://adblockplus.org/issues/%d?lang=%%LANG%%' % i]
+        kind = i % 4
+        if kind == 0:
+            lines.append('requestLocation = ||%s/ads/%d^' % (
+                rng.choice(DOMAINS), rng.randint(0, 100000)))
+        elif kind == 1:
+            lines.append('filterText = /^@@\\|\\|%s\\^\\$document/' %
+                         re.escape(rng.choice(DOMAINS)))
+        elif kind == 2:
+            lines += ['appname = firefox',
+                      'abpversion = 2.%d*' % rng.randint(0, 9)]
+        else:
+            lines += ['mainURL = *%s/page%d*' % (rng.choice(DOMAINS), i),
+                      'isEnabled = false']
+    return '\n'.join(lines) + '\n'
+
+
+def create_report(requests, filters, seed=0):
+    rng = random.Random(seed)
+    lines = [
+        '<?xml version="1.0"?>',
+        '<report type="false negative">',
+        '<adblock-plus version="2.9.1" locale="en-US"/>',
+        '<application name="firefox" vendor="Mozilla" version="57.0" '
+        'userAgent="Mozilla/5.0 (X11; Linux x86_64; rv:57.0)"/>',
+        '<platform name="Gecko" version="57.0" build="20171112125346"/>',
+        '<options>',
+        '<option id="enabled">true</option>',
+        '<option id="objecttabs">false</option>',
+        '<option id="collapse">true</option>',
+        '</options>',
+        '<window url="https://www.example.com/page/index.html">',
+    ]
+    for i in range(requests):
+        lines.append(
+            '<request location="%s" type="%s" docDomain="www.example.com" '
+            'thirdParty="true" size="%d" count="1"/>' % (
+                _random_url(rng), rng.choice(['SCRIPT', 'IMAGE', 'OTHER']),
+                rng.randint(100, 100000),
+            ),
+        )
+    lines.append('</window>')
+    lines.append('<filters>')
+    for i in range(filters):
+        lines.append('<filter text="||%s/%s/%d^$third-party" '
+                     'subscriptions="https://example.com/easylist.txt" '
+                     'hitCount="%d"/>' % (rng.choice(DOMAINS),
+                                          rng.choice(['ads', 'banner']),
+                                          rng.randint(0, 100000),
+                                          rng.randint(1, 50)))
+    lines += ['</filters>', '</report>']
+    return lines
+
+
+def legacy_find_matches(rules, rulesets, lines, lang):
+    # The matching as done before the rules were compiled: parsing all
+    # attributes and checking all supported keys for each line, and the
+    # patterns of each rule one by one.
+    matched_rules = set()
+    for line in lines:
+        match = re.search(r'<([\w\-]+)\s*(.*?)\s*/?>([^<>]*)', line)
+        if not match:
+            continue
+
+        tag = match.group(1)
+        attr_text = match.group(2)
+        text = match.group(3).strip()
+
+        attrs = {}
+        for match in re.finditer(r'(\w+)="([^"]*)"', attr_text):
+            attrs[match.group(1)] = (
+                match.group(2).strip().replace('&lt;', '<')
+                .replace('&gt;', '>').replace('&quot;', '"')
+                .replace('&amp;', '&')
+            )
+
+        for key, t in knownIssuesParser.supportedKeys.iteritems():
+            if len(t) == 3:
+                required_tag, required_attrs, required_value = t
+            else:
+                required_tag, required_attrs = t
+                required_value = None
+            required_attrs = required_attrs.split(' ')
+            if required_tag != tag:
+                continue
+
+            found_attrs = []
+            for attr in required_attrs:
+                if attr in attrs:
+                    found_attrs.append(attrs[attr])
+            if len(found_attrs) != len(required_attrs):
+                continue
+
+            value = ' '.join(found_attrs)
+            if required_value is not None:
+                if required_value != value:
+                    continue
+                value = text
+
+            value = value.lower()
+            for rule in rules.get(key, []):
+                if rule in matched_rules:
+                    continue
+                for pattern in rule.patterns:
+                    if re.search(pattern, value):
+                        matched_rules.add(rule)
+                        break
+
+    result = set()
+    for ruleset in rulesets:
+        if ruleset.isMatched(matched_rules):
+            result.add(re.sub(r'%LANG%', lang, ruleset.url))
+    return sorted(result)
+
+
+def _measure(func, duration):
+    count = 0
+    start_time = time.time()
+    end_time = start_time + duration
+    while True:
+        func()
+        count += 1
+        current_time = time.time()
+        if current_time >= end_time:
+            return count / (current_time - start_time)
+
+
+def run_benchmark(issue_counts, requests, filters, batch_size, duration):
+    report = create_report(requests, filters)
+    batch = [create_report(requests, filters, seed)
+             for seed in range(batch_size)]
+    print 'Report with %d lines (%d bytes), batches of %d reports' % (
+        len(report), sum(len(line) + 1 for line in report), batch_size,
+    )
+    print '%12s %19s %20s %18s %8s' % (
+        'known issues', 'legacy (reports/s)', 'current (reports/s)',
+        'batch (reports/s)', 'speedup',
+    )
+    for count in issue_counts:
+        rules, rulesets = knownIssuesParser.parseRules(
+            create_known_issues(count),
+        )
+        compiled_rules = knownIssuesParser.CompiledRules(rules, rulesets)
+
+        legacy = _measure(lambda: legacy_find_matches(rules, rulesets, report,
+                                                      'en-US'),
+                          duration)
+        current = _measure(lambda: compiled_rules.findMatches(report,
+                                                              'en-US'),
+                           duration)
+        batched = _measure(lambda: compiled_rules.findMatchesBatch(batch,
+                                                                   'en-US'),
+                           duration) * batch_size
+        print '%12d %19.1f %20.1f %18.1f %7.1fx' % (
+            count, legacy, current, batched, current / legacy,
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', '--known-issues', type=int, nargs='+',
+                        default=[10, 100, 500],
+                        help='Numbers of known issues to test with')
+    parser.add_argument('-r', '--requests', type=int, default=2000,
+                        help='Number of requests in the report')
+    parser.add_argument('-f', '--filters', type=int, default=500,
+                        help='Number of filters in the report')
+    parser.add_argument('-b', '--batch', type=int, default=20,
+                        help='Number of reports matched at once in batches')
+    parser.add_argument('-t', '--time', type=float, default=3,
+                        help='Seconds to measure each variant for')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.known_issues, args.requests, args.filters, args.batch,
+                  args.time)
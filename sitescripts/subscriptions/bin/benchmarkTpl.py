@@ -0,0 +1,223 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of converting filter lists to TPL files.
+
+Compares the rules per second of tplConverter with the conversion as it
+used to be done, with uncompiled patterns and several passes over the
+options of each filter. The filter list is generated, with a mix of filters
+similar to EasyList.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from sitescripts.subscriptions import tplConverter
+
+DOMAINS = ['example.com', 'example.net', 'ads.example.org', 'cdn.example.de',
+           'tracker.example.fr', 'static.example.co.uk']
+OPTIONS = ['third-party', '~third-party', 'script', 'image', 'stylesheet',
+           'object_subrequest', 'xmlhttprequest', 'other', 'elemhide',
+           'donottrack', 'match-case', 'popup', 'domain=example.com',
+           'domain=~example.net|example.org', 'Third-Party', 'SCRIPT']
+
+
+def create_filter_list(count, seed=0):
+    rng = random.Random(seed)
+    lines = ['! Title: Benchmark', '! Expires: 4 days (update frequency)',
+             '! Homepage: https://example.com/']
+    for i in range(count):
+        domain = rng.choice(DOMAINS)
+        kind = rng.randint(0, 9)
+        if kind == 0:
+            line = '! Comment %d --!' % i
+        elif kind < 3:
+            line = '%s##.ad-%d' % (domain, i)
+        elif kind < 6:
+            line = '||%s^*/ads/%d/*' % (domain, i)
+        elif kind < 7:
+            line = '|https://%s:8080/banner%d.gif|' % (domain, i)
+        elif kind < 8:
+            line = '/ad_%d_*.%s' % (i, rng.choice(['js', 'gif', 'html']))
+        else:
+            line = '@@||%s/%d^' % (domain, i)
+        if kind > 2 and rng.random() < 0.5:
+            line += '$' + ','.join(rng.sample(OPTIONS, rng.randint(1, 3)))
+        lines.append(line)
+    return lines
+
+
+def legacy_convert_to_tpl(lines):
+    # The conversion as done before tplConverter, with uncompiled patterns
+    # and several passes over the options.
+    yield 'msFilterList'
+    for line in lines:
+        if re.search(r'^\s*!', line):
+            # This is a comment. Handle "Expires" comment in a special way,
+            # keep the rest.
+            match = re.search(r'^\s*!\s*Expires\s*:\s*(\d+)\s*(h)?', line,
+                              re.I)
+            if match:
+                interval = int(match.group(1))
+                if match.group(2):
+                    interval = int(interval / 24)
+                yield ': Expires=%i' % interval
+            else:
+                yield re.sub(r'^\s*!', '#', re.sub(r'--!$', '--#', line))
+        elif line.find('#') >= 0:
+            # Element hiding rules are not supported in MSIE, drop them
+            pass
+        else:
+            # We have a blocking or exception rule, try to convert it
+            origline = line
+
+            is_exception = False
+            if line.startswith('@@'):
+                is_exception = True
+                line = line[2:]
+
+            has_unsupported = False
+            requires_script = False
+            match = re.search(r'^(.*?)\$(.*)', line)
+            if match:
+                # This rule has options, check whether any of them are
+                # important
+                line = match.group(1)
+                options = match.group(2).replace('_', '-').lower().split(',')
+
+                # Remove first-party only exceptions, we will allow an ad
+                # server everywhere otherwise
+                if is_exception and '~third-party' in options:
+                    has_unsupported = True
+
+                # A number of options are not supported in MSIE but can be
+                # safely ignored, remove them
+                options = filter(lambda o: o not in (
+                    '', 'third-party', '~third-party', 'match-case',
+                    '~match-case', '~other', '~donottrack',
+                ), options)
+
+                # Also ignore domain negation of whitelists
+                if is_exception:
+                    options = filter(lambda o: not o.startswith('domain=~'),
+                                     options)
+
+                unsupported = filter(lambda o: o in ('other', 'elemhide'),
+                                     options)
+                if unsupported and len(unsupported) == len(options):
+                    # The rule only applies to types that are not supported
+                    # in MSIE
+                    has_unsupported = True
+                elif 'donottrack' in options:
+                    # Do-Not-Track rules have to be removed even if
+                    # $donottrack is combined with other options
+                    has_unsupported = True
+                elif 'script' in options and \
+                        len(options) == len(unsupported) + 1:
+                    # Mark rules that only apply to scripts for approximate
+                    # conversion
+                    requires_script = True
+                elif len(options) > 0:
+                    # The rule has further options that aren't available in
+                    # TPLs. For exception rules that aren't specific to a
+                    # domain we ignore all remaining options to avoid
+                    # potential false positives. Other rules simply aren't
+                    # included in the TPL file.
+                    if is_exception:
+                        has_unsupported = any([o.startswith('domain=')
+                                               for o in options])
+                    else:
+                        has_unsupported = True
+
+            if has_unsupported:
+                # Do not include filters with unsupported options
+                yield '# ' + origline
+            else:
+                # Assume that separator placeholders mean slashes
+                line = line.replace('^', '/')
+
+                # Try to extract domain info
+                domain = None
+                match = re.search(r'^(\|\||\|\w+://)([^*:/]+)(:\d+)?(/.*)',
+                                  line)
+                if match:
+                    domain = match.group(2)
+                    line = match.group(4)
+                else:
+                    # No domain info, remove anchors at the rule start
+                    line = re.sub(r'^\|\|', 'http://', line)
+                    line = re.sub(r'^\|', '', line)
+                # Remove anchors at the rule end
+                line = re.sub(r'\|$', '', line)
+                # Remove unnecessary asterisks at the ends of lines
+                line = re.sub(r'\*$', '', line)
+                # Emulate $script by appending *.js to the rule
+                if requires_script:
+                    line += '*.js'
+                if line.startswith('/*'):
+                    line = line[2:]
+                if domain:
+                    line = '%sd %s %s' % ('+' if is_exception else '-',
+                                          domain, line)
+                    line = re.sub(r'\s+/$', '', line)
+                    yield line
+                elif is_exception:
+                    # Exception rules without domains are unsupported
+                    yield '# ' + origline
+                else:
+                    yield '- ' + line
+
+
+def _measure(convert, lines, repeat):
+    best = None
+    for i in range(repeat):
+        start_time = time.time()
+        for line in convert(lines):
+            pass
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def run_benchmark(count, repeat):
+    lines = create_filter_list(count)
+    if list(legacy_convert_to_tpl(lines)) != \
+            list(tplConverter.convert_to_tpl(lines)):
+        raise Exception('The converted filter lists differ')
+
+    print 'Filter list with %d lines (%d bytes)' % (
+        len(lines), sum(len(line) + 1 for line in lines),
+    )
+    legacy = _measure(legacy_convert_to_tpl, lines, repeat)
+    current = _measure(tplConverter.convert_to_tpl, lines, repeat)
+    print '%20s %20s %8s' % ('legacy (rules/s)', 'current (rules/s)',
+                             'speedup')
+    print '%20.0f %20.0f %7.1fx' % (legacy, current, current / legacy)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--rules', type=int, default=100000,
+                        help='Number of filters in the generated list')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of conversions to take the fastest of')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_benchmark(args.rules, args.repeat)
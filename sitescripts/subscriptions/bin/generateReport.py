@@ -66,12 +66,7 @@ def processFile(data, counts):
 def loadSubscriptions(counts):
     global interval
 
-    subscriptions = subscriptionParser.readSubscriptions()
-
-    knownURLs = {}
-    for subscription in subscriptions.values():
-        for title, url, complete in subscription.variants:
-            knownURLs[url] = True
+    knownURLs = subscriptionParser.readSubscriptionIndex().get_urls()
 
     redirectData, goneData = subscriptionParser.getFallbackData()
     redirects = processFile(redirectData, counts)
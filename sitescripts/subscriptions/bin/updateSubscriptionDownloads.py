@@ -13,41 +13,35 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import os
 import re
-import subprocess
-import tempfile
-import shutil
-import zipfile
-from StringIO import StringIO
+import sys
+from ...hgarchive import get_archive
 from ...utils import get_config, setupStderr
 from ..combineSubscriptions import combine_subscriptions
 
 
 class MercurialSource:
-    _prefix = './'
-
     def __init__(self, repo):
-        command = ['hg', '-R', repo, 'archive', '-r', 'default',
-                   '-t', 'uzip', '-p', '.', '-']
-        data = subprocess.check_output(command)
-        self._archive = zipfile.ZipFile(StringIO(data), mode='r')
+        self._archive = get_archive(repo)
 
     def close(self):
-        self._archive.close()
+        pass
 
     def read_file(self, filename):
-        return self._archive.read(self._prefix + filename).decode('utf-8')
+        return self._archive.read(filename).decode('utf-8')
 
     def list_top_level_files(self):
-        for filename in self._archive.namelist():
-            filename = filename[len(self._prefix):]
+        for filename in self._archive.list_files():
             if '/' not in filename:
                 yield filename
 
 
 if __name__ == '__main__':
     setupStderr()
+    if '--verbose' in sys.argv[1:]:
+        logging.basicConfig(level=logging.INFO)
 
     source_repos = {}
     for option, value in get_config().items('subscriptionDownloads'):
@@ -57,7 +51,8 @@ if __name__ == '__main__':
     basedir = get_config().get('subscriptionDownloads', 'outdir')
     destination = os.path.join(basedir, 'data')
     try:
-        combine_subscriptions(source_repos, destination, tempdir=basedir)
+        combine_subscriptions(source_repos, destination, tempdir=basedir,
+                              force='--force' in sys.argv[1:])
     finally:
         for source in source_repos.itervalues():
             source.close()
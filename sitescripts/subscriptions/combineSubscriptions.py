@@ -19,61 +19,274 @@ import sys
 import os
 import re
 import subprocess
-import urllib2
 import time
 import traceback
 import codecs
 import hashlib
 import base64
+import json
 import tempfile
+import logging
+import multiprocessing
 from getopt import getopt, GetoptError
+from itertools import chain, ifilter
+from multiprocessing.pool import ThreadPool
+
+from sitescripts.subscriptions.remoteIncludes import (HTTPCache, fetch, fetch_all,
+                                                      find_remote_includes)
+from sitescripts.subscriptions.tplConverter import convert_to_tpl
 
 accepted_extensions = set(['.txt'])
 ignore = set(['Apache.txt', 'CC-BY-SA.txt', 'GPL.txt', 'MPL.txt'])
 verbatim = set(['COPYING'])
 
+# Increase to generate all files again after changing how they are generated
+MANIFEST_VERSION = 2
+
+# Size of the chunks the generated files are copied in
+CHUNK_SIZE = 65536
+
+# The line boundaries unicode.splitlines() splits at
+_line_break_regexp = re.compile(u'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+_header_regexp = re.compile(r'\[Adblock(?:\s*Plus\s*([\d\.]+)?)?\]', re.I)
+
+
+def _compress(filename, path):
+    start_time = time.time()
+    try:
+        subprocess.check_output(['7za', 'a', '-tgzip', '-mx=9', '-bd', '-mpass=5', path + '.gz', path])
+    except:
+        print >>sys.stderr, 'Failed to compress file %s. Please ensure that p7zip is installed on the system.' % path
+        return False
+    logging.info('Compressed %s in %.2fs', filename, time.time() - start_time)
+    return True
+
+
+def _discard(files):
+    for filename, temp_path in files:
+        for path in (temp_path, temp_path + '.gz'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class _RecordingSource(object):
+    """Source that records the hashes of the files read from it."""
+
+    def __init__(self, source, source_name, inputs, fetched):
+        self._source = source
+        self._source_name = source_name
+        self._inputs = inputs
+        self._fetched = fetched
+
+    def read_file(self, filename):
+        data = self._source.read_file(filename)
+        self._inputs['%s:%s' % (self._source_name, filename)] = _hash(data)
+        for url in re.findall(r'^\s*%include\s+(https?://.*)%\s*$', data, re.M):
+            self._inputs[url] = _hash_fetched(self._fetched, url)
+        return data
+
+    def list_top_level_files(self):
+        return self._source.list_top_level_files()
+
+
+class _Output(object):
+    """The files generated for a subscription file, before they are moved."""
+
+    def __init__(self, source_name, filename):
+        self.source_name = source_name
+        self.filename = filename
+        self.files = []
+        self.compressions = []
+        self.succeeded = True
+        self.inputs = {}
+
+
+def _hash(data):
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _hash_fetched(fetched, url):
+    path = fetched.get(url)
+    if not isinstance(path, basestring):
+        return None
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_manifest_path(target_dir):
+    return os.path.normpath(target_dir) + '.manifest.json'
+
+
+def get_http_cache_dir(target_dir):
+    return os.path.normpath(target_dir) + '.httpcache'
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'rb') as file:
+            manifest = json.load(file)
+    except (IOError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['outputs']
+
+
+def _write_manifest(path, outputs):
+    handle = tempfile.NamedTemporaryFile(mode='wb', dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    with handle:
+        json.dump({'version': MANIFEST_VERSION, 'outputs': outputs}, handle, indent=2, sort_keys=True)
+    os.rename(handle.name, path)
+
+
+def _is_up_to_date(sources, fetched, target_dir, output_names, inputs):
+    if not inputs:
+        return False
+    for filename in output_names:
+        if not os.path.exists(os.path.join(target_dir, filename)):
+            return False
+    for key, file_hash in inputs.iteritems():
+        if file_hash is None:
+            return False
+        if re.search(r'^https?://', key):
+            if _hash_fetched(fetched, key) != file_hash:
+                return False
+            continue
+        source_name, filename = key.split(':', 1)
+        if source_name not in sources:
+            return False
+        try:
+            if _hash(sources[source_name].read_file(filename)) != file_hash:
+                return False
+        except (IOError, OSError, KeyError):
+            return False
+    return True
+
+
+def combine_subscriptions(sources, target_dir, timeout=30, tempdir=None, processes=None, force=False, cache_dir=None):
+    """Generate the subscription files and move them into target_dir.
+
+    The files are compressed by up to `processes` (by default: the number of
+    CPUs) 7za processes at the same time, while the next files are
+    generated. The files generated for a subscription are only moved into
+    target_dir, together, once all of them have been compressed.
+
+    Files are only generated again if the files they are generated from,
+    including the files they include, changed since the last run, or if
+    `force` is true. The hashes of these files are stored in a manifest
+    next to target_dir. Files that aren't generated again keep their version
+    and timestamp.
 
-def combine_subscriptions(sources, target_dir, timeout=30, tempdir=None):
+    Remote files that subscriptions include are fetched concurrently before
+    any file is generated, and kept in `cache_dir` (by default next to
+    target_dir), see sitescripts.subscriptions.remoteIncludes. They are
+    read from there when they are included. Like local files, their hashes
+    are stored in the manifest.
+    """
     if not os.path.exists(target_dir):
         os.makedirs(target_dir, 0755)
 
-    def save_file(filename, data):
-        handle = tempfile.NamedTemporaryFile(mode='wb', dir=tempdir, delete=False)
-        handle.write(data.encode('utf-8'))
-        handle.close()
+    manifest_path = get_manifest_path(target_dir)
+    manifest = {} if force else _read_manifest(manifest_path)
+    new_manifest = {}
 
-        if hasattr(os, 'chmod'):
-            os.chmod(handle.name, 0644)
+    subscription_files = []
+    for source_name, source in sources.iteritems():
+        for filename in source.list_top_level_files():
+            if filename in ignore or filename.startswith('.'):
+                continue
+            if not filename in verbatim and not os.path.splitext(filename)[1] in accepted_extensions:
+                continue
+            subscription_files.append((source_name, filename))
+
+    start_time = time.time()
+    urls = find_remote_includes(sources, subscription_files)
+    cache = HTTPCache(cache_dir or get_http_cache_dir(target_dir))
+    fetched = fetch_all(urls, timeout, cache)
+    logging.info('Fetched %d remote files in %.2fs', len(urls), time.time() - start_time)
+
+    pool = ThreadPool(processes or multiprocessing.cpu_count())
+    pending = []
 
+    def save_file(filename, chunks):
+        # chunks is an iterable of the encoded data, it might be generated
+        # while the file is written
+        handle = tempfile.NamedTemporaryFile(mode='wb', dir=tempdir, delete=False)
         try:
-            subprocess.check_output(['7za', 'a', '-tgzip', '-mx=9', '-bd', '-mpass=5', handle.name + '.gz', handle.name])
+            with handle:
+                for chunk in chunks:
+                    handle.write(chunk)
         except:
-            print >>sys.stderr, 'Failed to compress file %s. Please ensure that p7zip is installed on the system.' % handle.name
+            os.remove(handle.name)
+            raise
 
-        path = os.path.join(target_dir, filename)
-        os.rename(handle.name, path)
-        os.rename(handle.name + '.gz', path + '.gz')
+        if hasattr(os, 'chmod'):
+            os.chmod(handle.name, 0644)
+
+        output = pending[-1]
+        output.files.append((filename, handle.name))
+        output.compressions.append(pool.apply_async(_compress, [filename, handle.name]))
 
     known = set()
-    for source_name, source in sources.iteritems():
-        for filename in source.list_top_level_files():
-            if filename in ignore or filename.startswith('.'):
+    try:
+        for source_name, filename in subscription_files:
+            output_names = [filename, filename + '.gz']
+            if filename not in verbatim:
+                tpl_filename = os.path.splitext(filename)[0] + '.tpl'
+                output_names += [tpl_filename, tpl_filename + '.gz']
+            known.update(output_names)
+
+            key = '%s:%s' % (source_name, filename)
+            inputs = manifest.get(key)
+            if _is_up_to_date(sources, fetched, target_dir, output_names, inputs):
+                new_manifest[key] = inputs
+                logging.info('Skipped %s, it is up to date', filename)
                 continue
+
+            output = _Output(source_name, filename)
+            pending.append(output)
+            recording_sources = {
+                name: _RecordingSource(source, name, output.inputs, fetched)
+                for name, source in sources.iteritems()
+            }
+            start_time = time.time()
             if filename in verbatim:
-                process_verbatim_file(source, save_file, filename)
-            elif not os.path.splitext(filename)[1] in accepted_extensions:
-                continue
+                process_verbatim_file(recording_sources[source_name], save_file, filename)
             else:
                 try:
-                    process_subscription_file(source_name, sources, save_file, filename, timeout)
+                    process_subscription_file(source_name, recording_sources, save_file, filename, timeout, fetched)
                 except:
                     print >>sys.stderr, 'Error processing subscription file "%s"' % filename
                     traceback.print_exc()
                     print >>sys.stderr
-                known.add(os.path.splitext(filename)[0] + '.tpl')
-                known.add(os.path.splitext(filename)[0] + '.tpl.gz')
-            known.add(filename)
-            known.add(filename + '.gz')
+                    output.succeeded = False
+            logging.info('Generated %s in %.2fs', filename, time.time() - start_time)
+
+            # Until the new files are moved into target_dir, the previous
+            # ones are there, generated from the previous inputs
+            if inputs is not None:
+                new_manifest[key] = inputs
+
+        for output in pending:
+            # Only move the files if all files of the subscription are ready
+            compressed = [compression.get() for compression in output.compressions]
+            if not output.succeeded or not all(compressed):
+                continue
+            for filename, temp_path in output.files:
+                path = os.path.join(target_dir, filename)
+                os.rename(temp_path, path)
+                os.rename(temp_path + '.gz', path + '.gz')
+            new_manifest['%s:%s' % (output.source_name, output.filename)] = output.inputs
+    finally:
+        pool.terminate()
+        pool.join()
+        for output in pending:
+            _discard(output.files)
+
+    _write_manifest(manifest_path, new_manifest)
 
     for filename in os.listdir(target_dir):
         if filename.startswith('.'):
@@ -82,21 +295,45 @@ def combine_subscriptions(sources, target_dir, timeout=30, tempdir=None):
             os.remove(os.path.join(target_dir, filename))
 
 
+def iter_lines(data):
+    """Iterate over the lines of a string, like data.splitlines() does."""
+    start = 0
+    for match in _line_break_regexp.finditer(data):
+        yield data[start:match.start()]
+        start = match.end()
+    if start < len(data):
+        yield data[start:]
+
+
+def _strip_header(lines):
+    for line in lines:
+        if not _header_regexp.search(line):
+            yield line
+        break
+    for line in lines:
+        yield line
+
+
 def process_verbatim_file(source, save_file, filename):
-    save_file(filename, source.read_file(filename))
+    save_file(filename, [source.read_file(filename).encode('utf-8')])
+
 
+def process_subscription_file(source_name, sources, save_file, filename, timeout, fetched=None):
+    """Generate a subscription file and the corresponding TPL file.
 
-def process_subscription_file(source_name, sources, save_file, filename, timeout):
+    The lines are passed through the includes, filters and conversions one at
+    a time, rather than copying the whole list at each step. Since the
+    checksum is at the top of the file, the remaining lines are kept in a
+    temporary file until all of them have been hashed.
+    """
     source = sources[source_name]
-    lines = source.read_file(filename).splitlines()
+    lines = iter_lines(source.read_file(filename))
 
-    header = ''
-    if len(lines) > 0:
-        header = lines.pop(0)
-    if not re.search(r'\[Adblock(?:\s*Plus\s*([\d\.]+)?)?\]', header, re.I):
+    header = next(lines, '')
+    if not _header_regexp.search(header):
         raise Exception('This is not a valid Adblock Plus subscription file.')
 
-    lines = resolve_includes(source_name, sources, lines, timeout)
+    lines = resolve_includes(source_name, sources, lines, timeout, fetched=fetched)
     seen = set(['checksum', 'version'])
 
     def check_line(line):
@@ -110,51 +347,64 @@ def process_subscription_file(source_name, sources, save_file, filename, timeout
             return False
         seen.add(key)
         return True
-    lines = filter(check_line, lines)
-
-    write_tpl(save_file, os.path.splitext(filename)[0] + '.tpl', lines)
-
-    lines.insert(0, '! Version: %s' % time.strftime('%Y%m%d%H%M', time.gmtime()))
+    lines = ifilter(check_line, lines)
 
+    version = '! Version: %s' % time.strftime('%Y%m%d%H%M', time.gmtime())
     checksum = hashlib.md5()
-    checksum.update('\n'.join([header] + lines).encode('utf-8'))
-    lines.insert(0, '! Checksum: %s' % base64.b64encode(checksum.digest()).rstrip('='))
-    lines.insert(0, header)
-    save_file(filename, '\n'.join(lines))
-
-
-def resolve_includes(source_name, sources, lines, timeout, level=0):
+    checksum.update(header.encode('utf-8'))
+    with tempfile.TemporaryFile() as body:
+        def write_line(line):
+            data = ('\n' + line).encode('utf-8')
+            checksum.update(data)
+            body.write(data)
+
+        def write_lines(lines):
+            for line in lines:
+                write_line(line)
+                yield line
+
+        # The TPL file is generated from the same lines, as they are written
+        write_line(version)
+        write_tpl(save_file, os.path.splitext(filename)[0] + '.tpl', write_lines(lines))
+
+        body.seek(0)
+        save_file(filename, chain(
+            [(header + '\n! Checksum: %s' % base64.b64encode(checksum.digest()).rstrip('=')).encode('utf-8')],
+            iter(lambda: body.read(CHUNK_SIZE), ''),
+        ))
+
+
+def resolve_includes(source_name, sources, lines, timeout, level=0, fetched=None):
+    """Iterate over the lines, with the included files in place."""
     if level > 5:
         raise Exception('There are too many nested includes, which is probably the result of a circular reference somewhere.')
 
-    result = []
     for line in lines:
         match = re.search(r'^\s*%include\s+(.*)%\s*$', line)
         if match:
             filename = match.group(1)
             newlines = None
             if re.match(r'^https?://', filename):
-                result.append('! *** Fetched from: %s ***' % filename)
-
-                for i in range(3):
-                    try:
-                        request = urllib2.urlopen(filename, None, timeout)
-                        data = request.read()
-                        error = None
-                        break
-                    except urllib2.URLError as e:
-                        error = e
-                        time.sleep(5)
-                if error:
-                    raise error
+                yield '! *** Fetched from: %s ***' % filename
+
+                # Remote files are usually fetched up front by
+                # combine_subscriptions()
+                if fetched is not None and filename in fetched:
+                    path = fetched[filename]
+                    if isinstance(path, Exception):
+                        raise path
+                    with open(path, 'rb') as file:
+                        data = file.read()
+                else:
+                    data = fetch(filename, timeout)
 
                 # We should really get the charset from the headers rather than assuming
                 # that it is UTF-8. However, some of the Google Code mirrors are
                 # misconfigured and will return ISO-8859-1 as charset instead of UTF-8.
-                newlines = data.decode('utf-8').splitlines()
-                newlines = filter(lambda l: not re.search(r'^\s*!\s*(Redirect|Homepage|Title|Version|Expires)\s*:', l, re.M | re.I), newlines)
+                newlines = iter_lines(data.decode('utf-8'))
+                newlines = ifilter(lambda l: not re.search(r'^\s*!\s*(Redirect|Homepage|Title|Version|Expires)\s*:', l, re.M | re.I), newlines)
             else:
-                result.append('! *** %s ***' % filename)
+                yield '! *** %s ***' % filename
 
                 include_source = source_name
                 if ':' in filename:
@@ -163,122 +413,22 @@ def resolve_includes(source_name, sources, lines, timeout, level=0):
                     raise Exception('Cannot include file from repository "%s", this repository is unknown' % include_source)
 
                 source = sources[include_source]
-                newlines = source.read_file(filename).splitlines()
-                newlines = resolve_includes(include_source, sources, newlines, timeout, level + 1)
+                newlines = iter_lines(source.read_file(filename))
+                newlines = resolve_includes(include_source, sources, newlines, timeout, level + 1, fetched)
 
-            if len(newlines) and re.search(r'\[Adblock(?:\s*Plus\s*([\d\.]+)?)?\]', newlines[0], re.I):
-                del newlines[0]
-            result.extend(newlines)
+            for newline in _strip_header(newlines):
+                yield newline
         else:
             if line.find('%timestamp%') >= 0:
                 if level == 0:
                     line = line.replace('%timestamp%', time.strftime('%d %b %Y %H:%M UTC', time.gmtime()))
                 else:
                     line = ''
-            result.append(line)
-    return result
+            yield line
 
 
 def write_tpl(save_file, filename, lines):
-    result = []
-    result.append('msFilterList')
-    for line in lines:
-        if re.search(r'^\s*!', line):
-            # This is a comment. Handle "Expires" comment in a special way, keep the rest.
-            match = re.search(r'^\s*!\s*Expires\s*:\s*(\d+)\s*(h)?', line, re.I)
-            if match:
-                interval = int(match.group(1))
-                if match.group(2):
-                    interval = int(interval / 24)
-                result.append(': Expires=%i' % interval)
-            else:
-                result.append(re.sub(r'^\s*!', '#', re.sub(r'--!$', '--#', line)))
-        elif line.find('#') >= 0:
-            # Element hiding rules are not supported in MSIE, drop them
-            pass
-        else:
-            # We have a blocking or exception rule, try to convert it
-            origline = line
-
-            is_exception = False
-            if line.startswith('@@'):
-                is_exception = True
-                line = line[2:]
-
-            has_unsupported = False
-            requires_script = False
-            match = re.search(r'^(.*?)\$(.*)', line)
-            if match:
-                # This rule has options, check whether any of them are important
-                line = match.group(1)
-                options = match.group(2).replace('_', '-').lower().split(',')
-
-                # Remove first-party only exceptions, we will allow an ad server everywhere otherwise
-                if is_exception and '~third-party' in options:
-                    has_unsupported = True
-
-                # A number of options are not supported in MSIE but can be safely ignored, remove them
-                options = filter(lambda o: not o in ('', 'third-party', '~third-party', 'match-case', '~match-case', '~other', '~donottrack'), options)
-
-                # Also ignore domain negation of whitelists
-                if is_exception:
-                    options = filter(lambda o: not o.startswith('domain=~'), options)
-
-                unsupported = filter(lambda o: o in ('other', 'elemhide'), options)
-                if unsupported and len(unsupported) == len(options):
-                    # The rule only applies to types that are not supported in MSIE
-                    has_unsupported = True
-                elif 'donottrack' in options:
-                    # Do-Not-Track rules have to be removed even if $donottrack is combined with other options
-                    has_unsupported = True
-                elif 'script' in options and len(options) == len(unsupported) + 1:
-                    # Mark rules that only apply to scripts for approximate conversion
-                    requires_script = True
-                elif len(options) > 0:
-                    # The rule has further options that aren't available in TPLs. For
-                    # exception rules that aren't specific to a domain we ignore all
-                    # remaining options to avoid potential false positives. Other rules
-                    # simply aren't included in the TPL file.
-                    if is_exception:
-                        has_unsupported = any([o.startswith('domain=') for o in options])
-                    else:
-                        has_unsupported = True
-
-            if has_unsupported:
-                # Do not include filters with unsupported options
-                result.append('# ' + origline)
-            else:
-                line = line.replace('^', '/')  # Assume that separator placeholders mean slashes
-
-                # Try to extract domain info
-                domain = None
-                match = re.search(r'^(\|\||\|\w+://)([^*:/]+)(:\d+)?(/.*)', line)
-                if match:
-                    domain = match.group(2)
-                    line = match.group(4)
-                else:
-                    # No domain info, remove anchors at the rule start
-                    line = re.sub(r'^\|\|', 'http://', line)
-                    line = re.sub(r'^\|', '', line)
-                # Remove anchors at the rule end
-                line = re.sub(r'\|$', '', line)
-                # Remove unnecessary asterisks at the ends of lines
-                line = re.sub(r'\*$', '', line)
-                # Emulate $script by appending *.js to the rule
-                if requires_script:
-                    line += '*.js'
-                if line.startswith('/*'):
-                    line = line[2:]
-                if domain:
-                    line = '%sd %s %s' % ('+' if is_exception else '-', domain, line)
-                    line = re.sub(r'\s+/$', '', line)
-                    result.append(line)
-                elif is_exception:
-                    # Exception rules without domains are unsupported
-                    result.append('# ' + origline)
-                else:
-                    result.append('- ' + line)
-    save_file(filename, '\n'.join(result) + '\n')
+    save_file(filename, ((line + '\n').encode('utf-8') for line in convert_to_tpl(lines)))
 
 
 class FileSource:
@@ -311,12 +461,15 @@ def usage():
 Options:
   -h          --help              Print this message and exit
   -t seconds  --timeout=seconds   Timeout when fetching remote subscriptions
+  -f          --force             Generate all files, even if they are up to date
+  -v          --verbose           Log the time it took to generate and compress
+                                  each file
 ''' % os.path.basename(sys.argv[0])
 
 
 if __name__ == '__main__':
     try:
-        opts, args = getopt(sys.argv[1:], 'ht:', ['help', 'timeout='])
+        opts, args = getopt(sys.argv[1:], 'ht:fv', ['help', 'timeout=', 'force', 'verbose'])
     except GetoptError as e:
         print str(e)
         usage()
@@ -334,11 +487,16 @@ if __name__ == '__main__':
         sources[''] = FileSource('.')
 
     timeout = 30
+    force = False
     for option, value in opts:
         if option in ('-h', '--help'):
             usage()
             sys.exit()
         elif option in ('-t', '--timeout'):
             timeout = int(value)
+        elif option in ('-f', '--force'):
+            force = True
+        elif option in ('-v', '--verbose'):
+            logging.basicConfig(level=logging.INFO)
 
-    combine_subscriptions(sources, target_dir, timeout)
+    combine_subscriptions(sources, target_dir, timeout, force=force)
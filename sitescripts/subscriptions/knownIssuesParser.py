@@ -13,10 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
-import subprocess
 import sys
 import os
 import re
+from sitescripts.hgarchive import get_archive
 from sitescripts.utils import get_config, cached
 
 supportedKeys = {
@@ -80,10 +80,9 @@ class Ruleset:
         if not self.url:
             print >>sys.stderr, 'Ruleset "%s" doesn\'t have a URL defined' % self.name
 
-    @property
-    def matched(self):
+    def isMatched(self, matched):
         for rule in self._rules:
-            if not rule.matched:
+            if rule not in matched:
                 return False
         return True
 
@@ -94,7 +93,6 @@ class Rule:
     def __init__(self, key, value):
         value = value.lower()
 
-        self.matched = False
         self.key = key
         self.patterns = []
         self.addPattern(value)
@@ -118,47 +116,164 @@ class Rule:
             value = re.sub(r'\\\|$', r'$', value)    # process anchor at expression end
             self.patterns.append(re.compile(value))
 
-    def checkMatch(self, value):
-        if self.matched:
-            return
 
-        for pattern in self.patterns:
-            if re.search(pattern, value):
-                self.matched = True
-                break
+# Patterns that can't be merged with others into one regular expression,
+# backreferences would refer to the wrong group and inline flags would
+# apply to all patterns.
+_unmergeableRegExp = re.compile(r'\\[1-9]|\(\?P=|\(\?[a-zA-Z]+\)')
 
+_lineRegExp = re.compile(r'<([\w\-]+)\s*(.*?)\s*/?>([^<>]*)')
+_attrRegExp = re.compile(r'(\w+)="([^"]*)"')
 
-def resetMatches(rules):
-    for ruleGroup in rules.itervalues():
-        for rule in ruleGroup:
-            rule.matched = False
 
+def _mergePatterns(patterns):
+    """Merge compiled patterns into as few regular expressions as possible."""
+    mergeable = []
+    result = []
+    for pattern in patterns:
+        if _unmergeableRegExp.search(pattern.pattern):
+            result.append(pattern)
+        else:
+            mergeable.append(pattern)
 
-def checkMatch(rules, key, value):
-    value = value.lower()
-    if key in rules:
-        for rule in rules[key]:
-            rule.checkMatch(value)
+    if len(mergeable) > 1:
+        source = '|'.join('(?:%s)' % pattern.pattern for pattern in mergeable)
+        try:
+            mergeable = [re.compile(source)]
+        except (re.error, AssertionError, OverflowError):
+            # Python 2 supports no more than 100 groups in an expression
+            pass
+    return mergeable + result
 
 
-def extractMatches(rules, rulesets, lang):
-    result = {}
-    for ruleset in rulesets:
-        if ruleset.matched:
-            url = re.sub(r'%LANG%', lang, ruleset.url)
-            result[url] = True
-    resetMatches(rules)
+def _unescape(value):
+    value = value.strip()
+    if '&' in value:
+        value = value.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&amp;', '&')
+    return value
 
-    result = result.keys()
-    result.sort()
-    return result
 
+class _KeyMatcher:
+    """The rules for a key, with the patterns of each rule merged.
 
-@cached(600)
-def getRules():
-    repoPath = os.path.abspath(get_config().get('subscriptions', 'repository'))
+    The patterns of all rules are merged as well, so that values which
+    don't match any rule are ruled out with a single search.
+    """
+
+    def __init__(self, rules):
+        self.rules = [(rule, _mergePatterns(rule.patterns)) for rule in rules]
+        if len(rules) > 1:
+            self.prefilter = _mergePatterns([pattern for rule in rules
+                                             for pattern in rule.patterns])
+        else:
+            self.prefilter = []
+
+    def addMatches(self, value, matched):
+        """Add the rules matching the value to the set of matched rules."""
+        for regexp in self.prefilter:
+            if regexp.search(value):
+                break
+        else:
+            if self.prefilter:
+                return
+
+        for rule, regexps in self.rules:
+            if rule in matched:
+                continue
+            for regexp in regexps:
+                if regexp.search(value):
+                    matched.add(rule)
+                    break
+
+
+class CompiledRules:
+    """The rules of all rulesets, compiled for matching report lines.
+
+    The keys that can apply to a line are looked up by tag, so only the
+    attributes required by keys that have rules are extracted.
+
+    Instances aren't modified after they have been created, the state of a
+    match is kept per call. So the same instance can be used by multiple
+    threads at once.
+    """
+
+    def __init__(self, rules, rulesets):
+        self.rules = rules
+        self.rulesets = tuple(rulesets)
+        self._dispatch = {}
+        for key, keyRules in rules.iteritems():
+            definition = supportedKeys[key]
+            requiredValue = definition[2] if len(definition) == 3 else None
+            self._dispatch.setdefault(definition[0], []).append(
+                (_KeyMatcher(keyRules), definition[1].split(' '),
+                 requiredValue),
+            )
+
+    def _getValues(self, line):
+        """Yield the key matchers that apply to a line and their values."""
+        match = _lineRegExp.search(line)
+        if not match:
+            return
+        entries = self._dispatch.get(match.group(1))
+        if not entries:
+            return
+
+        attrs = dict(_attrRegExp.findall(match.group(2)))
+        for keyMatcher, requiredAttrs, requiredValue in entries:
+            try:
+                value = ' '.join(_unescape(attrs[attr])
+                                 for attr in requiredAttrs)
+            except KeyError:
+                continue
 
-    data = subprocess.check_output(['hg', '-R', repoPath, 'cat', '-r', 'default', os.path.join(repoPath, 'knownIssues')])
+            if requiredValue != None:
+                if requiredValue != value:
+                    continue
+                value = match.group(3).strip()
+
+            yield keyMatcher, value.lower()
+
+    def _getURLs(self, matched, lang):
+        result = set()
+        for ruleset in self.rulesets:
+            if ruleset.isMatched(matched):
+                result.add(re.sub(r'%LANG%', lang, ruleset.url))
+        return sorted(result)
+
+    def findMatches(self, lines, lang):
+        """Return the URLs of the known issues matching a report."""
+        matchedRules = set()
+        for line in lines:
+            for keyMatcher, value in self._getValues(line):
+                keyMatcher.addMatches(value, matchedRules)
+        return self._getURLs(matchedRules, lang)
+
+    def findMatchesBatch(self, reports, lang):
+        """Return the URLs of the known issues matching each report.
+
+        `reports` is an iterable with the lines of each report. The values of all
+        reports are collected first, so that each distinct value is only
+        checked once against the rules for its key.
+        """
+        values = {}
+        matchedRules = []
+        for index, lines in enumerate(reports):
+            matchedRules.append(set())
+            for line in lines:
+                for keyMatcher, value in self._getValues(line):
+                    keyValues = values.setdefault(keyMatcher, {})
+                    keyValues.setdefault(value, set()).add(index)
+
+        for keyMatcher, keyValues in values.iteritems():
+            for value, indexes in keyValues.iteritems():
+                matches = set()
+                keyMatcher.addMatches(value, matches)
+                for index in indexes:
+                    matchedRules[index].update(matches)
+        return [self._getURLs(matched, lang) for matched in matchedRules]
+
+
+def parseRules(data):
     data = data.decode('utf-8').replace('\r', '').split('\n')
     data.append('[]')   # Pushes out last section
 
@@ -196,46 +311,20 @@ def getRules():
     return (rules, rulesets)
 
 
-def findMatches(it, lang):
-    global supportedKeys
-
-    rules, rulesets = getRules()
-
-    for line in it:
-        match = re.search(r'<([\w\-]+)\s*(.*?)\s*/?>([^<>]*)', line)
-        if not match:
-            continue
+@cached(600)
+def getRules():
+    repoPath = os.path.abspath(get_config().get('subscriptions', 'repository'))
+    return parseRules(get_archive(repoPath).read('knownIssues'))
 
-        tag = match.group(1)
-        attrText = match.group(2)
-        text = match.group(3).strip()
 
-        attrs = {}
-        for match in re.finditer(r'(\w+)="([^"]*)"', attrText):
-            attrs[match.group(1)] = match.group(2).strip().replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&amp;', '&')
+@cached(600)
+def getCompiledRules():
+    return CompiledRules(*getRules())
 
-        for key, t in supportedKeys.iteritems():
-            if len(t) == 3:
-                requiredTag, requiredAttrs, requiredValue = t
-            else:
-                requiredTag, requiredAttrs = t
-                requiredValue = None
-            requiredAttrs = requiredAttrs.split(' ')
-            if requiredTag != tag:
-                continue
 
-            foundAttrs = []
-            for attr in requiredAttrs:
-                if attr in attrs:
-                    foundAttrs.append(attrs[attr])
-            if len(foundAttrs) != len(requiredAttrs):
-                continue
+def findMatches(it, lang):
+    return getCompiledRules().findMatches(it, lang)
 
-            value = ' '.join(foundAttrs)
-            if requiredValue != None:
-                if requiredValue != value:
-                    continue
-                value = text
 
-            checkMatch(rules, key, value)
-    return extractMatches(rules, rulesets, lang)
+def findMatchesBatch(reports, lang):
+    return getCompiledRules().findMatchesBatch(reports, lang)
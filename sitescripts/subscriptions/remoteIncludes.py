@@ -0,0 +1,191 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fetch the remote files included by subscriptions.
+
+All remote includes of a run are fetched up front, concurrently. The
+responses are kept in a cache directory along with their ETag and
+Last-Modified headers, so that unchanged files are only revalidated, and
+the last good response is used if a file can't be fetched.
+"""
+
+import hashlib
+import httplib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+ATTEMPTS = 3
+MAX_CONCURRENT_FETCHES = 8
+
+_include_regexp = re.compile(r'^\s*%include\s+(.*)%\s*$', re.M)
+
+
+class HTTPCache(object):
+    """Responses kept in a directory, with the headers to revalidate them."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _get_path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def get_data_path(self, url):
+        """Return the path of the file with the cached data of the URL."""
+        return self._get_path(url) + '.data'
+
+    def get(self, url):
+        """Return the cached data and headers of the URL, or (None, {})."""
+        path = self._get_path(url)
+        try:
+            with open(path + '.json', 'rb') as file:
+                headers = json.load(file)
+            with open(self.get_data_path(url), 'rb') as file:
+                return file.read(), headers
+        except (IOError, ValueError):
+            return None, {}
+
+    def _write(self, path, data):
+        handle = tempfile.NamedTemporaryFile(dir=self.directory, delete=False)
+        with handle:
+            handle.write(data)
+        os.rename(handle.name, path)
+
+    def set(self, url, data, headers):
+        self._write(self.get_data_path(url), data)
+        self._write(self._get_path(url) + '.json', json.dumps(headers))
+
+
+def _fetch_once(url, timeout, cached_headers):
+    request = urllib2.Request(url)
+    if 'etag' in cached_headers:
+        request.add_header('If-None-Match', cached_headers['etag'])
+    if 'last-modified' in cached_headers:
+        request.add_header('If-Modified-Since',
+                           cached_headers['last-modified'])
+    try:
+        response = urllib2.urlopen(request, None, timeout)
+    except urllib2.HTTPError as e:
+        if e.code == 304:
+            return None, cached_headers
+        raise
+    headers = {name: response.info()[name]
+               for name in ('etag', 'last-modified')
+               if name in response.info()}
+    data = response.read()
+    # urllib2 doesn't complain if the connection is closed early
+    length = response.info().get('content-length')
+    if length and length.isdigit() and len(data) < int(length):
+        raise httplib.IncompleteRead(data, int(length) - len(data))
+    return data, headers
+
+
+def fetch(url, timeout, cache=None):
+    """Return the data of the URL, from the cache if it didn't change.
+
+    The request is attempted up to ATTEMPTS times. If it still fails, the
+    cached data is returned if there is any.
+    """
+    cached_data, cached_headers = (None, {})
+    if cache is not None:
+        cached_data, cached_headers = cache.get(url)
+    if cached_data is None:
+        cached_headers = {}
+
+    for attempt in range(ATTEMPTS):
+        try:
+            data, headers = _fetch_once(url, timeout, cached_headers)
+            break
+        except (urllib2.URLError, httplib.HTTPException, IOError) as e:
+            error = e
+            if attempt + 1 < ATTEMPTS:
+                time.sleep(attempt + 1)
+    else:
+        if cached_data is None:
+            raise error
+        message = 'Fetching {} failed, using the cached copy: {}'
+        print >>sys.stderr, message.format(url, error)
+        return cached_data
+
+    if data is None:
+        return cached_data
+    if cache is not None:
+        cache.set(url, data, headers)
+    return data
+
+
+def find_remote_includes(sources, filenames, max_level=5):
+    """Return the URLs of the remote files included by the given files.
+
+    `filenames` are tuples of the source name and filename of the top level
+    files. Local includes are followed, to find the remote files they
+    include.
+    """
+    urls = set()
+    seen = set()
+    pending = [(source_name, filename, 0)
+               for source_name, filename in filenames]
+    while pending:
+        source_name, filename, level = pending.pop()
+        if (source_name, filename) in seen or level > max_level or \
+                source_name not in sources:
+            continue
+        seen.add((source_name, filename))
+        try:
+            data = sources[source_name].read_file(filename)
+        except Exception:
+            # Errors are reported when the file is actually processed
+            continue
+        for include in _include_regexp.findall(data):
+            if re.match(r'^https?://', include):
+                urls.add(include)
+            elif ':' in include:
+                include_source, include = include.split(':', 1)
+                pending.append((include_source, include, level + 1))
+            else:
+                pending.append((source_name, include, level + 1))
+    return urls
+
+
+def fetch_all(urls, timeout, cache):
+    """Fetch the URLs concurrently into the cache.
+
+    Returns a dict mapping the URLs to the paths of the cached files with
+    their data, or to the exception that occurred fetching them, so that
+    the data doesn't have to be held in memory until it's used.
+    """
+    def fetch_url(url):
+        try:
+            fetch(url, timeout, cache)
+            return url, cache.get_data_path(url)
+        except Exception as e:
+            return url, e
+
+    urls = sorted(urls)
+    if not urls:
+        return {}
+    pool = ThreadPool(min(len(urls), MAX_CONCURRENT_FETCHES))
+    try:
+        return dict(pool.map(fetch_url, urls))
+    finally:
+        pool.close()
+        pool.join()
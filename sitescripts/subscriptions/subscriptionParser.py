@@ -17,15 +17,24 @@ import re
 import os
 import sys
 import codecs
-import subprocess
-import tarfile
+import json
+import tempfile
+from email.utils import parseaddr
 from urlparse import urlparse
-from StringIO import StringIO
 from ConfigParser import SafeConfigParser
+from sitescripts.hgarchive import get_archive
 from sitescripts.utils import get_config, cached
 
 
+# Increase whenever the parsing changes, to invalidate cached results
+CACHE_VERSION = 3
+
+_recorded_warnings = None
+
+
 def warn(message):
+    if _recorded_warnings is not None:
+        _recorded_warnings.append(message)
     print >> sys.stderr, message
 
 
@@ -238,36 +247,193 @@ def calculate_supplemented(lists):
 @cached(60)
 def get_settings():
     repo = os.path.abspath(get_config().get('subscriptions', 'repository'))
-    settingsdata = subprocess.check_output(['hg', '-R', repo, 'cat', '-r', 'default', os.path.join(repo, 'settings')])
     settings = SafeConfigParser()
-    settings.readfp(codecs.getreader('utf8')(StringIO(settingsdata)))
+    with get_archive(repo).open('settings') as file:
+        settings.readfp(codecs.getreader('utf8')(file))
     return settings
 
 
-def readSubscriptions():
-    repo = os.path.abspath(get_config().get('subscriptions', 'repository'))
-    data = subprocess.check_output(['hg', 'archive', '-R', repo, '-r', 'default', '-t', 'tar', '-I', os.path.join(repo, '*.subscription'), '-'])
+def _serialize(subscriptions):
+    result = {}
+    for name, subscription in subscriptions.iteritems():
+        data = dict(subscription._data)
+        data['supplementsType'] = sorted(data['supplementsType'])
+        data['supplemented'] = [supplementing.name
+                                for supplementing in data['supplemented']]
+        result[name] = data
+    return result
 
+
+def _deserialize(data):
+    subscriptions = {}
+    for name, subscription_data in data.iteritems():
+        subscription = Subscription.__new__(Subscription)
+        subscription._data = subscription_data
+        subscription_data['supplementsType'] = set(
+            subscription_data['supplementsType'],
+        )
+        subscriptions[name] = subscription
+    for subscription in subscriptions.itervalues():
+        subscription._data['supplemented'] = [
+            subscriptions[name] for name in subscription.supplemented
+        ]
+    return subscriptions
+
+
+def _read_cache(archive):
+    # The cache directory can be shared with other users, so only data is
+    # stored there, no pickles that could run code when loaded
+    try:
+        with open(archive.get_cache_file('subscriptions.json'), 'rb') as f:
+            cached_data = json.load(f)
+        if cached_data['version'] != CACHE_VERSION or \
+                cached_data['node'] != archive.node:
+            return None
+        return (cached_data['warnings'],
+                _deserialize(cached_data['subscriptions']))
+    except (IOError, ValueError, KeyError, TypeError):
+        # Missing, corrupt or written by an incompatible version
+        return None
+
+
+def _write_cache(archive, warnings, result):
+    path = archive.get_cache_file('subscriptions.json')
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'wb') as file:
+        json.dump({
+            'version': CACHE_VERSION,
+            'node': archive.node,
+            'warnings': warnings,
+            'subscriptions': _serialize(result),
+        }, file)
+    os.chmod(temp_path, 0644)
+    os.rename(temp_path, path)
+
+
+def _parse_subscriptions(archive):
     result = {}
-    with tarfile.open(mode='r:', fileobj=StringIO(data)) as archive:
-        for fileinfo in archive:
-            filedata = parse_file(fileinfo.name, codecs.getreader('utf8')(archive.extractfile(fileinfo)))
-            if filedata.unavailable:
-                continue
+    for filename in archive.list_files():
+        if '/' in filename or not filename.endswith('.subscription'):
+            continue
+
+        with archive.open(filename) as file:
+            filedata = parse_file(filename, codecs.getreader('utf8')(file))
+        if filedata.unavailable:
+            continue
 
-            if filedata.name in result:
-                warn('Name %s is claimed by multiple files' % filedata.name)
-            result[filedata.name] = filedata
+        if filedata.name in result:
+            warn('Name %s is claimed by multiple files' % filedata.name)
+        result[filedata.name] = filedata
 
     calculate_supplemented(result)
     return result
 
 
+def readSubscriptions():
+    """Parse the subscriptions in the default revision of the repository.
+
+    The result is cached for each revision, warnings emitted while parsing
+    are printed again when the cached result is used.
+    """
+    global _recorded_warnings
+
+    repo = os.path.abspath(get_config().get('subscriptions', 'repository'))
+    archive = get_archive(repo)
+
+    cached_data = _read_cache(archive)
+    if cached_data is not None:
+        warnings, result = cached_data
+        for message in warnings:
+            warn(message)
+        return result
+
+    _recorded_warnings = warnings = []
+    try:
+        result = _parse_subscriptions(archive)
+    finally:
+        _recorded_warnings = None
+    _write_cache(archive, warnings, result)
+    return result
+
+
+def normalize_email(value):
+    """Return the address of an email header value, lowercased, or None."""
+    if value is None:
+        return None
+    return parseaddr(value)[1].lower() or None
+
+
+class SubscriptionIndex(object):
+    """Lookup tables for the subscriptions returned by readSubscriptions().
+
+    `by_url` maps the URLs of all variants to their subscription. The other
+    lookups are done via find(), which returns sets of subscriptions so that
+    the results can be combined with set operations.
+    """
+
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+        self.by_url = {}
+        self._all = set(subscriptions.itervalues())
+        self._maps = {
+            'email': {},
+            'type': {},
+            'language': {},
+            'digest': {},
+            'digest_day': {},
+        }
+
+        for subscription in subscriptions.itervalues():
+            for title, url, complete in subscription.variants:
+                self.by_url[url] = subscription
+
+            languages = subscription.languages or ''
+            keys = {
+                'email': [normalize_email(subscription.email)],
+                'type': [subscription.type],
+                'language': [language.strip()
+                             for language in languages.split(',')],
+                'digest': [subscription.digest],
+                'digest_day': [subscription.digestDay],
+            }
+            for name, values in keys.iteritems():
+                for value in values:
+                    # Sunday is digest day 0
+                    if value is not None and value != '':
+                        self._maps[name].setdefault(value, set()).add(
+                            subscription,
+                        )
+
+    def get_urls(self):
+        """Return the set of the URLs of all variants."""
+        return set(self.by_url)
+
+    def get_emails(self):
+        """Return the set of the maintainer email addresses, lowercased."""
+        return set(self._maps['email'])
+
+    def find(self, **criteria):
+        """Return the set of subscriptions matching all criteria.
+
+        Possible criteria are `email`, `type`, `language`, `digest` and
+        `digest_day`, without criteria all subscriptions are returned.
+        """
+        result = self._all
+        for name, value in criteria.iteritems():
+            if name == 'email':
+                value = normalize_email(value)
+            result = result & self._maps[name].get(value, set())
+        return set(result)
+
+
+def readSubscriptionIndex():
+    return SubscriptionIndex(readSubscriptions())
+
+
 def getFallbackData():
     repo = os.path.abspath(get_config().get('subscriptions', 'repository'))
-    redirectdata = subprocess.check_output(['hg', '-R', repo, 'cat', '-r', 'default', os.path.join(repo, 'redirects')])
-    gonedata = subprocess.check_output(['hg', '-R', repo, 'cat', '-r', 'default', os.path.join(repo, 'gone')])
-    return (redirectdata, gonedata)
+    archive = get_archive(repo)
+    return (archive.read('redirects'), archive.read('gone'))
 
 
 def _validate_URL(url):
@@ -0,0 +1,42 @@
+msFilterList
+# Title: Golden filter list
+: Expires=4
+: Expires=1
+# Indented comment --#
+#
+-d ads.example.com
+-d ads.example.com /banner/
+-d ads.example.com /path/
+-d ads.example.com /ad.gif
+-d tracker.example.org
+- http://example.com*/ads/
+- /banner/*/ad.gif
+- */ads/
+- /ad_*.js
+-d ads.example.com
+-d ads.example.com
+# ||ads.example.com^$image
+# ||ads.example.com^$other
+# ||ads.example.com^$elemhide,other
+# ||ads.example.com^$other,image
+# ||ads.example.com^$donottrack
+# ||ads.example.com^$script,donottrack
+-d ads.example.com .js
+-d ads.example.com .js
+-d ads.example.com .js
+# ||ads.example.com^$script,image
+# ||ads.example.com^$domain=example.net
+- /ads/*.js
+- /ads/
++d example.com
++d example.com /path//
+# @@||example.com^$~third-party
++d example.com
+# @@||example.com^$~third-party,script
++d example.com
+# @@||example.com^$domain=example.net
++d example.com
++d example.com
++d example.com .js
+# @@/ads/path
++d example.com
@@ -0,0 +1,127 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for generating the subscription files."""
+
+import base64
+import hashlib
+import os
+from distutils.spawn import find_executable
+
+import pytest
+
+from sitescripts.subscriptions.combineSubscriptions import (
+    FileSource, combine_subscriptions, get_manifest_path, iter_lines,
+    process_subscription_file,
+)
+
+requires_7za = pytest.mark.skipif(not find_executable('7za'),
+                                  reason='p7zip is not installed')
+
+
+@pytest.fixture
+def source_dir(tmpdir):
+    source_dir = tmpdir.mkdir('source')
+    source_dir.join('list.txt').write(
+        '[Adblock Plus 2.0]\n! Title: List\n! Updated: %timestamp%\n'
+        '%include includes/include.txt%\n',
+    )
+    source_dir.join('other.txt').write('[Adblock Plus 2.0]\n||other^\n')
+    source_dir.mkdir('includes').join('include.txt').write('||example.com^\n')
+    source_dir.join('COPYING').write('License')
+    return source_dir
+
+
+def _combine(source_dir, target_dir, **kwargs):
+    combine_subscriptions({'source': FileSource(source_dir.strpath)},
+                          target_dir.strpath, **kwargs)
+    # Files that are generated again are new files, moved into target_dir
+    return {path.basename: (path.stat().ino, path.stat().mtime)
+            for path in target_dir.listdir()}
+
+
+@requires_7za
+def test_incremental_rebuild(source_dir, tmpdir):
+    target_dir = tmpdir.join('target')
+    first = _combine(source_dir, target_dir)
+    assert sorted(first) == [
+        'COPYING', 'COPYING.gz', 'list.tpl', 'list.tpl.gz', 'list.txt',
+        'list.txt.gz', 'other.tpl', 'other.tpl.gz', 'other.txt',
+        'other.txt.gz',
+    ]
+    assert os.path.exists(get_manifest_path(target_dir.strpath))
+    assert '||example.com^' in target_dir.join('list.txt').read()
+
+    # Nothing changed, so no file is generated again
+    assert _combine(source_dir, target_dir) == first
+
+    # Files including a changed file are generated again
+    source_dir.join('includes', 'include.txt').write('||example.org^\n')
+    second = _combine(source_dir, target_dir)
+    changed = {name for name in first if first[name] != second[name]}
+    assert changed == {'list.tpl', 'list.tpl.gz', 'list.txt', 'list.txt.gz'}
+    assert '||example.org^' in target_dir.join('list.txt').read()
+
+    # Removed files are removed from the target directory and the manifest
+    source_dir.join('other.txt').remove()
+    third = _combine(source_dir, target_dir)
+    assert 'other.txt' not in third
+    assert all(third[name] == second[name] for name in third)
+
+    forced = _combine(source_dir, target_dir, force=True)
+    assert all(forced[name] != third[name] for name in forced)
+
+
+@pytest.mark.parametrize('data', [
+    u'', u'\n', u'line', u'line\n', u'a\r\nb\rc\n\nd\x0ce\u2028f',
+])
+def test_iter_lines(data):
+    assert list(iter_lines(data)) == data.splitlines()
+
+
+def test_process_subscription_file(source_dir):
+    source_dir.join('list.txt').write(
+        '[Adblock Plus 2.0]\n! Title: List\n! Expires: 2 days\n'
+        '%include includes/include.txt%\n! Title: Duplicate\n\n'
+        '@@||example.com^$~third-party\n',
+    )
+    source_dir.join('includes', 'include.txt').write(
+        '[Adblock Plus 2.0]\n||example.com^\nexample.com##.ad\n',
+    )
+    files = {}
+
+    def save_file(filename, chunks):
+        files[filename] = ''.join(chunks)
+
+    process_subscription_file('source',
+                              {'source': FileSource(source_dir.strpath)},
+                              save_file, 'list.txt', 30)
+
+    lines = files['list.txt'].split('\n')
+    assert lines[0] == '[Adblock Plus 2.0]'
+    assert lines[1].startswith('! Checksum: ')
+    assert lines[2].startswith('! Version: ')
+    assert lines[3:] == [
+        '! Title: List', '! Expires: 2 days', '! *** includes/include.txt ***',
+        '||example.com^', 'example.com##.ad', '@@||example.com^$~third-party',
+    ]
+    checksum = hashlib.md5('\n'.join(lines[:1] + lines[2:])).digest()
+    assert lines[1] == '! Checksum: ' + base64.b64encode(checksum).rstrip('=')
+
+    assert files['list.tpl'] == (
+        'msFilterList\n# Title: List\n: Expires=2\n'
+        '# *** includes/include.txt ***\n-d example.com\n'
+        '# @@||example.com^$~third-party\n'
+    )
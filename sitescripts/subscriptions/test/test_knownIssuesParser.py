@@ -0,0 +1,132 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import pytest
+
+from sitescripts.subscriptions import knownIssuesParser
+from sitescripts.subscriptions.bin import benchmarkKnownIssues
+
+KNOWN_ISSUES = '''
+[Blocked video]
+url = https://adblockplus.org/%LANG%/issue/video
+requestLocation = ||video.example.com^
+requestLocation = /\\/ads\\/\\d+\\.mp4$/
+
+[Old Firefox]
+url = https://adblockplus.org/%LANG%/issue/firefox
+appname = firefox
+appversion = 4*
+
+[Disabled]
+url = https://adblockplus.org/%LANG%/issue/disabled
+isEnabled = false
+
+[Whitelisted]
+url = https://adblockplus.org/%LANG%/issue/whitelisted
+filterText = @@||example.com^$document
+'''
+
+REPORT = '''<report type="false negative">
+<application name="Firefox" version="4.0.1"/>
+<option id="enabled">false</option>
+<option id="collapse">true</option>
+<request location="https://video.example.com/ads/1.mp4" type="OBJECT"/>
+<filter text="@@||example.net^$document" hitCount="1"/>
+</report>'''
+
+
+@pytest.fixture
+def known_issues(mocker):
+    def use(data):
+        rules, rulesets = knownIssuesParser.parseRules(data)
+        compiled_rules = knownIssuesParser.CompiledRules(rules, rulesets)
+        mocker.patch.object(knownIssuesParser, 'getCompiledRules',
+                            lambda: compiled_rules)
+        return compiled_rules
+    return use
+
+
+def test_find_matches(known_issues):
+    known_issues(KNOWN_ISSUES)
+    matches = knownIssuesParser.findMatches(REPORT.splitlines(), 'de')
+    assert matches == [
+        'https://adblockplus.org/de/issue/disabled',
+        'https://adblockplus.org/de/issue/firefox',
+        'https://adblockplus.org/de/issue/video',
+    ]
+
+    # Match state doesn't leak into the next report
+    matches = knownIssuesParser.findMatches(
+        ['<filter text="@@||example.com^$document"/>'], 'en-US',
+    )
+    assert matches == ['https://adblockplus.org/en-US/issue/whitelisted']
+
+
+def test_unmergeable_patterns(known_issues):
+    known_issues('[Repeated]\nurl = https://example.com/\n'
+                 'requestLocation = /(ad)\\1/\nrequestLocation = /^x/\n')
+    assert knownIssuesParser.findMatches(
+        ['<request location="https://example.com/adad"/>'], 'en-US',
+    ) == ['https://example.com/']
+    assert knownIssuesParser.findMatches(
+        ['<request location="https://example.com/ad"/>'], 'en-US',
+    ) == []
+
+
+def test_same_as_legacy_matching(known_issues):
+    data = benchmarkKnownIssues.create_known_issues(200)
+    report = benchmarkKnownIssues.create_report(1000, 200)
+    known_issues(data)
+
+    rules, rulesets = knownIssuesParser.parseRules(data)
+    expected = benchmarkKnownIssues.legacy_find_matches(rules, rulesets,
+                                                        report, 'en-US')
+    assert expected
+    assert knownIssuesParser.findMatches(report, 'en-US') == expected
+
+
+def test_find_matches_batch(known_issues):
+    known_issues(KNOWN_ISSUES)
+    reports = [
+        REPORT.splitlines(),
+        [],
+        ['<filter text="@@||example.com^$document"/>'],
+        REPORT.splitlines(),
+    ]
+    assert knownIssuesParser.findMatchesBatch(iter(reports), 'de') == [
+        knownIssuesParser.findMatches(lines, 'de') for lines in reports
+    ]
+
+
+def test_concurrent_matching(known_issues):
+    compiled_rules = known_issues(KNOWN_ISSUES)
+    lines = REPORT.splitlines()
+    expected = compiled_rules.findMatches(lines, 'de')
+
+    def match():
+        for i in range(50):
+            results.append(compiled_rules.findMatches(lines, 'de'))
+            results.append(compiled_rules.findMatches([], 'de'))
+
+    results = []
+    threads = [threading.Thread(target=match) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(expected) == 200
+    assert results.count([]) == 200
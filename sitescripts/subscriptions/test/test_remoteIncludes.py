@@ -0,0 +1,169 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for fetching the remote files included by subscriptions."""
+
+import httplib
+import threading
+import urllib2
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from distutils.spawn import find_executable
+
+import pytest
+
+from sitescripts.subscriptions import remoteIncludes
+from sitescripts.subscriptions.combineSubscriptions import (
+    FileSource, combine_subscriptions,
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802
+        server = self.server
+        server.requests.append((self.path,
+                                self.headers.get('If-None-Match')))
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        data = server.files[self.path]
+        etag = '"{}"'.format(hash(data))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if self.path in server.truncated:
+            # The connection is closed before all data was sent
+            self.send_header('Content-Length', str(len(data) + 1))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.files = {'/list.txt': '||example.com^\n'}
+    server.requests = []
+    server.truncated = set()
+    server.base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return remoteIncludes.HTTPCache(tmpdir.join('cache').strpath)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(mocker):
+    mocker.patch.object(remoteIncludes.time, 'sleep')
+
+
+def test_revalidation(server, cache):
+    url = server.base_url + '/list.txt'
+    assert remoteIncludes.fetch(url, 5, cache) == '||example.com^\n'
+    assert remoteIncludes.fetch(url, 5, cache) == '||example.com^\n'
+    # The second request only revalidated the cached copy
+    assert server.requests[0] == ('/list.txt', None)
+    assert server.requests[1][1] is not None
+
+    server.files['/list.txt'] = '||example.org^\n'
+    assert remoteIncludes.fetch(url, 5, cache) == '||example.org^\n'
+
+
+def test_last_good_copy(server, cache):
+    url = server.base_url + '/list.txt'
+    remoteIncludes.fetch(url, 5, cache)
+    del server.files['/list.txt']
+    assert remoteIncludes.fetch(url, 5, cache) == '||example.com^\n'
+    assert len(server.requests) == 1 + remoteIncludes.ATTEMPTS
+
+    with pytest.raises(urllib2.HTTPError):
+        remoteIncludes.fetch(server.base_url + '/missing.txt', 5, cache)
+
+
+def test_incomplete_response(server, cache):
+    url = server.base_url + '/list.txt'
+    server.truncated.add('/list.txt')
+    with pytest.raises(httplib.IncompleteRead):
+        remoteIncludes.fetch(url, 5, cache)
+    assert len(server.requests) == remoteIncludes.ATTEMPTS
+
+    server.truncated.clear()
+    remoteIncludes.fetch(url, 5, cache)
+    server.files['/list.txt'] = '||example.org^\n'
+    server.truncated.add('/list.txt')
+    assert remoteIncludes.fetch(url, 5, cache) == '||example.com^\n'
+
+
+def test_fetch_all(server, cache, tmpdir):
+    source_dir = tmpdir.mkdir('source')
+    source_dir.join('list.txt').write(
+        '%include local.txt%\n%include {}/list.txt%\n'.format(
+            server.base_url,
+        ),
+    )
+    source_dir.join('local.txt').write(
+        '%include {}/missing.txt%\n'.format(server.base_url),
+    )
+    sources = {'source': FileSource(source_dir.strpath)}
+
+    urls = remoteIncludes.find_remote_includes(sources,
+                                               [('source', 'list.txt')])
+    assert urls == {server.base_url + '/list.txt',
+                    server.base_url + '/missing.txt'}
+
+    fetched = remoteIncludes.fetch_all(urls, 5, cache)
+    with open(fetched[server.base_url + '/list.txt'], 'rb') as file:
+        assert file.read() == '||example.com^\n'
+    assert isinstance(fetched[server.base_url + '/missing.txt'],
+                      urllib2.HTTPError)
+
+
+@pytest.mark.skipif(not find_executable('7za'),
+                    reason='p7zip is not installed')
+def test_combine_with_remote_include(server, tmpdir):
+    source_dir = tmpdir.mkdir('source')
+    source_dir.join('list.txt').write(
+        '[Adblock Plus 2.0]\n%include {}/list.txt%\n'.format(
+            server.base_url,
+        ),
+    )
+    target_dir = tmpdir.join('target')
+    cache_dir = tmpdir.join('cache')
+
+    def combine():
+        combine_subscriptions({'source': FileSource(source_dir.strpath)},
+                              target_dir.strpath, cache_dir=cache_dir.strpath)
+        # Files that are generated again are new files
+        stat = target_dir.join('list.txt').stat()
+        return stat.ino, stat.mtime
+
+    first = combine()
+    assert '||example.com^' in target_dir.join('list.txt').read()
+    assert combine() == first
+
+    server.files['/list.txt'] = '||example.org^\n'
+    combine()
+    assert '||example.org^' in target_dir.join('list.txt').read()
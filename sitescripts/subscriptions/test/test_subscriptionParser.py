@@ -0,0 +1,121 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from sitescripts.hgarchive import Archive
+from sitescripts.subscriptions import subscriptionParser
+
+SUBSCRIPTIONS = {
+    'easylist.subscription': '''
+email = easylist@example.com
+specialization = English
+homepage = https://easylist.example.com/
+list = https://easylist.example.com/easylist.txt [recommendation]
+languages = en
+''',
+    'easylistgermany.subscription': '''
+email = easylistgermany@example.com
+homepage = https://easylist.example.com/germany/
+list = https://easylist.example.com/easylistgermany.txt
+supplements = easylist
+languages = de,xx
+''',
+}
+
+
+@pytest.fixture
+def archives(tmpdir, mocker):
+    """Two revisions of the subscriptions repository, the current is first."""
+    archives = []
+    for node in ['1' * 40, '2' * 40]:
+        tree = tmpdir.join(node)
+        tree.join('settings').write('[languages]\nen=English\nde=German\n',
+                                    ensure=True)
+        for filename, content in SUBSCRIPTIONS.items():
+            tree.join(filename).write(content)
+        archives.append(Archive(tree.strpath, node))
+
+    mocker.patch.object(subscriptionParser, 'get_archive',
+                        lambda repo: archives[0])
+    return archives
+
+
+def test_read_subscriptions(archives, capsys):
+    subscriptions = subscriptionParser.readSubscriptions()
+
+    assert sorted(subscriptions) == ['easylist', 'easylistgermany']
+    easylist = subscriptions['easylist']
+    germany = subscriptions['easylistgermany']
+    assert easylist.specialization == 'English, English'
+    assert germany.specialization == 'German'
+    assert easylist.supplemented == [germany]
+    assert 'Unknown language code xx' in capsys.readouterr().err
+
+
+def test_cached_per_revision(archives, capsys, mocker):
+    parse_file = mocker.spy(subscriptionParser, 'parse_file')
+    parsed = subscriptionParser.readSubscriptions()
+    warnings = capsys.readouterr().err
+    assert parse_file.call_count == 2
+
+    subscriptions = subscriptionParser.readSubscriptions()
+    assert parse_file.call_count == 2
+    assert capsys.readouterr().err == warnings
+    assert subscriptions['easylist'].supplemented == \
+        [subscriptions['easylistgermany']]
+    assert subscriptions['easylistgermany'].supplementsType == {'ads'}
+    assert subscriptionParser._serialize(subscriptions) == \
+        subscriptionParser._serialize(parsed)
+
+    archives.reverse()
+    subscriptionParser.readSubscriptions()
+    assert parse_file.call_count == 4
+
+
+def test_subscription_index(archives):
+    index = subscriptionParser.readSubscriptionIndex()
+    easylist = index.subscriptions['easylist']
+    germany = index.subscriptions['easylistgermany']
+
+    assert index.by_url == {
+        'https://easylist.example.com/easylist.txt': easylist,
+        'https://easylist.example.com/easylistgermany.txt': germany,
+    }
+    assert index.get_emails() == {'easylist@example.com',
+                                  'easylistgermany@example.com'}
+    assert index.find() == {easylist, germany}
+    assert index.find(email='Maintainer <easylist@example.com>') == \
+        {easylist}
+    assert index.find(language='xx') == {germany}
+    assert index.find(type='ads', language='en') == {easylist}
+    assert index.find(type='privacy') == set()
+    assert index.find(digest='weekly', digest_day=3) == {easylist, germany}
+    assert index.find(digest='daily') == set()
+
+
+def test_subscription_index_normalization(archives, tmpdir):
+    tmpdir.join('1' * 40, 'sunday.subscription').write(
+        'email = Sunday <Sunday@Example.com>\nspecialization = Sunday\n'
+        'homepage = https://sunday.example.com/\n'
+        'list = https://sunday.example.com/sunday.txt\ndigestDay = sonntag\n',
+    )
+    index = subscriptionParser.readSubscriptionIndex()
+    sunday = index.subscriptions['sunday']
+
+    assert index.find(digest_day=0) == {sunday}
+    assert index.find(email='sunday@example.com') == {sunday}
+    assert index.find(email='SUNDAY@example.COM') == {sunday}
+    assert 'sunday@example.com' in index.get_emails()
@@ -0,0 +1,43 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for converting filter lists to TPL files."""
+
+import io
+import os
+
+from sitescripts.subscriptions import tplConverter
+from sitescripts.subscriptions.bin import benchmarkTpl
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _read_lines(filename):
+    with io.open(os.path.join(DATA_DIR, filename), encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+def test_golden_file():
+    lines = _read_lines('filters.txt')
+    assert list(tplConverter.convert_to_tpl(lines)) == \
+        _read_lines('filters.tpl')
+
+
+def test_same_as_legacy_conversion():
+    lines = benchmarkTpl.create_filter_list(5000)
+    lines += [u'||\xe4.example.com^$script', u' \t! Expires: 48 H',
+              '||example.com \t/', '@@||example.com/$~third-party,image']
+    assert list(tplConverter.convert_to_tpl(lines)) == \
+        list(benchmarkTpl.legacy_convert_to_tpl(lines))
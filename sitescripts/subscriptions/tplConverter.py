@@ -0,0 +1,190 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Convert filter lists to Tracking Protection Lists (TPL) for MSIE.
+
+The options of a filter are classified in one pass, by looking them up in
+OPTION_CLASSES, and the patterns are compiled once, when the module is
+imported.
+"""
+
+import re
+
+# The characters that \s matches in the patterns (without re.UNICODE)
+_WHITESPACE = ' \t\n\r\f\v'
+
+# Options that aren't supported in MSIE but can be safely ignored
+IGNORED = 'ignored'
+# Options for types that aren't supported in MSIE
+UNSUPPORTED = 'unsupported'
+DO_NOT_TRACK = 'donottrack'
+SCRIPT = 'script'
+# Any other option, the filter can't be converted if it has one
+OTHER = 'other'
+
+OPTION_CLASSES = {
+    '': IGNORED,
+    'third-party': IGNORED,
+    '~third-party': IGNORED,
+    'match-case': IGNORED,
+    '~match-case': IGNORED,
+    '~other': IGNORED,
+    '~donottrack': IGNORED,
+    'other': UNSUPPORTED,
+    'elemhide': UNSUPPORTED,
+    'donottrack': DO_NOT_TRACK,
+    'script': SCRIPT,
+}
+
+_expires_regexp = re.compile(r'\s*!\s*Expires\s*:\s*(\d+)\s*(h)?', re.I)
+_domain_regexp = re.compile(r'(\|\||\|\w+://)([^*:/]+)(:\d+)?(/.*)')
+
+
+def _convert_comment(line):
+    match = _expires_regexp.match(line)
+    if match:
+        interval = int(match.group(1))
+        if match.group(2):
+            interval = int(interval / 24)
+        return ': Expires=%i' % interval
+    if line.endswith('--!'):
+        line = line[:-1] + '#'
+    return '#' + line.lstrip(_WHITESPACE)[1:]
+
+
+def _classify_options(options, is_exception):
+    """Return whether a filter is unsupported and whether it needs *.js.
+
+    The filter can't be converted if it has options that are unsupported in
+    MSIE. If it only applies to scripts, it is converted approximately.
+    """
+    # Remove first-party only exceptions, we will allow an ad server
+    # everywhere otherwise
+    first_party = False
+    count = 0
+    counts = dict.fromkeys([UNSUPPORTED, DO_NOT_TRACK, SCRIPT], 0)
+    has_domain = False
+    for option in options.replace('_', '-').lower().split(','):
+        option_class = OPTION_CLASSES.get(option, OTHER)
+        if option_class == IGNORED:
+            if is_exception and option == '~third-party':
+                first_party = True
+            continue
+        # Also ignore domain negation of whitelists
+        if is_exception and option.startswith('domain=~'):
+            continue
+        count += 1
+        if option_class != OTHER:
+            counts[option_class] += 1
+        if option.startswith('domain='):
+            has_domain = True
+
+    unsupported = counts[UNSUPPORTED]
+    if unsupported and unsupported == count:
+        # The rule only applies to types that are not supported in MSIE
+        return True, False
+    if counts[DO_NOT_TRACK]:
+        # Do-Not-Track rules have to be removed even if $donottrack is
+        # combined with other options
+        return True, False
+    if counts[SCRIPT] and count == unsupported + 1:
+        # Mark rules that only apply to scripts for approximate conversion
+        return first_party, True
+    if count:
+        # The rule has further options that aren't available in TPLs. For
+        # exception rules that aren't specific to a domain we ignore all
+        # remaining options to avoid potential false positives. Other rules
+        # simply aren't included in the TPL file.
+        return has_domain if is_exception else True, False
+    return first_party, False
+
+
+def _convert_rule(line):
+    origline = line
+
+    is_exception = line.startswith('@@')
+    if is_exception:
+        line = line[2:]
+
+    has_unsupported = False
+    requires_script = False
+    line, separator, options = line.partition('$')
+    if separator:
+        has_unsupported, requires_script = _classify_options(options,
+                                                             is_exception)
+    if has_unsupported:
+        # Do not include filters with unsupported options
+        return '# ' + origline
+
+    # Assume that separator placeholders mean slashes
+    line = line.replace('^', '/')
+
+    # Try to extract domain info
+    domain = None
+    match = _domain_regexp.match(line)
+    if match:
+        domain = match.group(2)
+        line = match.group(4)
+    elif line.startswith('||'):
+        # No domain info, remove anchors at the rule start
+        line = 'http://' + line[2:]
+    elif line.startswith('|'):
+        line = line[1:]
+    # Remove anchors at the rule end
+    if line.endswith('|'):
+        line = line[:-1]
+    # Remove unnecessary asterisks at the ends of lines
+    if line.endswith('*'):
+        line = line[:-1]
+    # Emulate $script by appending *.js to the rule
+    if requires_script:
+        line += '*.js'
+    if line.startswith('/*'):
+        line = line[2:]
+
+    if domain:
+        line = '%sd %s %s' % ('+' if is_exception else '-', domain, line)
+        if line.endswith('/'):
+            stripped = line[:-1].rstrip(_WHITESPACE)
+            if len(stripped) < len(line) - 1:
+                line = stripped
+        return line
+    if is_exception:
+        # Exception rules without domains are unsupported
+        return '# ' + origline
+    return '- ' + line
+
+
+def convert_filter(line):
+    """Return the TPL line for a line of a filter list.
+
+    None is returned for lines that have no equivalent in TPL files, i.e.
+    element hiding filters.
+    """
+    if line.lstrip(_WHITESPACE).startswith('!'):
+        return _convert_comment(line)
+    if '#' in line:
+        # Element hiding rules are not supported in MSIE, drop them
+        return None
+    return _convert_rule(line)
+
+
+def convert_to_tpl(lines):
+    """Iterate over the lines of the TPL file for the filters."""
+    yield 'msFilterList'
+    for line in lines:
+        line = convert_filter(line)
+        if line is not None:
+            yield line
@@ -18,16 +18,18 @@ from urlparse import urlparse, parse_qs
 import sys
 import os
 import re
+from sitescripts.hgarchive import resolve
 from sitescripts.utils import get_config, cached, setupStderr
-from sitescripts.web import url_handler
+from sitescripts.web import conditional_get, url_handler
 import sitescripts.subscriptions.subscriptionParser as subscriptionParser
 
 
 @url_handler('/getSubscription')
+@conditional_get(lambda environ: getData()[0], 'max-age=600')
 def handleSubscriptionFallbackRequest(environ, start_response):
     setupStderr(environ['wsgi.errors'])
 
-    redirects, gone = getData()
+    revision, redirects, gone = getData()
 
     start_response('200 OK', [('Content-Type', 'text/plain')])
 
@@ -48,11 +50,15 @@ def handleSubscriptionFallbackRequest(environ, start_response):
 def getData():
     processed = set()
 
+    # Resolved first, so that the data is never older than the revision
+    repo = os.path.abspath(get_config().get('subscriptions', 'repository'))
+    revision = resolve(repo)
+
     redirectData, goneData = subscriptionParser.getFallbackData()
     redirects = processData(redirectData, processed, {})
     gone = processData(goneData, processed, set())
 
-    return (redirects, gone)
+    return (revision, redirects, gone)
 
 
 def processData(data, processed, var):
@@ -17,6 +17,7 @@ import os
 import MySQLdb
 import json
 from urlparse import parse_qs
+from sitescripts.requestbody import RequestBodyError, spool_body
 from sitescripts.web import url_handler
 from sitescripts.utils import cached, get_config, setupStderr
 
@@ -30,17 +31,15 @@ def submit_data(environ, start_response):
 
     params = parse_qs(environ.get('QUERY_STRING', ''))
     requestVersion = params.get('version', ['0'])[0]
-    data = '{}'
-    try:
-        data_length = int(environ.get('CONTENT_LENGTH', '0'))
-    except ValueError:
-        data_length = 0
-    if data_length != 0:
-        data = environ['wsgi.input'].read(data_length)
-    try:
-        data = json.loads(data)
-    except json.decoder.JSONDecodeError:
-        return showError('Error while parsing JSON data.', start_response)
+    data = {}
+    if environ.get('CONTENT_LENGTH', '0') not in ('', '0'):
+        try:
+            with spool_body(environ) as body:
+                data = json.load(body)
+        except RequestBodyError as e:
+            return showError(str(e), start_response)
+        except json.decoder.JSONDecodeError:
+            return showError('Error while parsing JSON data.', start_response)
 
     db = _get_db()
 
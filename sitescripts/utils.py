@@ -17,50 +17,225 @@ import os
 import sys
 import re
 import codecs
-import subprocess
+import gzip
+import shutil
+import threading
 import sitescripts
+from collections import OrderedDict
 from time import time
 from tempfile import mkstemp
-from ConfigParser import SafeConfigParser
+from ConfigParser import (DEFAULTSECT, InterpolationError, NoOptionError,
+                          NoSectionError, RawConfigParser, SafeConfigParser)
 
 siteScriptsPath = sitescripts.__path__[0]
 
 
+class _Flight(object):
+    """A computation of a cached value that other callers wait for."""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.done = threading.Event()
+
+
 class cached(object):
     """
       Decorator that caches a function's return value for a given number of seconds.
-      Note that this only works if the string representation of the parameters is
-      always unique.
+      Note that the parameters have to be hashable.
+
+      At most `max_size` results are kept, the least recently used ones are
+      evicted first. Concurrent callers wait for the result of the first one
+      instead of calling the function as well. If `stale_while_revalidate`
+      is given, expired results are returned for that many more seconds
+      while the function is called again in a background thread.
     """
 
-    def __init__(self, timeout):
+    def __init__(self, timeout, max_size=1024, stale_while_revalidate=0):
         self.timeout = timeout
-        self.lastResult = {}
-        self.lastUpdate = {}
+        self.max_size = max_size
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
 
     def __call__(self, func):
         def wrapped(*args, **kwargs):
-            key = str(kwargs)
-            currentTime = time()
-            if (args, key) not in self.lastUpdate or currentTime - self.lastUpdate[args, key] > self.timeout:
-                self.lastResult[args, key] = func(*args, **kwargs)
-                self.lastUpdate[args, key] = currentTime
-            return self.lastResult[args, key]
+            return self._get((args, tuple(sorted(kwargs.items()))),
+                             func, args, kwargs)
         self.func = func
+        wrapped.cache = self
         return wrapped
 
     def __repr__(self):
         return repr(self.func)
 
-
-@cached(3600)
-def get_config():
-    """
-      Returns parsed configuration file (SafeConfigParser instance). File paths
-      that will be checked: ~/.sitescripts, ~/sitescripts.ini, /etc/sitescripts,
-      /etc/sitescripts.ini
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key, func, args, kwargs):
+        while True:
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                age = None
+                if entry is not None:
+                    # Move the entry to the end, as the most recently used
+                    self._entries[key] = entry
+                    age = time() - entry[0]
+                    if age <= self.timeout:
+                        self.hits += 1
+                        return entry[1]
+
+                flight = self._flights.get(key)
+                stale = (age is not None and
+                         age <= self.timeout + self.stale_while_revalidate)
+                if stale:
+                    self.hits += 1
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    if stale:
+                        threading.Thread(
+                            target=self._compute,
+                            args=(key, flight, func, args, kwargs),
+                        ).start()
+                        return entry[1]
+                    self.misses += 1
+                    break
+                if stale:
+                    return entry[1]
+            # Recursive calls of the function compute the value themselves
+            if flight.thread is threading.current_thread():
+                return func(*args, **kwargs)
+            # If the computation fails, the next caller tries again
+            flight.done.wait()
+        return self._compute(key, flight, func, args, kwargs)
+
+    def _compute(self, key, flight, func, args, kwargs):
+        flight.thread = threading.current_thread()
+        try:
+            result = func(*args, **kwargs)
+            with self._lock:
+                self._entries.pop(key, None)
+                self._entries[key] = (time(), result)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+# Seconds after which get_config() checks whether the file changed
+CONFIG_CHECK_INTERVAL = 1
+
+_config_state = {'config': None, 'checked': 0}
+_config_lock = threading.Lock()
+
+_NO_DEFAULT = object()
+
+
+class ConfigSnapshot(object):
+    """Immutable configuration, interpolated once when it's read.
+
+    Provides the reading methods of SafeConfigParser, looking values up in
+    dicts with the interpolated values of each section. `getint()`,
+    `getfloat()` and `getboolean()` optionally take a default value that's
+    returned if the option is missing. `key` identifies the version of the
+    file the configuration was read from.
     """
 
+    def __init__(self, parser, key=None):
+        self.key = key
+        self._raw_defaults = dict(parser.defaults())
+        self._sections = parser.sections()
+        self._raw = {}
+        self._values = {}
+        for section in [DEFAULTSECT] + parser.sections():
+            raw = dict(self._raw_defaults)
+            values = {}
+            if section != DEFAULTSECT:
+                raw.update(parser.items(section, raw=True))
+            for option in raw:
+                # Values that can't be interpolated only fail when read
+                try:
+                    values[option] = parser.get(section, option)
+                except InterpolationError as e:
+                    values[option] = e
+            self._raw[section] = raw
+            self._values[section] = values
+
+    def _get_values(self, section, raw=False):
+        try:
+            return (self._raw if raw else self._values)[section]
+        except KeyError:
+            raise NoSectionError(section)
+
+    def defaults(self):
+        return dict(self._raw_defaults)
+
+    def sections(self):
+        return list(self._sections)
+
+    def has_section(self, section):
+        return section != DEFAULTSECT and section in self._values
+
+    def options(self, section):
+        if section == DEFAULTSECT:
+            raise NoSectionError(section)
+        return list(self._get_values(section))
+
+    def has_option(self, section, option):
+        return option in self._values.get(section or DEFAULTSECT, ())
+
+    def get(self, section, option, raw=False):
+        values = self._get_values(section, raw)
+        try:
+            value = values[option]
+        except KeyError:
+            raise NoOptionError(option, section)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def items(self, section, raw=False):
+        return [(option, self.get(section, option, raw))
+                for option in self._get_values(section, raw)]
+
+    def get_section(self, section):
+        """Return a dict with the interpolated values of a section."""
+        return dict(self.items(section))
+
+    def _get_typed(self, convert, section, option, default):
+        if default is not _NO_DEFAULT and \
+                not self.has_option(section, option):
+            return default
+        return convert(self.get(section, option))
+
+    def getint(self, section, option, default=_NO_DEFAULT):
+        return self._get_typed(int, section, option, default)
+
+    def getfloat(self, section, option, default=_NO_DEFAULT):
+        return self._get_typed(float, section, option, default)
+
+    def getboolean(self, section, option, default=_NO_DEFAULT):
+        def convert(value):
+            if value.lower() not in RawConfigParser._boolean_states:
+                raise ValueError('Not a boolean: %s' % value)
+            return RawConfigParser._boolean_states[value.lower()]
+        return self._get_typed(convert, section, option, default)
+
+
+def _get_config_path():
     paths = []
 
     # Allow SITESCRIPTS_CONFIG variable to override config path
@@ -78,14 +253,41 @@ def get_config():
     for path in paths:
         path = os.path.abspath(path)
         if os.path.exists(path):
-            config = SafeConfigParser()
-            config.optionxform = lambda x: x
-            config.read(path)
-            return config
+            return path
 
     raise Exception('No config file found. Please put sitescripts.ini into your home directory or /etc')
 
 
+def get_config():
+    """
+      Returns the parsed configuration file (ConfigSnapshot instance). File
+      paths that will be checked: ~/.sitescripts, ~/sitescripts.ini,
+      /etc/sitescripts, /etc/sitescripts.ini
+
+      The file is only read again if its path, inode, modification time or
+      size changed, which is checked at most every CONFIG_CHECK_INTERVAL
+      seconds.
+    """
+    config = _config_state['config']
+    if config is not None and \
+            time() - _config_state['checked'] < CONFIG_CHECK_INTERVAL:
+        return config
+
+    with _config_lock:
+        path = _get_config_path()
+        stat = os.stat(path)
+        key = (path, stat.st_ino, stat.st_mtime, stat.st_size)
+        config = _config_state['config']
+        if config is None or config.key != key:
+            parser = SafeConfigParser()
+            parser.optionxform = lambda x: x
+            parser.read(path)
+            config = ConfigSnapshot(parser, key)
+        _config_state['config'] = config
+        _config_state['checked'] = time()
+    return config
+
+
 def setupStderr(stream=sys.stderr):
     """
       Sets up sys.stderr to accept Unicode characters, redirects error output to
@@ -108,19 +310,13 @@ def anonymizeMail(email):
 
 def sendMail(template, data):
     """
-      Sends a mail generated from the template and data given.
+      Sends a mail generated from the template and data given. If a spool
+      directory is configured, the mail is only queued, see
+      sitescripts.mail.spool.
     """
+    from sitescripts.mail.spool import send
     template = get_template(template, False)
-    mail = template.render(data)
-    config = get_config()
-    if config.has_option('DEFAULT', 'mailerDebug') and config.get('DEFAULT', 'mailerDebug') == 'yes':
-        handle, path = mkstemp(prefix='mail_', suffix='.eml', dir='.')
-        os.close(handle)
-        f = codecs.open(path, 'wb', encoding='utf-8')
-        print >>f, mail
-        f.close()
-    else:
-        subprocess.Popen([config.get('DEFAULT', 'mailer'), '-t'], stdin=subprocess.PIPE).communicate(mail.encode('utf-8'))
+    send(template.render(data))
 
 
 def encode_email_address(email):
@@ -207,3 +403,22 @@ def get_custom_template_environment(additional_filters, loader=None):
     env.filters.update(filters)
     env.filters.update(additional_filters)
     return env
+
+
+def write_compressed_copy(path):
+    """Write a gzip-compressed copy of the file, with `.gz` appended.
+
+    This lets web servers (and sitescripts.web.send_file()) send the
+    compressed copy to clients that accept it, without compressing the file
+    on each request.
+    """
+    fd, temp_path = mkstemp(dir=os.path.dirname(path))
+    try:
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb') as file:
+            with gzip.GzipFile(os.path.basename(path), 'wb', 9, file) as target:
+                shutil.copyfileobj(source, target)
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path + '.gz')
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -14,18 +14,50 @@
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
 import base64
+import errno
+import fcntl
+import hashlib
+import math
 import imp
 import importlib
+import os
 import re
 import httplib
+import threading
+import time
 import urllib
-from urlparse import parse_qsl
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate, mktime_tz, parsedate_tz
 
+from sitescripts.requestbody import RequestBodyError, iter_urlencoded
 from sitescripts.utils import get_config
 
 handlers = {}
 authenticated_users = {}
 
+# URLs of handlers in modules that are only imported once a request for one
+# of these URLs comes in, mapped to the module names
+lazy_handlers = {}
+
+# Seconds it took to import each handler module
+import_times = {}
+
+# Concurrency limits of handlers, by the URL they are registered for
+limits = {}
+
+# Seconds between the attempts of queued requests to get a shared slot
+LIMIT_POLL_INTERVAL = 0.01
+
+_import_lock = threading.Lock()
+
+# Compressed response bodies by the SHA-1 of the uncompressed body, least
+# recently used first, and the maximal number of compressed bytes kept
+_compression_cache = OrderedDict()
+_compression_cache_size = [0]
+_compression_lock = threading.Lock()
+COMPRESSION_CACHE_SIZE = 16 * 1024 * 1024
+
 
 def url_handler(url):
     def decorator(func):
@@ -95,15 +127,10 @@ def form_handler(func):
             return send_simple_response(start_response, 415)
 
         try:
-            content_length = int(environ['CONTENT_LENGTH'])
-        except (KeyError, ValueError):
-            content_length = None
-        if content_length is None or content_length < 0:
-            return send_simple_response(start_response, 411)
-
-        raw_data = parse_qsl(environ['wsgi.input'].read(content_length))
-        try:
-            data = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw_data}
+            data = {k.decode('utf-8'): v.decode('utf-8')
+                    for k, v in iter_urlencoded(environ)}
+        except RequestBodyError as e:
+            return send_simple_response(start_response, e.status, str(e))
         except UnicodeDecodeError:
             return send_simple_response(start_response, 400, 'Invalid form data encoding')
 
@@ -112,23 +139,494 @@ def form_handler(func):
     return wrapper
 
 
-def multiplex(environ, start_response):
-    try:
-        path = environ['PATH_INFO']
+def _is_not_modified(environ, etag, last_modified):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        return bool(tags & {'*', etag, 'W/' + etag})
+
+    if_modified_since = parsedate_tz(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is not None:
+        return last_modified <= mktime_tz(if_modified_since)
+    return False
+
+
+def conditional_get(get_version, cache_control='no-cache'):
+    """Answer conditional GET requests without calling the handler.
+
+    `get_version(environ)` is called for each GET and HEAD request and has to
+    be cheap. It returns a key that changes whenever the response for the
+    requested URL changes, e.g. a revision or a file modification time, or
+    None if the response can't be reused.
+
+    Responses get a strong ETag derived from the key, a Last-Modified header
+    with the time this process first saw the key and the given Cache-Control
+    header. Requests whose If-None-Match or If-Modified-Since header matches
+    are answered with 304 Not Modified.
+    """
+    def decorator(func):
+        first_seen = {}
+
+        def wrapper(environ, start_response):
+            if environ.get('REQUEST_METHOD', 'GET') not in {'GET', 'HEAD'}:
+                return func(environ, start_response)
+            version = get_version(environ)
+            if version is None:
+                return func(environ, start_response)
+
+            etag = '"%s"' % hashlib.sha1(repr(version)).hexdigest()
+            if etag not in first_seen and len(first_seen) >= 100:
+                first_seen.clear()
+            last_modified = first_seen.setdefault(etag, int(time.time()))
+            cache_headers = [
+                ('ETag', etag),
+                ('Last-Modified', formatdate(last_modified, usegmt=True)),
+                ('Cache-Control', cache_control),
+            ]
+            if _is_not_modified(environ, etag, last_modified):
+                start_response('304 Not Modified', cache_headers)
+                return []
+
+            def start_cacheable_response(status, headers, exc_info=None):
+                if int(status.split(None, 1)[0]) < 400:
+                    names = {name.lower() for name, value in headers}
+                    headers = headers + [header for header in cache_headers
+                                         if header[0].lower() not in names]
+                if exc_info is None:
+                    return start_response(status, headers)
+                return start_response(status, headers, exc_info)
+
+            return func(environ, start_cacheable_response)
+        return wrapper
+    return decorator
+
+
+def load_handler_module(module):
+    with _import_lock:
+        if module in import_times:
+            return
+
+        module_path = get_config().get('multiplexer', module)
+        start_time = time.time()
+        if module_path:
+            imp.load_source(module, module_path)
+        else:
+            importlib.import_module(module)
+        import_times[module] = time.time() - start_time
+
+
+def accepts_gzip(environ):
+    """Check whether the Accept-Encoding of the request allows gzip."""
+    qualities = {}
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = coding.split(';')
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[params[0].strip().lower()] = quality
+
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def _gzip(data):
+    # Unlike the gzip module, this doesn't add a timestamp, so that the same
+    # data always results in the same compressed data
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _get_compressed(data):
+    key = hashlib.sha1(data).digest()
+    with _compression_lock:
+        compressed = _compression_cache.pop(key, None)
+        if compressed is not None:
+            _compression_cache[key] = compressed
+            return compressed
+
+    compressed = _gzip(data)
+    with _compression_lock:
+        if key not in _compression_cache:
+            _compression_cache[key] = compressed
+            _compression_cache_size[0] += len(compressed)
+        while _compression_cache_size[0] > COMPRESSION_CACHE_SIZE:
+            key, value = _compression_cache.popitem(last=False)
+            _compression_cache_size[0] -= len(value)
+    return compressed
+
+
+def _gzip_etag(etag):
+    # Strong ETags have to differ between the encodings of a response
+    return etag[:-1] + '-gzip"' if etag.endswith('"') else etag
+
+
+def compress_response(min_size=1024):
+    """Compress the responses of the handler, if the client accepts gzip.
+
+    Responses smaller than `min_size` bytes, responses with a status other
+    than 200 and responses that are encoded already (see send_file()) are
+    sent as they are. Compressed bodies are cached, so that the same body
+    isn't compressed twice. This has to be applied outside of
+    conditional_get(), so that the ETags of compressed responses differ.
+    """
+    def decorator(func):
+        def wrapper(environ, start_response):
+            if not accepts_gzip(environ):
+                def start_identity_response(status, headers, exc_info=None):
+                    headers = headers + [('Vary', 'Accept-Encoding')]
+                    if exc_info is None:
+                        return start_response(status, headers)
+                    return start_response(status, headers, exc_info)
+                return func(environ, start_identity_response)
+
+            # Requests for the compressed response are checked against the
+            # ETag of the uncompressed one
+            if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+            if if_none_match is not None:
+                environ = dict(environ, HTTP_IF_NONE_MATCH=re.sub(
+                    r'-gzip"', '"', if_none_match,
+                ))
+
+            response = []
+            body = []
+
+            def start_buffered_response(status, headers, exc_info=None):
+                response[:] = [status, headers]
+                return body.append
+
+            result = func(environ, start_buffered_response)
+            try:
+                body.extend(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            status, headers = response
+            body = ''.join(body)
+
+            names = {name.lower() for name, value in headers}
+            compress = (status.startswith('200 ') and
+                        'content-encoding' not in names and
+                        len(body) >= min_size)
+            if compress:
+                body = _get_compressed(body)
+            # Clients with a compressed response revalidate it with its ETag
+            gzip_etag = compress or (status.startswith('304 ') and
+                                     '-gzip"' in (if_none_match or ''))
+
+            new_headers = []
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    continue
+                if name.lower() == 'etag' and gzip_etag:
+                    value = _gzip_etag(value)
+                new_headers.append((name, value))
+            if compress:
+                new_headers.append(('Content-Encoding', 'gzip'))
+            if 'vary' not in names:
+                new_headers.append(('Vary', 'Accept-Encoding'))
+            if not status.startswith('304 '):
+                new_headers.append(('Content-Length', str(len(body))))
+            start_response(status, new_headers)
+            return [body]
+        return wrapper
+    return decorator
+
+
+def send_file(environ, start_response, path, headers, block_size=4096):
+    """Send a file, or its precompressed copy if the client accepts gzip.
+
+    The precompressed copy is the file with `.gz` appended, see
+    sitescripts.utils.write_compressed_copy(). It's only used if it's not
+    older than the file.
+    """
+    headers = headers + [('Vary', 'Accept-Encoding')]
+    compressed_path = path + '.gz'
+    if accepts_gzip(environ):
         try:
-            handler = handlers[path]
-        except KeyError:
-            handler = handlers[re.sub(r'[^/]+$', '', path)]
-    except KeyError:
+            if os.path.getmtime(compressed_path) >= os.path.getmtime(path):
+                path = compressed_path
+                headers.append(('Content-Encoding', 'gzip'))
+        except OSError:
+            pass
+
+    file = open(path, 'rb')
+    headers.append(('Content-Length', str(os.fstat(file.fileno()).st_size)))
+    start_response('200 OK', headers)
+    if 'wsgi.file_wrapper' in environ:
+        return environ['wsgi.file_wrapper'](file, block_size)
+    return _read_file(file, block_size)
+
+
+def _read_file(file, block_size):
+    with file:
+        for data in iter(lambda: file.read(block_size), ''):
+            yield data
+
+
+def load_lazy_handler_modules():
+    """Import the modules that would otherwise be imported on first hit."""
+    for module in set(lazy_handlers.itervalues()):
+        load_handler_module(module)
+
+
+def find_handler(path):
+    """Return the URL and handler for the path, importing it if necessary.
+
+    Handlers registered for the exact path take precedence over handlers
+    registered for the directory (i.e. the path up to the last slash).
+    If there is no handler for the path, (None, None) is returned.
+    """
+    for url in (path, re.sub(r'[^/]+$', '', path)):
+        if url not in handlers and url in lazy_handlers:
+            load_handler_module(lazy_handlers[url])
+        if url in handlers:
+            return url, handlers[url]
+    return None, None
+
+
+class ConcurrencyLimit(object):
+    """Limit the number of requests a handler processes at the same time.
+
+    Requests over the limit wait for up to `timeout` seconds in a queue of
+    up to `queue_size` requests, further requests are rejected right away.
+    The limit applies to the threads of the current process, use
+    SharedConcurrencyLimit to limit the requests of several processes.
+    """
+
+    def __init__(self, concurrency, queue_size=0, timeout=0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, on_queue_change=None):
+        """Wait for the request's turn, return None if it's rejected.
+
+        Otherwise, the slot that has to be passed to release() is returned.
+        `on_queue_change(delta)` is called when the request enters or
+        leaves the queue.
+        """
+        with self._condition:
+            if self.active < self.concurrency:
+                self.active += 1
+                return True
+            if self.queued >= self.queue_size:
+                return None
+
+            self.queued += 1
+            if on_queue_change:
+                on_queue_change(1)
+            try:
+                deadline = time.time() + self.timeout
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.queued -= 1
+                if on_queue_change:
+                    on_queue_change(-1)
+
+    def release(self, slot=True):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class SharedConcurrencyLimit(object):
+    """Limit the requests of a handler in all processes sharing a directory.
+
+    Each slot, for a request being processed or waiting in the queue, is a
+    file in `directory` that is locked while a request has it. The lock is
+    released by the system when a process exits, so that the slots of
+    crashed processes are available again right away.
+    """
+
+    def __init__(self, directory, url, concurrency, queue_size=0, timeout=0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        prefix = os.path.join(directory, hashlib.sha1(url).hexdigest())
+        self._slots = ['{}.active.{}'.format(prefix, i)
+                       for i in range(concurrency)]
+        self._queue_slots = ['{}.queued.{}'.format(prefix, i)
+                             for i in range(queue_size)]
+
+    def _lock_any(self, paths):
+        for path in paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+            try:
+                # Don't pass the lock on to processes started by handlers
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                os.close(fd)
+                if e.errno not in {errno.EAGAIN, errno.EACCES}:
+                    raise
+                continue
+            return fd
+        return None
+
+    def acquire(self, on_queue_change=None):
+        """Wait for the request's turn, return None if it's rejected.
+
+        Otherwise, the slot that has to be passed to release() is returned.
+        Queued requests check for a free slot every LIMIT_POLL_INTERVAL
+        seconds.
+        """
+        slot = self._lock_any(self._slots)
+        if slot is not None:
+            return slot
+        queue_slot = self._lock_any(self._queue_slots)
+        if queue_slot is None:
+            return None
+
+        if on_queue_change:
+            on_queue_change(1)
+        try:
+            deadline = time.time() + self.timeout
+            while True:
+                slot = self._lock_any(self._slots)
+                if slot is not None or time.time() >= deadline:
+                    return slot
+                time.sleep(LIMIT_POLL_INTERVAL)
+        finally:
+            os.close(queue_slot)
+            if on_queue_change:
+                on_queue_change(-1)
+
+    def release(self, slot):
+        os.close(slot)
+
+
+class _LimitedResponse(object):
+    def __init__(self, result, limit, slot):
+        self._result = result
+        self._limit = limit
+        self._slot = slot
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        try:
+            if hasattr(self._result, 'close'):
+                self._result.close()
+        finally:
+            self._limit.release(self._slot)
+
+
+def _call_limited(handler, limit, url, environ, start_response):
+    # The metrics middleware records the queue, if it's installed
+    metrics = environ.get('sitescripts.metrics')
+
+    def on_queue_change(delta):
+        if metrics:
+            metrics.record_queue_change(url, delta)
+
+    start_time = time.time()
+    slot = limit.acquire(on_queue_change)
+    environ['sitescripts.queue_wait'] = time.time() - start_time
+    if slot is None:
+        retry_after = max(1, int(math.ceil(limit.timeout)))
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'text/plain'),
+            ('Retry-After', str(retry_after)),
+        ])
+        return ['Service Unavailable']
+
+    try:
+        result = handler(environ, start_response)
+    except Exception:
+        limit.release(slot)
+        raise
+    return _LimitedResponse(result, limit, slot)
+
+
+def multiplex(environ, start_response):
+    url = handler = None
+    if 'PATH_INFO' in environ:
+        url, handler = find_handler(environ['PATH_INFO'])
+    if handler is None:
         start_response('404 Not Found', [('Content-Type', 'text/plain')])
         return ['Not Found']
 
+    # The URL the handler is registered for, e.g. for per-handler metrics
+    environ['sitescripts.handler_url'] = url
+    if url in limits:
+        return _call_limited(handler, limits[url], url, environ,
+                             start_response)
     return handler(environ, start_response)
 
 
-for module in set(get_config().options('multiplexer')) - set(get_config().defaults()):
-    module_path = get_config().get('multiplexer', module)
-    if module_path:
-        imp.load_source(module, module_path)
-    else:
-        importlib.import_module(module)
+def load_limit_config():
+    """Set up the concurrency limits of the multiplexer_limits section.
+
+    Each option maps a URL, as handlers are registered for it, to the
+    number of concurrent requests, and optionally the number of requests
+    that can wait and the seconds they wait, e.g. `/submitReport=4,8,5`.
+    If the `directory` option is set, the limits apply to all processes
+    that use this directory, otherwise to each process on its own.
+    """
+    config = get_config()
+    if not config.has_section('multiplexer_limits'):
+        return
+    directory = None
+    if config.has_option('multiplexer_limits', 'directory'):
+        directory = config.get('multiplexer_limits', 'directory')
+    for url in set(config.options('multiplexer_limits')) - \
+            set(config.defaults()):
+        if not url.startswith('/'):
+            continue
+        values = config.get('multiplexer_limits', url).split(',')
+        concurrency = int(values[0])
+        queue_size = int(values[1]) if len(values) > 1 else 0
+        timeout = float(values[2]) if len(values) > 2 else 0
+        if directory:
+            limits[url] = SharedConcurrencyLimit(directory, url, concurrency,
+                                                 queue_size, timeout)
+        else:
+            limits[url] = ConcurrencyLimit(concurrency, queue_size, timeout)
+
+
+def load_handler_config():
+    """Import the modules listed in the multiplexer configuration.
+
+    Modules with URLs in the `multiplexer_urls` section aren't imported
+    here, but when the first request for one of these URLs comes in.
+    """
+    config = get_config()
+    defaults = set(config.defaults())
+    modules = set(config.options('multiplexer')) - defaults
+
+    if config.has_section('multiplexer_urls'):
+        for url in set(config.options('multiplexer_urls')) - defaults:
+            module = config.get('multiplexer_urls', url)
+            if module in modules:
+                lazy_handlers[url] = module
+
+    for module in modules - set(lazy_handlers.itervalues()):
+        load_handler_module(module)
+
+    load_limit_config()
+
+
+load_handler_config()
@@ -0,0 +1,118 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import subprocess
+
+import mock
+import pytest
+
+from sitescripts import hgarchive
+
+
+def _commit(repo, files):
+    for name, content in files.items():
+        repo.join(name).write(content, ensure=True)
+    subprocess.check_call(['hg', 'commit', '-q', '-A', '-m', 'commit',
+                           '-u', 'test'], cwd=repo.strpath)
+    return subprocess.check_output(['hg', 'log', '-r', '.', '--template',
+                                    '{node}'], cwd=repo.strpath)
+
+
+@pytest.fixture
+def repo(tmpdir):
+    repo = tmpdir.join('repo')
+    repo.ensure(dir=True)
+    subprocess.check_call(['hg', 'init'], cwd=repo.strpath)
+    return repo
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir):
+    cache_dir = tmpdir.join('cache')
+    with mock.patch.object(hgarchive, 'get_cache_dir',
+                           return_value=cache_dir.strpath), \
+            mock.patch.object(hgarchive, '_resolved', {}):
+        yield cache_dir
+
+
+def test_archive(repo):
+    node = _commit(repo, {'a': 'a', 'dir/b': 'b'})
+    archive = hgarchive.get_archive(repo.strpath)
+
+    assert archive.node == node
+    assert archive.list_files() == ['a', 'dir/b']
+    assert archive.read('dir/b') == 'b'
+    assert archive.exists('a')
+    assert not archive.exists('c')
+
+
+def test_resolve_cached(repo):
+    node = _commit(repo, {'a': 'a'})
+    assert hgarchive.resolve(repo.strpath) == node
+
+    with mock.patch('subprocess.check_output') as check_output:
+        assert hgarchive.resolve(repo.strpath) == node
+        # Remembered on disk too, e.g. for the next cron run
+        hgarchive._resolved.clear()
+        assert hgarchive.resolve(repo.strpath) == node
+    assert not check_output.called
+
+
+def test_resolve_after_commit(repo):
+    _commit(repo, {'a': 'a'})
+    hgarchive.get_archive(repo.strpath)
+    node = _commit(repo, {'a': 'b'})
+
+    archive = hgarchive.get_archive(repo.strpath)
+    assert archive.node == node
+    assert archive.read('a') == 'b'
+
+
+def test_old_revisions_pruned(repo):
+    nodes = []
+    for i in range(hgarchive.KEEP_REVISIONS + 2):
+        nodes.append(_commit(repo, {'a': str(i)}))
+        hgarchive.get_archive(repo.strpath)
+
+    repo_cache_dir = hgarchive._get_repo_cache_dir(repo.strpath)
+    trees = [name for name in os.listdir(repo_cache_dir)
+             if os.path.isdir(os.path.join(repo_cache_dir, name))]
+    assert sorted(trees) == sorted(nodes[-hgarchive.KEEP_REVISIONS:])
+
+
+def test_pruned_tree_extracted_again(repo):
+    _commit(repo, {'a': 'a'})
+    archive = hgarchive.get_archive(repo.strpath)
+    shutil.rmtree(archive.path)
+    assert hgarchive.get_archive(repo.strpath).read('a') == 'a'
+
+
+def test_private_cache_dir(tmpdir):
+    path = tmpdir.join('private').strpath
+    assert hgarchive._get_private_dir(path) == path
+    assert os.stat(path).st_mode & 0777 == 0700
+    # Used again by the next process
+    assert hgarchive._get_private_dir(path) == path
+
+    os.chmod(path, 0777)
+    with pytest.raises(hgarchive.CacheDirectoryError):
+        hgarchive._get_private_dir(path)
+
+    os.symlink(tmpdir.mkdir('other').strpath, tmpdir.join('link').strpath)
+    os.chmod(tmpdir.join('other').strpath, 0700)
+    with pytest.raises(hgarchive.CacheDirectoryError):
+        hgarchive._get_private_dir(tmpdir.join('link').strpath)
@@ -0,0 +1,82 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import subprocess
+
+import mock
+import pytest
+
+from sitescripts import hgclient
+
+
+@pytest.fixture
+def repo(tmpdir):
+    subprocess.check_call(['hg', 'init'], cwd=tmpdir.strpath)
+    tmpdir.join('metadata').write('[general]\nbasename = test\n')
+    subprocess.check_call(['hg', 'commit', '-q', '-A', '-m', 'commit',
+                           '-u', 'test'], cwd=tmpdir.strpath)
+    yield tmpdir
+    hgclient.close(tmpdir.strpath)
+
+
+@pytest.fixture(autouse=True)
+def stats():
+    with mock.patch.object(hgclient, '_stats', {}):
+        yield hgclient._stats
+
+
+def test_check_output(repo):
+    assert hgclient.check_output(repo.strpath, ['locate', '-r', '0']) == \
+        'metadata\n'
+    assert hgclient.check_output(repo.strpath, ['cat', '-r', '0',
+                                                'metadata']) == \
+        repo.join('metadata').read()
+
+
+def test_server_reused(repo):
+    hgclient.check_output(repo.strpath, ['id', '-n'])
+    with mock.patch.object(hgclient, 'CommandServer') as command_server:
+        hgclient.check_output(repo.strpath, ['id', '-n'])
+    assert not command_server.called
+
+
+def test_sees_new_commits(repo):
+    hgclient.check_output(repo.strpath, ['id', '-n'])
+    repo.join('other').write('other')
+    subprocess.check_call(['hg', 'commit', '-q', '-A', '-m', 'commit',
+                           '-u', 'test'], cwd=repo.strpath)
+    assert hgclient.check_output(repo.strpath, ['locate', '-r', 'tip']) == \
+        'metadata\nother\n'
+
+
+def test_error(repo):
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        hgclient.check_output(repo.strpath, ['cat', '-r', '0', 'missing'])
+    assert excinfo.value.returncode == 1
+
+    # The server is still usable after a failed command
+    assert hgclient.check_output(repo.strpath, ['id', '-n']) == '0\n'
+
+
+def test_stats(repo):
+    hgclient.check_output(repo.strpath, ['id', '-n'])
+    hgclient.check_output(repo.strpath, ['id', '-i'])
+    hgclient.check_output(repo.strpath, ['locate'])
+
+    stats = hgclient.get_stats()
+    assert sorted(stats) == ['id', 'locate']
+    assert stats['id']['count'] == 2
+    assert stats['locate']['count'] == 1
+    assert stats['id']['time'] > 0
@@ -0,0 +1,135 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib2
+
+import pytest
+
+import sitescripts
+
+SERVER_SCRIPT = '''
+import os
+import sys
+
+from sitescripts.prefork import PreforkServer
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid())]
+
+
+PreforkServer(app, ('127.0.0.1', int(sys.argv[1])), workers=2,
+              max_requests=2).serve_forever()
+'''
+
+
+def _get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def server(tmpdir):
+    script = tmpdir.join('server.py')
+    script.write(SERVER_SCRIPT)
+    port = _get_free_port()
+    root = os.path.dirname(os.path.dirname(sitescripts.__file__))
+    process = subprocess.Popen(
+        [sys.executable, script.strpath, str(port)],
+        env=dict(os.environ, PYTHONPATH=root),
+    )
+    url = 'http://127.0.0.1:{}/'.format(port)
+
+    for i in range(100):
+        try:
+            urllib2.urlopen(url).read()
+            break
+        except urllib2.URLError:
+            time.sleep(0.1)
+
+    yield process, url
+    if process.poll() is None:
+        # Let the master stop its workers, rather than leaving them behind
+        process.terminate()
+        process.wait()
+
+
+def _get_pids(url, count):
+    return {urllib2.urlopen(url).read() for i in range(count)}
+
+
+def _wait_for_exit(pids):
+    for i in range(100):
+        pids = [pid for pid in pids if _is_running(pid)]
+        if not pids:
+            return
+        time.sleep(0.1)
+    raise AssertionError('Processes {} are still running'.format(pids))
+
+
+def _is_running(pid):
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except OSError:
+        return False
+
+
+def _get_worker_pids(process):
+    output = subprocess.check_output(['ps', '-o', 'pid=', '--ppid',
+                                      str(process.pid)])
+    return output.split()
+
+
+def test_replacing_killed_workers(server):
+    process, url = server
+    pids = _get_worker_pids(process)
+    assert len(pids) == 2
+
+    # The master doesn't wait for a timeout to replace the workers
+    start_time = time.time()
+    for pid in pids:
+        os.kill(int(pid), signal.SIGKILL)
+    assert _get_pids(url, 1) - set(pids)
+    assert time.time() - start_time < 0.5
+
+
+def test_recycling_and_reload(server):
+    process, url = server
+    pids = _get_pids(url, 8)
+    # Two workers with two requests each are replaced at least twice
+    assert len(pids) >= 4
+    assert str(process.pid) not in pids
+
+    # Workers that are still running might handle a request before they
+    # are told to exit
+    process.send_signal(signal.SIGHUP)
+    _wait_for_exit(pids)
+    new_pids = _get_pids(url, 8)
+    assert not pids & new_pids
+    assert process.poll() is None
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait() == 0
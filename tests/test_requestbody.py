@@ -0,0 +1,138 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import urlparse
+from StringIO import StringIO
+
+import pytest
+
+from sitescripts import requestbody
+from sitescripts.requestbody import (RequestBodyError, iter_multipart,
+                                     iter_urlencoded, spool_body)
+
+MULTIPART_BODY = '\r\n'.join([
+    'preamble',
+    '--xyz',
+    'Content-Disposition: form-data; name="file"; filename="a.txt"',
+    'Content-Type: text/plain',
+    '',
+    'line 1',
+    'line 2\r\n--xyzw',
+    '--xyz',
+    'Content-Disposition: form-data; name="field"',
+    '',
+    'value',
+    '--xyz--',
+    'epilogue',
+])
+
+
+def _environ(body, content_type='application/x-www-form-urlencoded',
+             content_length=None):
+    if content_length is None:
+        content_length = str(len(body))
+    return {
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': content_length,
+        'wsgi.input': StringIO(body),
+    }
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(requestbody, 'CHUNK_SIZE', 3)
+
+
+def test_urlencoded(small_chunks):
+    body = 'a=1&b=x+y%26z&empty=&c=%C3%A4&a=2'
+    fields = list(iter_urlencoded(_environ(body)))
+    assert fields == [('a', '1'), ('b', 'x y&z'), ('c', '\xc3\xa4'),
+                      ('a', '2')]
+    assert ('empty', '') in iter_urlencoded(_environ(body),
+                                            keep_blank_values=True)
+
+
+@pytest.mark.parametrize('keep_blank_values', [False, True])
+def test_urlencoded_like_parse_qsl(small_chunks, keep_blank_values):
+    body = 'a=1;b=2&&c=;;d&e=x%3By&'
+    fields = list(iter_urlencoded(_environ(body), None, keep_blank_values))
+    assert fields[:2] == [('a', '1'), ('b', '2')]
+    assert fields == urlparse.parse_qsl(body, keep_blank_values)
+
+
+@pytest.mark.parametrize('content_length,max_size,status', [
+    (None, 100, 411),
+    ('-1', 100, 411),
+    ('foo', 100, 411),
+    ('11', 10, 413),
+    ('20', 100, 400),
+])
+def test_invalid_body(content_length, max_size, status):
+    environ = _environ('a=123456789', content_length=content_length)
+    if content_length is None:
+        del environ['CONTENT_LENGTH']
+    with pytest.raises(RequestBodyError) as error:
+        list(iter_urlencoded(environ, max_size))
+    assert error.value.status == status
+
+
+def test_body_is_not_read_beyond_content_length():
+    environ = _environ('a=1&b=2', content_length='3')
+    assert list(iter_urlencoded(environ)) == [('a', '1')]
+    assert environ['wsgi.input'].read() == '&b=2'
+
+
+def test_spool_body(monkeypatch):
+    monkeypatch.setattr(requestbody, 'SPOOL_SIZE', 10)
+    body = 'x' * 100
+    with spool_body(_environ(body)) as file:
+        assert file._rolled
+        assert file.read() == body
+
+
+def test_multipart(small_chunks):
+    environ = _environ(MULTIPART_BODY, 'multipart/form-data; boundary=xyz')
+    parts = []
+    for part in iter_multipart(environ):
+        parts.append((part.name, part.filename,
+                      part.headers.get('content-type'),
+                      list(part.iter_lines())))
+    assert parts == [
+        ('file', 'a.txt', 'text/plain', ['line 1\r\n', 'line 2\r\n',
+                                         '--xyzw']),
+        ('field', None, None, ['value']),
+    ]
+
+
+def test_multipart_skips_unread_parts():
+    environ = _environ(MULTIPART_BODY, 'multipart/form-data; boundary=xyz')
+    parts = iter_multipart(environ)
+    next(parts)
+    assert next(parts).read() == 'value'
+
+
+@pytest.mark.parametrize('body,content_type,status', [
+    (MULTIPART_BODY, 'text/plain', 415),
+    (MULTIPART_BODY, 'multipart/form-data', 400),
+    (MULTIPART_BODY.split('value')[0], 'multipart/form-data; boundary=xyz',
+     400),
+    ('--xyz\r\nfoo\r\n\r\n--xyz--', 'multipart/form-data; boundary=xyz',
+     400),
+])
+def test_invalid_multipart(body, content_type, status):
+    with pytest.raises(RequestBodyError) as error:
+        for part in iter_multipart(_environ(body, content_type)):
+            part.drain()
+    assert error.value.status == status
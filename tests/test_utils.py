@@ -13,9 +13,23 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+import time
+from ConfigParser import InterpolationError, NoOptionError, NoSectionError
+
 import pytest
 
-from sitescripts.utils import get_template
+from sitescripts import utils
+from sitescripts.utils import cached, get_config, get_template
+
+CONFIG = '''[DEFAULT]
+root=/root
+[section]
+path=%(root)s/path
+count=3
+enabled=yes
+broken=%(missing)s
+'''
 
 
 def test_get_template_default_path():
@@ -36,3 +50,139 @@ def test_get_template(tmpdir, mode):
         template = get_template('template.tmpl', template_path=tmpdir.strpath)
 
     assert template.render({'value': 1}) == 'value = 1'
+
+
+@pytest.fixture
+def config_path(tmpdir, monkeypatch):
+    path = tmpdir.join('sitescripts.ini')
+    path.write(CONFIG)
+    monkeypatch.setenv('SITESCRIPTS_CONFIG', path.strpath)
+    monkeypatch.setitem(utils._config_state, 'config', None)
+    return path
+
+
+def test_config_snapshot(config_path):
+    config = get_config()
+    assert config.sections() == ['section']
+    assert config.get('section', 'path') == '/root/path'
+    assert config.get('section', 'path', raw=True) == '%(root)s/path'
+    assert config.get('DEFAULT', 'root') == '/root'
+    assert config.defaults() == {'root': '/root'}
+    assert config.has_option('section', 'root')
+    assert not config.has_option('other', 'root')
+    assert config.getint('section', 'count') == 3
+    assert config.getboolean('section', 'enabled')
+    assert config.getfloat('section', 'timeout', 0.5) == 0.5
+    assert config.get_section('DEFAULT') == {'root': '/root'}
+
+    with pytest.raises(NoSectionError):
+        config.get('other', 'root')
+    with pytest.raises(NoOptionError):
+        config.getint('section', 'missing')
+    with pytest.raises(InterpolationError):
+        config.items('section')
+
+
+def test_config_changes(config_path, monkeypatch):
+    config = get_config()
+    assert get_config() is config
+
+    config_path.write(CONFIG.replace('count=3', 'count=4'))
+    assert get_config() is config
+    monkeypatch.setattr(utils, 'CONFIG_CHECK_INTERVAL', 0)
+    assert get_config().getint('section', 'count') == 4
+    assert get_config() is get_config()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils, 'time', lambda: now[0])
+    return now
+
+
+def test_cached_expiry_and_eviction(clock):
+    calls = []
+
+    @cached(10, max_size=2)
+    def func(value, suffix=''):
+        calls.append(value)
+        return value + suffix
+
+    assert func('a') == 'a'
+    assert func('a') == 'a'
+    assert func('a', suffix='!') == 'a!'
+    assert calls == ['a', 'a']
+
+    clock[0] += 11
+    assert func('a') == 'a'
+    assert calls == ['a', 'a', 'a']
+
+    # ('a', '!') is the least recently used entry
+    func('b')
+    func('a')
+    func('a', suffix='!')
+    assert calls == ['a', 'a', 'a', 'b', 'a']
+    assert func.cache.get_stats() == {'hits': 2, 'misses': 5,
+                                      'evictions': 2, 'size': 2}
+
+
+def test_cached_single_flight():
+    calls = []
+    started = threading.Event()
+    finish = threading.Event()
+
+    @cached(10)
+    def func():
+        calls.append(None)
+        started.set()
+        finish.wait()
+        return len(calls)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(func()))
+               for i in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    finish.set()
+    for thread in threads:
+        thread.join()
+    assert results == [1] * 5
+    assert len(calls) == 1
+
+
+def test_cached_failure_is_not_cached():
+    results = [ValueError(), 'result']
+
+    @cached(10)
+    def func():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with pytest.raises(ValueError):
+        func()
+    assert func() == 'result'
+
+
+def test_cached_stale_while_revalidate(clock):
+    values = iter(['old', 'new'])
+    refreshed = threading.Event()
+
+    @cached(10, stale_while_revalidate=5)
+    def func():
+        value = next(values)
+        if value == 'new':
+            refreshed.set()
+        return value
+
+    assert func() == 'old'
+    clock[0] += 12
+    assert func() == 'old'
+    refreshed.wait(5)
+    while func.cache._flights:
+        time.sleep(0.01)
+    assert func() == 'new'
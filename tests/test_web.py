@@ -0,0 +1,350 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import io
+import os
+import sys
+import threading
+import time
+from ConfigParser import SafeConfigParser
+
+import pytest
+
+from sitescripts import web
+from sitescripts.utils import write_compressed_copy
+
+HANDLER_MODULE = '''
+from sitescripts.web import url_handler
+
+
+@url_handler('/{name}')
+def handler(environ, start_response):
+    start_response('200 OK', [])
+    return ['{name}']
+
+
+@url_handler('/{name}/')
+def directory_handler(environ, start_response):
+    start_response('200 OK', [])
+    return ['{name} directory']
+'''
+
+
+@pytest.fixture
+def config(tmpdir, mocker):
+    config = SafeConfigParser()
+    config.optionxform = lambda x: x
+    config.add_section('multiplexer')
+    config.add_section('multiplexer_urls')
+    for name in ['eager', 'lazy']:
+        path = tmpdir.join(name + '.py')
+        path.write(HANDLER_MODULE.format(name=name))
+        config.set('multiplexer', 'test_' + name, path.strpath)
+    config.set('multiplexer_urls', '/lazy', 'test_lazy')
+    config.set('multiplexer_urls', '/lazy/', 'test_lazy')
+    config.add_section('multiplexer_limits')
+    config.set('multiplexer_limits', '/eager', '1,1,5')
+    config.set('multiplexer_limits', '/lazy/', '2')
+
+    mocker.patch.object(web, 'get_config', lambda: config)
+    mocker.patch.dict(web.handlers, clear=True)
+    mocker.patch.dict(web.lazy_handlers, clear=True)
+    mocker.patch.dict(web.import_times, clear=True)
+    mocker.patch.dict(web.limits, clear=True)
+    mocker.patch.dict(sys.modules)
+    web.load_handler_config()
+    return config
+
+
+def _request(path):
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = status
+
+    result = web.multiplex({'PATH_INFO': path}, start_response)
+    body = ''.join(result)
+    if hasattr(result, 'close'):
+        result.close()
+    return response['status'], body
+
+
+def test_lazy_loading(config):
+    assert sorted(web.import_times) == ['test_eager']
+    assert sorted(web.handlers) == ['/eager', '/eager/']
+
+    assert _request('/lazy/foo') == ('200 OK', 'lazy directory')
+    assert sorted(web.import_times) == ['test_eager', 'test_lazy']
+    assert _request('/lazy') == ('200 OK', 'lazy')
+    assert _request('/eager') == ('200 OK', 'eager')
+
+
+def test_not_found(config):
+    assert _request('/unknown')[0] == '404 Not Found'
+    assert _request('/eager/foo/bar')[0] == '404 Not Found'
+    assert web.multiplex({}, lambda status, headers: None) == ['Not Found']
+    assert sorted(web.import_times) == ['test_eager']
+
+
+def test_concurrency_limits(config):
+    assert web.limits['/eager'].concurrency == 1
+    assert web.limits['/eager'].queue_size == 1
+    assert web.limits['/eager'].timeout == 5
+    assert web.limits['/lazy/'].queue_size == 0
+
+    started = threading.Event()
+    finish = threading.Event()
+
+    def handler(environ, start_response):
+        started.set()
+        finish.wait()
+        start_response('200 OK', [])
+        return ['done']
+
+    web.handlers['/eager'] = handler
+    statuses = []
+    threads = [threading.Thread(target=lambda: statuses.append(
+        _request('/eager')[0],
+    )) for i in range(2)]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    while web.limits['/eager'].queued == 0:
+        time.sleep(0.01)
+
+    # The queue is full
+    responses = []
+    web.multiplex({'PATH_INFO': '/eager'},
+                  lambda status, headers: responses.append((status, headers)))
+    assert responses == [('503 Service Unavailable', [
+        ('Content-Type', 'text/plain'), ('Retry-After', '5'),
+    ])]
+
+    finish.set()
+    for thread in threads:
+        thread.join()
+    assert statuses == ['200 OK', '200 OK']
+    assert web.limits['/eager'].active == 0
+    assert web.limits['/eager'].queued == 0
+
+
+def test_concurrency_limit_timeout():
+    limit = web.ConcurrencyLimit(1, 1, 0.1)
+    changes = []
+    assert limit.acquire(changes.append)
+    assert not limit.acquire(changes.append)
+    assert changes == [1, -1]
+    limit.release()
+    assert limit.acquire()
+
+
+def test_shared_concurrency_limit(tmpdir):
+    # Each instance opens its own lock files, as separate processes would
+    directory = tmpdir.join('limits').strpath
+    limit = web.SharedConcurrencyLimit(directory, '/eager', 1, 1, 5)
+    other = web.SharedConcurrencyLimit(directory, '/eager', 1, 1, 0.1)
+    unrelated = web.SharedConcurrencyLimit(directory, '/lazy', 1)
+
+    slot = limit.acquire()
+    assert slot is not None
+    unrelated.release(unrelated.acquire())
+    changes = []
+    assert other.acquire(changes.append) is None
+    assert changes == [1, -1]
+
+    # A queued request gets the slot once it's released
+    slots = []
+    thread = threading.Thread(target=lambda: slots.append(limit.acquire(
+        changes.append,
+    )))
+    thread.start()
+    while len(changes) < 3:
+        time.sleep(0.01)
+    # The queue is full
+    assert other.acquire() is None
+    limit.release(slot)
+    thread.join()
+    assert slots[0] is not None
+    assert changes == [1, -1, 1, -1]
+    limit.release(slots[0])
+    other.release(other.acquire())
+
+
+def test_shared_limit_config(config, tmpdir):
+    config.set('multiplexer_limits', 'directory',
+               tmpdir.join('limits').strpath)
+    web.load_limit_config()
+    assert isinstance(web.limits['/eager'], web.SharedConcurrencyLimit)
+    assert web.limits['/eager'].queue_size == 1
+    assert sorted(web.limits) == ['/eager', '/lazy/']
+    assert _request('/eager') == ('200 OK', 'eager')
+
+
+def _conditional_request(handler, **environ):
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    body = ''.join(handler(environ, start_response))
+    return response['status'], response['headers'], body
+
+
+def test_conditional_get():
+    calls = []
+    versions = ['1']
+
+    @web.conditional_get(lambda environ: versions[-1], 'max-age=60')
+    def handler(environ, start_response):
+        calls.append(environ)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['version %s' % versions[-1]]
+
+    status, headers, body = _conditional_request(handler)
+    assert (status, body) == ('200 OK', 'version 1')
+    assert headers['Cache-Control'] == 'max-age=60'
+    etag = headers['ETag']
+    last_modified = headers['Last-Modified']
+    assert etag.startswith('"')
+
+    for conditions in [{'HTTP_IF_NONE_MATCH': etag},
+                       {'HTTP_IF_NONE_MATCH': '"foo", W/' + etag},
+                       {'HTTP_IF_MODIFIED_SINCE': last_modified}]:
+        status, headers, body = _conditional_request(handler, **conditions)
+        assert (status, body) == ('304 Not Modified', '')
+        assert headers['ETag'] == etag
+    assert len(calls) == 1
+
+    # If-None-Match takes precedence over If-Modified-Since
+    status, headers, body = _conditional_request(
+        handler, HTTP_IF_NONE_MATCH='"foo"',
+        HTTP_IF_MODIFIED_SINCE=last_modified,
+    )
+    assert status == '200 OK'
+
+    versions.append('2')
+    status, headers, body = _conditional_request(handler,
+                                                 HTTP_IF_NONE_MATCH=etag)
+    assert (status, body) == ('200 OK', 'version 2')
+    assert headers['ETag'] != etag
+
+    status, headers, body = _conditional_request(handler,
+                                                 REQUEST_METHOD='POST',
+                                                 HTTP_IF_NONE_MATCH=etag)
+    assert 'ETag' not in headers
+
+    versions.append(None)
+    status, headers, body = _conditional_request(handler,
+                                                 HTTP_IF_NONE_MATCH='*')
+    assert status == '200 OK'
+    assert 'ETag' not in headers
+    assert len(calls) == 5
+
+
+@pytest.mark.parametrize('accept_encoding,expected', [
+    ('gzip, deflate', True),
+    ('deflate;q=1.0, gzip;q=0.5', True),
+    ('x-gzip', True),
+    ('*', True),
+    ('gzip;q=0, *', False),
+    ('identity', False),
+    ('', False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    environ = {'HTTP_ACCEPT_ENCODING': accept_encoding}
+    assert web.accepts_gzip(environ) == expected
+
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+def test_compress_response(mocker):
+    body = 'x' * 2000
+    bodies = [body, body, body, 'small']
+    compress = mocker.spy(web, '_gzip')
+
+    @web.compress_response(min_size=1000)
+    @web.conditional_get(lambda environ: 1)
+    def handler(environ, start_response):
+        start_response('200 OK', [('Content-Length', '2000')])
+        return [bodies.pop(0)]
+
+    status, headers, identity = _conditional_request(handler)
+    assert identity == body
+    assert 'Content-Encoding' not in headers
+    assert headers['Vary'] == 'Accept-Encoding'
+    etag = headers['ETag']
+
+    status, headers, compressed = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert _gunzip(compressed) == body
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Content-Length'] == str(len(compressed))
+    assert headers['ETag'] == etag[:-1] + '-gzip"'
+
+    # The response was revalidated, with the ETag of the compressed body
+    status, headers, empty = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+        HTTP_IF_NONE_MATCH=headers['ETag'],
+    )
+    assert (status, empty) == ('304 Not Modified', '')
+    assert headers['ETag'] == etag[:-1] + '-gzip"'
+
+    status, headers, compressed = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert compress.call_count == 1
+
+    status, headers, small = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert small == 'small'
+    assert 'Content-Encoding' not in headers
+
+
+def test_send_file(tmpdir):
+    path = tmpdir.join('digest.html')
+    path.write('<html></html>')
+
+    def handler(environ, start_response):
+        return web.send_file(environ, start_response, path.strpath,
+                             [('Content-Type', 'text/html')])
+
+    status, headers, body = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert body == '<html></html>'
+    assert 'Content-Encoding' not in headers
+
+    write_compressed_copy(path.strpath)
+    status, headers, body = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert _gunzip(body) == '<html></html>'
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Content-Length'] == str(len(body))
+    assert _conditional_request(handler)[2] == '<html></html>'
+
+    # Outdated compressed copies aren't used
+    mtime = os.path.getmtime(path.strpath)
+    os.utime(path.strpath + '.gz', (mtime - 10, mtime - 10))
+    status, headers, body = _conditional_request(
+        handler, HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert body == '<html></html>'